@@ -0,0 +1,222 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from Scripts.trials import label_frames
+
+# frame states of a rasterized manual annotation
+OFF, ON, UNSCORED = 0, 1, -1
+
+# Datavyu column separator of each annotator's verbose export, and the look
+# directions they code. AW codes every look of a trial as on (y) or off (n),
+# GS only codes the off looks, so the rest of a trial is on. Looks coded e
+# are parts of the video that could not be scored.
+ANNOTATORS = {
+    'AW': {'separator': '_', 'directions': {'y': ON, 'n': OFF, 'e': UNSCORED}, 'default': UNSCORED},
+    'GS': {'separator': '.', 'directions': {'off': OFF, 'e': UNSCORED}, 'default': ON},
+}
+
+# trial types that are compared, fam and test
+TRIAL_TYPES = ['f', 't']
+
+
+def read_manual_looks(manual_path):
+    """
+    Reads the trials and looks of one hand annotated file, named
+    MCS_[CHILD_ID]_[SESSION]_verbose_[ANNOTATOR].csv
+
+    manual_path (string): path to the Datavyu verbose .csv
+    rtype: Tuple[string, np.ndarray, np.ndarray, np.ndarray, int], child ID,
+            fam/test trial [onset, offset] pairs in ms, look [onset, offset]
+            pairs in ms, the state (ON, OFF or UNSCORED) of each look and the
+            state of trial time outside any coded look
+    """
+    file_split = os.path.basename(manual_path).replace('.csv', '').split('_')
+    child_id, annotator = file_split[1], file_split[-1]
+    coding = ANNOTATORS[annotator]
+    sep = coding['separator']
+
+    df = pd.read_csv(manual_path)
+
+    trials = df[df['Trials' + sep + 'x'].isin(TRIAL_TYPES)]
+    trials = trials[['Trials' + sep + 'onset', 'Trials' + sep + 'offset']].drop_duplicates()
+    trial_sets = trials.to_numpy(dtype=np.int64).reshape(-1, 2)
+
+    looks = df[df['Looks' + sep + 'direction'].isin(list(coding['directions']))]
+    look_sets = looks[['Looks' + sep + 'onset', 'Looks' + sep + 'offset']].to_numpy(dtype=np.int64).reshape(-1, 2)
+    states = looks['Looks' + sep + 'direction'].map(coding['directions']).to_numpy(dtype=np.int8)
+
+    return child_id, trial_sets, look_sets, states, coding['default']
+
+
+def rasterize(time_ms, trial_sets, look_sets, states, default):
+    """
+    Gives every frame the manual state at its time stamp: the state of the
+    look it falls in, default for other frames within a trial and
+    UNSCORED outside trials
+
+    time_ms (array-like of int): time stamp of each frame in ms
+    trial_sets (array-like): trial [onset, offset] pairs in ms
+    look_sets (array-like): look [onset, offset] pairs in ms
+    states (array-like of int): state of each look
+    default (int): state of trial time no look covers
+    rtype: Tuple[np.ndarray, np.ndarray], state of each frame (int8) and
+            the 1-based trial of each frame, 0 outside trials
+    """
+    time_ms = np.asarray(time_ms)
+    trial = label_frames(time_ms, trial_sets)
+    look = label_frames(time_ms, look_sets)
+
+    # index 0 is frames outside every look
+    lookup = np.concatenate([[default], np.asarray(states, dtype=np.int8)]).astype(np.int8)
+    frame_states = lookup[look]
+    frame_states[trial == 0] = UNSCORED
+    return frame_states, trial
+
+
+def child_agreement(on, time_ms, manual_path):
+    """
+    Compares iCatcher's on/off label of every frame of one child with the
+    manual annotation in manual_path, over the frames the annotator scored
+
+    on (array-like of bool): whether iCatcher labeled each frame on
+    time_ms (array-like of int): time stamp of each frame in ms
+    manual_path (string): path to the child's Datavyu verbose .csv
+    rtype: Tuple[np.ndarray, DataFrame], 2x2 confusion counts of scored
+            frames ([manual off/on][icatcher off/on]) and one row per trial
+            with the manual and iCatcher on time in ms
+    """
+    on = np.asarray(on, dtype=bool)
+    time_ms = np.asarray(time_ms, dtype=np.int64)
+    _, trial_sets, look_sets, states, default = read_manual_looks(manual_path)
+    manual, trial = rasterize(time_ms, trial_sets, look_sets, states, default)
+
+    scored = manual != UNSCORED
+    # both labels of a scored frame as one index, 2 * manual + icatcher
+    pairs = 2 * manual[scored] + on[scored]
+    confusion = np.bincount(pairs, minlength=4).reshape(2, 2)
+
+    # each frame lasts until the next one, the last one lasts 0 ms
+    duration = np.diff(time_ms, append=time_ms[-1:]) if len(time_ms) else time_ms
+    num_trials = len(trial_sets)
+    weights = np.where(scored, duration, 0)
+    trials = pd.DataFrame({
+        'trial_num': np.arange(1, num_trials + 1),
+        'scored_ms': np.bincount(trial, weights, minlength=num_trials + 1)[1:],
+        'manual_on_ms': np.bincount(trial, weights * (manual == ON), minlength=num_trials + 1)[1:],
+        'icatcher_on_ms': np.bincount(trial, weights * on, minlength=num_trials + 1)[1:],
+    })
+    return confusion, trials
+
+
+def accuracy_kappa(confusion):
+    """
+    Frame accuracy and Cohen's kappa of confusion counts, for one 2x2 table
+    or a stack of them (..., 2, 2)
+
+    rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    total = confusion.sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = (confusion[..., 0, 0] + confusion[..., 1, 1]) / total
+        manual_on = confusion[..., 1, :].sum(axis=-1) / total
+        icatcher_on = confusion[..., :, 1].sum(axis=-1) / total
+        chance = manual_on * icatcher_on + (1 - manual_on) * (1 - icatcher_on)
+        kappa = (observed - chance) / (1 - chance)
+    return observed, kappa
+
+
+def _correlation(sums):
+    """
+    Pearson r from sums of n, x, y, xx, yy and xy along the last axis
+    """
+    n, x, y, xx, yy, xy = np.moveaxis(np.asarray(sums, dtype=np.float64), -1, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = xy - x * y / n
+        return cov / np.sqrt((xx - x * x / n) * (yy - y * y / n))
+
+
+def _trial_sums(trials, children):
+    """
+    Per-child sums for the correlation of manual and iCatcher on time over
+    trials with any scored time
+
+    rtype: np.ndarray of shape (children, 6)
+    """
+    trials = trials[trials['scored_ms'] > 0]
+    x = trials['manual_on_ms'].to_numpy(dtype=np.float64)
+    y = trials['icatcher_on_ms'].to_numpy(dtype=np.float64)
+    child = pd.Categorical(trials['child'], categories=children).codes
+
+    columns = [np.ones_like(x), x, y, x * x, y * y, x * y]
+    return np.stack([np.bincount(child, c, minlength=len(children)) for c in columns], axis=1)
+
+
+def cohort_agreement(confusions, trials, n_boot=1000, ci=0.95, seed=0):
+    """
+    Summarizes agreement over a cohort: frame accuracy and Cohen's kappa
+    over all scored frames pooled, and the correlation of manual and
+    iCatcher on time over all trials, each with a bootstrap confidence
+    interval from resampling children. All n_boot resamples are drawn
+    and scored at once from per-child counts and sums.
+
+    confusions (dict): child ID -> 2x2 confusion counts from child_agreement
+    trials (DataFrame): trial rows of every child from child_agreement,
+            with a child column
+    n_boot (int): number of bootstrap resamples
+    ci (float): width of the confidence intervals
+    seed (int): seed of the resampling
+    rtype: Tuple[DataFrame, DataFrame], one row per child with its accuracy,
+            kappa, trial correlation and scored frames, and one row per
+            statistic with the cohort value and interval bounds
+    """
+    children = list(confusions)
+    counts = np.stack([confusions[child] for child in children]) if children else np.zeros((0, 2, 2), dtype=int)
+    sums = _trial_sums(trials, children)
+
+    accuracy, kappa = accuracy_kappa(counts)
+    per_child = pd.DataFrame({'child': children, 'scored_frames': counts.sum(axis=(1, 2)),
+                              'accuracy': accuracy, 'kappa': kappa,
+                              'trials': sums[:, 0].astype(int), 'trial_r': _correlation(sums)})
+
+    rng = np.random.default_rng(seed)
+    resample = rng.integers(0, len(children), size=(n_boot, len(children))) if children else np.zeros((n_boot, 0), dtype=int)
+    boot_accuracy, boot_kappa = accuracy_kappa(counts[resample].sum(axis=1))
+    boot_r = _correlation(sums[resample].sum(axis=1))
+
+    accuracy, kappa = accuracy_kappa(counts.sum(axis=0))
+    r = _correlation(sums.sum(axis=0))
+    tails = [(1 - ci) / 2 * 100, (1 + ci) / 2 * 100]
+    summary = pd.DataFrame([[name, value, *_percentiles(boot, tails)]
+                            for name, value, boot in [('accuracy', accuracy, boot_accuracy),
+                                                      ('kappa', kappa, boot_kappa),
+                                                      ('trial_r', r, boot_r)]],
+                           columns=['statistic', 'value', 'ci_low', 'ci_high'])
+    return per_child, summary
+
+
+def _percentiles(values, tails):
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return [np.nan, np.nan]
+    return list(np.percentile(values, tails))
+
+
+def manual_files(manual_dir, manifest=None):
+    """
+    Maps each child ID to its hand annotated file in manual_dir, named
+    MCS_[CHILD_ID]_[SESSION]_verbose_[ANNOTATOR].csv
+
+    manifest (Manifest): index to take the files from instead of listing
+            manual_dir, if it has a 'manual' root
+    rtype: dict
+    """
+    if manifest is not None and 'manual' in manifest.roots:
+        return {entry['child']: entry['path'] for entry in manifest.entries('manual')}
+    files = {}
+    for name in sorted(os.listdir(manual_dir)):
+        if name.startswith('MCS_') and '_verbose_' in name and name.endswith('.csv'):
+            files[name.split('_')[1]] = os.path.join(manual_dir, name)
+    return files
@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+
+from Scripts.agreement import ON, rasterize
+
+# spacing of the uniform time grid signals are resampled onto, in ms
+GRID_MS = 10
+
+# largest shift searched for, in ms either way
+MAX_OFFSET_MS = 60000
+
+# peaks closer than this to the best one count as the same peak when
+# looking for the runner up
+PEAK_EXCLUSION_MS = 2000
+
+
+def resample(on, time_ms, grid_ms=GRID_MS):
+    """
+    Resamples per-frame on/off labels onto a uniform grid starting at 0 ms,
+    each grid point taking the label of the last frame at or before it
+
+    on (array-like of bool): whether each frame is an on look
+    time_ms (array-like of int): time stamp of each frame in ms
+    grid_ms (int): grid spacing in ms
+    rtype: np.ndarray of float, 1 for on and 0 for off
+    """
+    on = np.asarray(on, dtype=bool)
+    time_ms = np.asarray(time_ms, dtype=np.int64)
+    if len(time_ms) == 0:
+        return np.zeros(0)
+
+    grid = np.arange(0, time_ms[-1] + 1, grid_ms)
+    frame = np.clip(np.searchsorted(time_ms, grid, side='right') - 1, 0, None)
+    return on[frame].astype(np.float64)
+
+
+def trial_template(trial_sets, grid_ms=GRID_MS):
+    """
+    Expected looking signal of an experiment: on during trials and off
+    between them, on the same grid as resample
+
+    trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+            relative to the start of the experiment
+    rtype: np.ndarray of float
+    """
+    sets = np.asarray(trial_sets, dtype=np.int64).reshape(-1, 2)
+    if len(sets) == 0:
+        return np.zeros(0)
+
+    length = sets[:, 1].max() // grid_ms + 1
+    starts = np.clip(sets[:, 0] // grid_ms, 0, None)
+    ends = np.clip(sets[:, 1] // grid_ms + 1, 0, None)
+    # +1 at each onset and -1 after each offset, overlapping trials count once
+    steps = np.zeros(length + 1)
+    np.add.at(steps, starts, 1)
+    np.add.at(steps, ends, -1)
+    return (np.cumsum(steps[:-1]) > 0).astype(np.float64)
+
+
+def look_template(trial_sets, look_sets, states, default, grid_ms=GRID_MS):
+    """
+    Looking signal of a manual annotation (see Scripts/agreement.py) on the
+    same grid as resample, unscored time counting as off
+
+    rtype: np.ndarray of float
+    """
+    sets = np.asarray(trial_sets, dtype=np.int64).reshape(-1, 2)
+    if len(sets) == 0:
+        return np.zeros(0)
+    grid = np.arange(0, sets[:, 1].max() + 1, grid_ms)
+    frame_states, _ = rasterize(grid, trial_sets, look_sets, states, default)
+    return (frame_states == ON).astype(np.float64)
+
+
+def estimate_offset(signal, template, grid_ms=GRID_MS, max_offset_ms=MAX_OFFSET_MS):
+    """
+    Finds the shift of template that best lines it up with signal by FFT
+    cross-correlation, so the whole search is O(n log n) in the length of
+    the recording.
+
+    A positive offset means template time 0 is offset ms into the signal,
+    i.e. offset is what to add to template times to get signal times, the
+    same as an experiment_onset.txt value.
+
+    signal (np.ndarray): looking signal in video time, from resample
+    template (np.ndarray): expected signal, from trial_template or look_template
+    grid_ms (int): grid spacing of both signals in ms
+    max_offset_ms (int): largest shift searched for either way, or None
+            for every shift
+    rtype: Tuple[int, float, float], offset in ms, correlation coefficient
+            at that offset and a confidence between 0 and 1, how far the
+            best peak stands above the best one PEAK_EXCLUSION_MS or more
+            away from it
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    template = np.asarray(template, dtype=np.float64)
+    if len(signal) == 0 or len(template) == 0:
+        return 0, np.nan, 0.0
+    signal = signal - signal.mean()
+    template = template - template.mean()
+    norm = np.sqrt((signal ** 2).sum() * (template ** 2).sum())
+    if norm == 0:
+        return 0, np.nan, 0.0
+
+    # zero padded so shifts don't wrap around into each other
+    size = 1 << int(len(signal) + len(template) - 1).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(signal, size) * np.conj(np.fft.rfft(template, size)), size) / norm
+
+    # correlation[k] is the score of shift k, negative shifts wrap to the end
+    lags = np.arange(size)
+    lags[lags >= size - len(template) + 1] -= size
+    valid = (lags < len(signal)) & (lags > -len(template))
+    if max_offset_ms is not None:
+        valid &= np.abs(lags) <= max_offset_ms // grid_ms
+    lags, correlation = lags[valid], correlation[valid]
+    if len(lags) == 0:
+        return 0, np.nan, 0.0
+
+    best = np.argmax(correlation)
+    peak = correlation[best]
+    others = correlation[np.abs(lags - lags[best]) >= PEAK_EXCLUSION_MS // grid_ms]
+    runner_up = max(others.max(), 0) if len(others) else 0
+    confidence = float(np.clip(1 - runner_up / peak, 0, 1)) if peak > 0 else 0.0
+    return int(lags[best] * grid_ms), float(peak), confidence
+
+
+def align_child(on, time_ms, trial_sets, manual_looks=None, grid_ms=GRID_MS, max_offset_ms=MAX_OFFSET_MS):
+    """
+    Estimates how far into a child's video the experiment started, from
+    iCatcher's on/off labels and the trial times
+
+    on (array-like of bool): whether iCatcher labeled each frame on
+    time_ms (array-like of int): time stamp of each frame in ms
+    trial_sets (List[List[int]]): trial [onset, offset] pairs in ms,
+            relative to the start of the experiment
+    manual_looks (Tuple): look [onset, offset] pairs, their states and the
+            default state from Scripts/agreement.py's read_manual_looks, to
+            line up with manual looks instead of the trial structure; then
+            trial_sets must be the manual ones too
+    rtype: Tuple[int, float, float], see estimate_offset
+    """
+    signal = resample(on, time_ms, grid_ms)
+    if manual_looks is None:
+        template = trial_template(trial_sets, grid_ms)
+    else:
+        template = look_template(trial_sets, *manual_looks, grid_ms=grid_ms)
+    return estimate_offset(signal, template, grid_ms, max_offset_ms)
+
+
+def write_experiment_onset(onsets_dir, child_id, session_id, offset_ms):
+    """
+    Writes sub-[child_id]_session-[session_id]_experiment_onset.txt, the
+    file ManualTrialInfo adds to a child's trial times
+
+    rtype: string, path of the file
+    """
+    os.makedirs(onsets_dir, exist_ok=True)
+    path = os.path.join(onsets_dir, 'sub-{}_session-{}_experiment_onset.txt'.format(child_id, session_id))
+    with open(path, 'w') as f:
+        f.write(str(int(offset_ms)))
+    return path
@@ -0,0 +1,159 @@
+import contextlib
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+
+class ICatcherOutput:
+    """
+    Reader for one iCatcher .npz output, holding the per-frame gaze label
+    (first array in the file) and confidence (second array).
+
+    Each member is decompressed once, and the file is closed right after.
+    With cache=True the arrays are also saved uncompressed next to the
+    .npz ([CHILD_ID].labels.npy and [CHILD_ID].confidence.npy), and later
+    readers memory-map those read-only instead of decompressing again. The
+    cache is ignored if the .npz is newer than it.
+
+    path (string): path to the .npz file
+    cache (bool): whether to write and use the uncompressed .npy cache
+    """
+
+    def __init__(self, path, cache=False):
+        self.path = Path(path)
+        self.cache = cache
+        self._labels = None
+        self._confidence = None
+
+    def _cache_path(self, name):
+        return self.path.with_name('{}.{}.npy'.format(self.path.stem, name))
+
+    def _cache_is_fresh(self):
+        npz_mtime = self.path.stat().st_mtime
+        for name in ('labels', 'confidence'):
+            cache_path = self._cache_path(name)
+            if not cache_path.is_file() or cache_path.stat().st_mtime < npz_mtime:
+                return False
+        return True
+
+    def _load(self):
+        if self.cache and self._cache_is_fresh():
+            self._labels = np.load(self._cache_path('labels'), mmap_mode='r')
+            self._confidence = np.load(self._cache_path('confidence'), mmap_mode='r')
+            return
+
+        with np.load(self.path) as npz:
+            names = npz.files
+            self._labels = npz[names[0]]
+            self._confidence = npz[names[1]]
+
+        if self.cache:
+            self._write_cache('labels', self._labels)
+            self._write_cache('confidence', self._confidence)
+
+    def _write_cache(self, name, array):
+        cache_path = self._cache_path(name)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, prefix='.' + cache_path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.save(tmp_file, array)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
+    @property
+    def labels(self):
+        """
+        rtype: np.ndarray, iCatcher gaze label of each frame, > 0 for on looks
+        """
+        if self._labels is None:
+            self._load()
+        return self._labels
+
+    @property
+    def confidence(self):
+        """
+        rtype: np.ndarray, iCatcher confidence of each frame
+        """
+        if self._confidence is None:
+            self._load()
+        return self._confidence
+
+    def __len__(self):
+        return len(self.labels)
+
+    def iter_chunks(self, chunk_size):
+        """
+        Yields (labels, confidence) for consecutive blocks of up to
+        chunk_size frames. Unless the arrays are already loaded or cached
+        uncompressed, both members are decompressed straight from the .npz
+        a block at a time, so the whole output is never in memory.
+
+        chunk_size (int): frames per block
+        rtype: Iterator[Tuple[np.ndarray, np.ndarray]]
+        """
+        if self._labels is None and not (self.cache and self._cache_is_fresh()):
+            yield from self._iter_npz_chunks(chunk_size)
+            return
+
+        labels, confidence = self.labels, self.confidence
+        for start in range(0, len(labels), chunk_size):
+            yield labels[start:start + chunk_size], confidence[start:start + chunk_size]
+
+    def _iter_npz_chunks(self, chunk_size):
+        with zipfile.ZipFile(self.path) as npz:
+            names = npz.namelist()
+            with npz.open(names[0]) as labels_file, npz.open(names[1]) as confidence_file:
+                labels_shape, labels_dtype = _read_npy_header(labels_file)
+                confidence_shape, confidence_dtype = _read_npy_header(confidence_file)
+                if labels_shape[0] != confidence_shape[0]:
+                    raise ValueError('{} has {} labels but {} confidences'.format(
+                        self.path, labels_shape[0], confidence_shape[0]))
+
+                for start in range(0, labels_shape[0], chunk_size):
+                    n = min(chunk_size, labels_shape[0] - start)
+                    yield (_read_block(labels_file, labels_dtype, n),
+                           _read_block(confidence_file, confidence_dtype, n))
+
+    def validate(self, timestamps):
+        """
+        Checks that there is one time stamp per annotated frame
+
+        timestamps (array-like of int): time stamp of each frame in ms, from
+                get_frame_information
+        rtype: None
+        """
+        if len(self.labels) != len(self.confidence):
+            raise ValueError('{} has {} labels but {} confidences'.format(
+                self.path, len(self.labels), len(self.confidence)))
+        if len(self.labels) != len(timestamps):
+            raise ValueError('{} has {} frames but the video has {} time stamps'.format(
+                self.path, len(self.labels), len(timestamps)))
+
+
+def _read_npy_header(npy_file):
+    """
+    Reads the header of a 1-D .npy stream, leaving it at the first element
+
+    rtype: Tuple[Tuple[int], np.dtype]
+    """
+    version = np.lib.format.read_magic(npy_file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npy_file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npy_file)
+    if len(shape) != 1 or dtype.hasobject:
+        raise ValueError('expected a 1-D numeric array, got shape {} and dtype {}'.format(shape, dtype))
+    return shape, dtype
+
+
+def _read_block(npy_file, dtype, n):
+    data = npy_file.read(n * dtype.itemsize)
+    if len(data) != n * dtype.itemsize:
+        raise ValueError('unexpected end of .npy data')
+    return np.frombuffer(data, dtype=dtype)
@@ -0,0 +1,186 @@
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# stages of analyze_child, in the order they run
+STAGES = ('frame_info', 'trial_info', 'cache', 'load', 'assign', 'aggregate', 'write')
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+
+class ChildStats:
+    """
+    Seconds spent in each stage and counters (frames, trials, cache hits
+    and misses, ...) for one child. Made in the process analyzing the child
+    and sent back with its rows, so it must stay picklable.
+
+    child_id (string): unique child ID associated with subject
+    """
+
+    def __init__(self, child_id):
+        self.child_id = child_id
+        self.stages = {}
+        self.counters = {}
+        self.error = None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Adds the time spent in the with block to stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_row(self):
+        row = {'child': self.child_id, 'error': self.error}
+        row.update({stage + '_s': round(self.stages.get(stage, 0.0), 6) for stage in STAGES})
+        row.update(self.counters)
+        return row
+
+
+@contextmanager
+def profiled(stats, mode=None, profile_dir=None):
+    """
+    Profiles the with block for one child. 'cprofile' dumps a cProfile
+    of the block to [profile_dir]/[child].prof, 'tracemalloc' adds the
+    peak bytes allocated in the block to the peak_alloc_bytes counter.
+
+    stats (ChildStats): stats of the child being profiled
+    mode (string): None, 'cprofile' or 'tracemalloc'
+    profile_dir (string): folder for the cProfile dumps
+    """
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(profile_dir, stats.child_id + '.prof'))
+    elif mode == 'tracemalloc':
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats.count('peak_alloc_bytes', peak)
+    else:
+        yield
+
+
+class RunStats:
+    """
+    Collects the ChildStats of a batch and writes the run report
+
+    workers (int): number of processes the batch ran in
+    profile (string): None, 'cprofile' or 'tracemalloc', see profiled
+    """
+
+    def __init__(self, workers=1, profile=None):
+        if profile is not None and profile not in PROFILE_MODES:
+            raise ValueError('profile must be one of {}, not {}'.format(PROFILE_MODES, profile))
+        self.workers = workers
+        self.profile = profile
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.children = []
+        self._start = time.perf_counter()
+        self.wall_s = None
+
+    def add(self, child_stats):
+        self.children.append(child_stats)
+
+    def finish(self):
+        self.wall_s = time.perf_counter() - self._start
+
+    def totals(self):
+        """
+        Returns seconds per stage and counters summed over all children
+
+        rtype: Tuple[dict, dict]
+        """
+        stages = {stage: 0.0 for stage in STAGES}
+        counters = {}
+        for child in self.children:
+            for stage, seconds in child.stages.items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+            for name, n in child.counters.items():
+                counters[name] = counters.get(name, 0) + n
+        return stages, counters
+
+    def summary(self):
+        """
+        rtype: string, a few lines to print at the end of a run
+        """
+        stages, counters = self.totals()
+        busy = sum(stages.values()) or 1.0
+        lines = ['analyzed {} children ({} failed) in {:.1f}s with {} worker(s)'.format(
+            len(self.children), sum(child.error is not None for child in self.children),
+            self.wall_s or 0.0, self.workers)]
+        for stage in STAGES:
+            lines.append('  {:<12} {:>9.2f}s {:>5.1f}%'.format(stage, stages[stage], 100 * stages[stage] / busy))
+        lines.append('  ' + ', '.join('{}={}'.format(name, n) for name, n in sorted(counters.items())))
+        return '\n'.join(lines)
+
+    def write(self, path):
+        """
+        Writes the run report to path, as one row per child if path ends in
+        .csv, otherwise as a .json with the run totals and every child
+
+        rtype: None
+        """
+        if Path(path).suffix == '.csv':
+            pd.DataFrame([child.as_row() for child in self.children]).to_csv(path, index=False)
+            return
+
+        stages, counters = self.totals()
+        report = {
+            'started': self.started,
+            'wall_s': round(self.wall_s, 3) if self.wall_s is not None else None,
+            'workers': self.workers,
+            'profile': self.profile,
+            'children': len(self.children),
+            'failed': sum(child.error is not None for child in self.children),
+            'stages_s': {stage: round(seconds, 6) for stage, seconds in stages.items()},
+            'counters': counters,
+            'per_child': [child.as_row() for child in self.children],
+        }
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=1)
+
+
+def merge_profiles(profile_dir, output_path, top=20, child_ids=None):
+    """
+    Combines the per-child cProfile dumps in profile_dir into one dump at
+    output_path and prints the functions with the most cumulative time
+
+    child_ids (List[string]): only merge the dumps of these children, e.g.
+            those profiled in this run, so dumps left by earlier runs are
+            not mixed in; all dumps if None
+    rtype: None
+    """
+    if child_ids is None:
+        dumps = sorted(str(path) for path in Path(profile_dir).glob('*.prof'))
+    else:
+        dumps = [str(Path(profile_dir) / (child_id + '.prof')) for child_id in sorted(set(child_ids))]
+        dumps = [path for path in dumps if os.path.isfile(path)]
+    if not dumps:
+        return
+    stats = pstats.Stats(*dumps)
+    stats.dump_stats(output_path)
+    stats.sort_stats('cumulative').print_stats(top)
@@ -0,0 +1,182 @@
+import numpy as np
+
+
+class LookSegments:
+    """
+    Run-length encoded iCatcher output: one entry per run of consecutive
+    frames with the same on/off state instead of one per frame. Gaze is
+    piecewise constant, so this is usually a few hundred runs for a video
+    of tens of thousands of frames.
+
+    A frame is taken to last until the next frame's time stamp, and the
+    last frame for the median frame interval, so runs tile the video
+    without gaps.
+
+    start_ms (np.ndarray): time stamp of the first frame of each run
+    end_ms (np.ndarray): time the run ends, the start of the next run
+    state (np.ndarray of bool): True for on looks, False for off
+    mean_confidence (np.ndarray): mean iCatcher confidence over the run
+    num_frames (np.ndarray): number of frames in the run
+    """
+
+    def __init__(self, start_ms, end_ms, state, mean_confidence, num_frames):
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.state = state
+        self.mean_confidence = mean_confidence
+        self.num_frames = num_frames
+
+    @classmethod
+    def from_frames(cls, on, confidence, time_ms, end_ms=None):
+        """
+        Builds the runs from per-frame arrays
+
+        on (array-like of bool): whether each frame is an on look, e.g.
+                iCatcher label > 0
+        confidence (array-like of float): iCatcher confidence of each
+                frame, or None if not available
+        time_ms (array-like of int): time stamp of each frame in ms
+        end_ms (int): time the last frame ends, by default after the median
+                frame interval. Given when the frames are one chunk of a
+                longer recording, see Scripts/streaming.py
+        rtype: LookSegments
+        """
+        on = np.asarray(on, dtype=bool)
+        if confidence is None:
+            confidence = np.full(len(on), np.nan)
+        confidence = np.asarray(confidence, dtype=np.float64)
+        time_ms = np.asarray(time_ms, dtype=np.int64)
+
+        if len(on) == 0:
+            return cls._empty()
+
+        starts = np.flatnonzero(np.concatenate([[True], on[1:] != on[:-1]]))
+        num_frames = np.diff(np.append(starts, len(on)))
+
+        if end_ms is None:
+            last_frame = np.median(np.diff(time_ms)) if len(time_ms) > 1 else 0
+            end_ms = time_ms[-1] + int(last_frame)
+        run_end_ms = np.append(time_ms[starts[1:]], np.int64(end_ms))
+
+        mean_confidence = np.add.reduceat(confidence, starts) / num_frames
+
+        return cls(time_ms[starts], run_end_ms, on[starts], mean_confidence, num_frames)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Joins the runs of consecutive pieces of one recording, e.g. chunks
+        of a streamed output, merging a run that continues from one piece
+        into the next
+
+        parts (List[LookSegments]): runs of each piece, in order
+        rtype: LookSegments
+        """
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls._empty()
+
+        start_ms = np.concatenate([part.start_ms for part in parts])
+        end_ms = np.concatenate([part.end_ms for part in parts])
+        state = np.concatenate([part.state for part in parts])
+        confidence = np.concatenate([part.mean_confidence for part in parts])
+        num_frames = np.concatenate([part.num_frames for part in parts])
+
+        starts = np.flatnonzero(np.concatenate([[True], state[1:] != state[:-1]]))
+        merged_frames = np.add.reduceat(num_frames, starts)
+        mean_confidence = np.add.reduceat(confidence * num_frames, starts) / merged_frames
+        ends = np.append(starts[1:], len(state)) - 1
+
+        return cls(start_ms[starts], end_ms[ends], state[starts], mean_confidence, merged_frames)
+
+    @classmethod
+    def _empty(cls):
+        empty = np.array([], dtype=np.int64)
+        return cls(empty, empty, np.array([], dtype=bool), np.array([], dtype=np.float64), empty)
+
+    def __len__(self):
+        return len(self.start_ms)
+
+    def _time_in_state(self, state, times):
+        """
+        Total time spent in state from the start of the video up to each of
+        times, by interpolating a running sum over the runs
+        """
+        durations = (self.end_ms - self.start_ms) * (self.state == state)
+        before = np.concatenate([[0], np.cumsum(durations)])
+
+        run = np.searchsorted(self.start_ms, times, side='right') - 1
+        inside = run >= 0
+        run = np.clip(run, 0, None)
+
+        partial = np.clip(times - self.start_ms[run], 0, self.end_ms[run] - self.start_ms[run])
+        partial = partial * (self.state[run] == state)
+
+        return np.where(inside, before[run] + partial, 0)
+
+    def trial_totals(self, trial_sets):
+        """
+        Returns total on and off time in ms within each trial
+
+        trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+        rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        onsets, offsets = _split(trial_sets)
+        if len(self) == 0:
+            return np.zeros(len(onsets)), np.zeros(len(onsets))
+
+        on = self._time_in_state(True, offsets) - self._time_in_state(True, onsets)
+        off = self._time_in_state(False, offsets) - self._time_in_state(False, onsets)
+        return on, off
+
+    def look_counts(self, trial_sets):
+        """
+        Returns the number of on looks overlapping each trial
+
+        trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+        rtype: np.ndarray of int
+        """
+        onsets, offsets = _split(trial_sets)
+        on_start, on_end = self.start_ms[self.state], self.end_ms[self.state]
+
+        # runs don't overlap, so on looks are sorted by both start and end
+        counts = np.searchsorted(on_start, offsets, side='left') - np.searchsorted(on_end, onsets, side='right')
+        return np.clip(counts, 0, None)
+
+    def first_look_latency(self, trial_sets):
+        """
+        Returns the time in ms from each trial's onset to its first on look,
+        0 if the child is already looking at onset, or NaN if the child
+        never looks during the trial
+
+        trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+        rtype: np.ndarray of float
+        """
+        onsets, offsets = _split(trial_sets)
+        on_start, on_end = self.start_ms[self.state], self.end_ms[self.state]
+
+        if len(on_start) == 0:
+            return np.full(len(onsets), np.nan)
+
+        first = np.searchsorted(on_end, onsets, side='right')
+        found = first < len(on_start)
+        first = np.clip(first, 0, len(on_start) - 1)
+
+        latency = np.maximum(on_start[first], onsets) - onsets
+        return np.where(found & (on_start[first] < offsets), latency, np.nan)
+
+    def on_off_times(self, trial_sets):
+        """
+        Returns [on time, off time] in seconds for each trial, in the form
+        written to the output file
+
+        trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+        rtype: List[List[float]]
+        """
+        on, off = self.trial_totals(trial_sets)
+        return np.round(np.column_stack([on, off]) / 1000, 3).tolist()
+
+
+def _split(trial_sets):
+    sets = np.asarray(trial_sets, dtype=np.int64).reshape(-1, 2)
+    return sets[:, 0], sets[:, 1]
@@ -0,0 +1,227 @@
+import contextlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+
+# kind of input -> how its files are named, the child ID and session are
+# read from the file name or, for 'session' folders, from the parent folder
+PATTERNS = {
+    'video': re.compile(r'^(?P<child>[^.]+)\.mp4$'),
+    'icatcher': re.compile(r'^(?P<child>[^.]+)\.npz$'),
+    'timestamps': re.compile(r'^(?P<child>[^.]+)\.json$'),
+    'trial_info': re.compile(r'^sub-(?P<child>.+)_session-(?P<session>[^_]+)_trial_info\.csv$'),
+    'experiment_onset': re.compile(r'^sub-(?P<child>.+)_session-(?P<session>[^_]+)_experiment_onset\.txt$'),
+    'manual': re.compile(r'^MCS_(?P<child>[^_]+)_[^_]+_verbose_[^_]+\.csv$'),
+}
+
+# kinds whose files are stat'ed again on every refresh, as they are small
+# and can be rewritten in place (see write_experiment_onset in
+# Scripts/alignment.py), which does not change their folder's mtime
+RESTAT_KINDS = ('trial_info', 'experiment_onset')
+
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    """
+    Persistent index of the input files of every child: videos, iCatcher
+    outputs, cached time stamps, trial info and manual annotations, with
+    their sizes and modification times, so the pipeline can look inputs up
+    instead of listing folders and building paths for every child.
+
+    Each kind of input lives under its own root folder, searched
+    recursively; files in a session[ID] folder belong to that session. The
+    index is saved as .json and refreshed incrementally: a folder is only
+    listed again if its own modification time changed, which happens when
+    files are added, removed or renamed in it (as the atomic writes of the
+    pipeline do), so an unchanged tree costs one stat per folder. Files
+    rewritten in place are only picked up by refresh(full=True), except
+    those of RESTAT_KINDS, which are stat'ed on every refresh.
+
+    path (string): .json file the index is kept in
+    roots (dict): kind in PATTERNS -> root folder, e.g.
+            {'video': VID_DIR, 'icatcher': ICATCHER_DIR}
+    """
+
+    def __init__(self, path, roots):
+        unknown = [kind for kind in roots if kind not in PATTERNS]
+        if unknown:
+            raise ValueError('unknown input kinds {}, expected some of {}'.format(unknown, list(PATTERNS)))
+        self.path = Path(path)
+        self.roots = {kind: str(root) for kind, root in roots.items() if root}
+        self._dirs = {}
+        self._index = None
+        self._lookup = None
+
+        if self.path.is_file():
+            with open(self.path, 'r') as manifest_file:
+                saved = json.load(manifest_file)
+            if saved.get('version') == MANIFEST_VERSION:
+                self._dirs = saved['dirs']
+
+    def refresh(self, full=False):
+        """
+        Brings the index up to date with the files on disk and saves it
+
+        full (bool): list every folder and stat every file again, even
+                folders whose modification time did not change
+        rtype: int, number of folders that were listed
+        """
+        dirs, listed = {}, 0
+        restat_roots = [os.path.join(root, '') for kind, root in self.roots.items() if kind in RESTAT_KINDS]
+        for root in sorted(set(self.roots.values())):
+            stack = [root]
+            while stack:
+                folder = stack.pop()
+                if folder in dirs:
+                    continue
+                try:
+                    mtime = os.stat(folder).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+                cached = self._dirs.get(folder)
+                if full or cached is None or cached['mtime_ns'] != mtime:
+                    cached = _list_folder(folder, mtime)
+                    listed += 1
+                elif any(os.path.join(folder, '').startswith(restat_root) for restat_root in restat_roots):
+                    cached = _restat_folder(folder, cached)
+                dirs[folder] = cached
+                stack.extend(os.path.join(folder, name) for name in cached['subdirs'])
+
+        self._dirs = dirs
+        self._index = None
+        self.save()
+        return listed
+
+    def save(self):
+        """
+        Writes the index to path, atomically
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.' + self.path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump({'version': MANIFEST_VERSION, 'dirs': self._dirs}, tmp_file)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
+    def _build_index(self):
+        index = {kind: [] for kind in self.roots}
+        for kind, root in self.roots.items():
+            pattern = PATTERNS[kind]
+            prefix = os.path.join(root, '')
+            for folder, listing in self._dirs.items():
+                if folder != root and not folder.startswith(prefix):
+                    continue
+                parent = os.path.basename(folder)
+                folder_session = parent[len('session'):] if parent.startswith('session') and folder != root else None
+                for name, (size, mtime) in listing['files'].items():
+                    match = pattern.match(name)
+                    if match is None:
+                        continue
+                    fields = match.groupdict()
+                    session = fields.get('session', folder_session)
+                    index[kind].append({'child': fields['child'], 'session': session,
+                                        'path': os.path.join(folder, name), 'size': size, 'mtime_ns': mtime})
+        for entries in index.values():
+            entries.sort(key=lambda entry: entry['path'])
+        return index
+
+    @property
+    def index(self):
+        """
+        kind -> entries of every indexed input of that kind, sorted by path
+        """
+        return self._indexed()[0]
+
+    def _indexed(self):
+        if self._index is None:
+            self._index = self._build_index()
+            self._lookup = {kind: {(entry['child'], entry['session']): entry for entry in entries}
+                            for kind, entries in self._index.items()}
+        return self._index, self._lookup
+
+    def get(self, kind, child_id, session=None):
+        """
+        Returns the entry of a child's input, a dict with child, session,
+        path, size and mtime_ns, or None if it is not in the index
+
+        kind (string): kind of input, a key of the roots
+        child_id (string): unique child ID associated with subject
+        session (string): the experiment session, None for files that are
+                not in a session folder and not named by session
+        rtype: dict
+        """
+        if session is not None:
+            session = str(session)
+        _, lookup = self._indexed()
+        return lookup.get(kind, {}).get((child_id, session))
+
+    def locate(self, kind, child_id, session=None):
+        """
+        Returns the path of a child's input, or None if it is not indexed
+
+        rtype: string
+        """
+        entry = self.get(kind, child_id, session)
+        return entry['path'] if entry else None
+
+    def entries(self, kind, session=None):
+        """
+        Returns the entries of every indexed input of kind, sorted by path,
+        only those of session if it is given. A child can have several,
+        e.g. manual annotations by two annotators.
+
+        rtype: List[dict]
+        """
+        entries = self.index.get(kind, [])
+        if session is not None:
+            entries = [entry for entry in entries if entry['session'] == str(session)]
+        return entries
+
+    def children(self, kind, session=None):
+        """
+        Returns the sorted IDs of children with an input of kind
+
+        rtype: List[string]
+        """
+        return sorted({entry['child'] for entry in self.entries(kind, session)})
+
+
+def _restat_folder(folder, listing):
+    """
+    Returns a folder's listing with the sizes and modification times of its
+    files stat'ed again
+    """
+    files = {}
+    for name in listing['files']:
+        try:
+            stat = os.stat(os.path.join(folder, name))
+        except FileNotFoundError:
+            continue
+        files[name] = [stat.st_size, stat.st_mtime_ns]
+    return dict(listing, files=files)
+
+
+def _list_folder(folder, mtime):
+    """
+    Lists a folder's non-hidden files with their sizes and modification
+    times, and its non-hidden subfolders
+    """
+    files, subdirs = {}, []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.is_file():
+                stat = entry.stat()
+                files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return {'mtime_ns': mtime, 'subdirs': sorted(subdirs), 'files': files}
@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+
+from Scripts.looks import _split
+
+# a trial counts as ended by a look away if the child had been looking away
+# for at least this long when it ended
+LOOK_AWAY_MS = 2000
+
+# habituation: the on time summed over a window of fam trials drops below
+# HABITUATION_CRITERION times the sum over the first window of fam trials
+HABITUATION_WINDOW = 3
+HABITUATION_CRITERION = 0.5
+
+# name -> function(looks, trial_sets, trial_types) returning one value per trial
+METRICS = {}
+
+
+def metric(name):
+    """
+    Registers a per-trial metric under name. The function takes a
+    LookSegments, the trial [onset, offset] pairs in ms and the trial types
+    ('fam', 'test', ... or None), and returns an array with one value per
+    trial.
+    """
+    def register(function):
+        METRICS[name] = function
+        return function
+    return register
+
+
+def trial_metrics(looks, trial_sets, metrics=None, trial_types=None):
+    """
+    Computes metrics for every trial of one child
+
+    looks (LookSegments): the child's looks
+    trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+    metrics (List[string]): names of metrics in METRICS, all of them if None
+    trial_types (array-like of string): 'fam' or 'test' for each trial,
+            needed for the habituation metrics
+    rtype: DataFrame, one row per trial and one column per metric
+    """
+    if metrics is None:
+        metrics = list(METRICS)
+    unknown = [name for name in metrics if name not in METRICS]
+    if unknown:
+        raise ValueError('unknown metrics {}, expected some of {}'.format(unknown, list(METRICS)))
+
+    if trial_types is not None:
+        trial_types = np.asarray(trial_types, dtype=object)
+    table = pd.DataFrame({name: METRICS[name](looks, trial_sets, trial_types) for name in metrics},
+                         index=pd.RangeIndex(1, len(trial_sets) + 1, name='trial_num'))
+    return table
+
+
+def _on_looks_in_trials(looks, onsets, offsets):
+    """
+    Pairs every trial with each on look overlapping it
+
+    rtype: Tuple[np.ndarray, np.ndarray, np.ndarray], trial index and the
+            start and end in ms of the look clipped to the trial
+    """
+    on_start, on_end = looks.start_ms[looks.state], looks.end_ms[looks.state]
+
+    first = np.searchsorted(on_end, onsets, side='right')
+    last = np.searchsorted(on_start, offsets, side='left')
+    counts = np.clip(last - first, 0, None)
+
+    trial = np.repeat(np.arange(len(onsets)), counts)
+    look = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    start = np.maximum(on_start[look], onsets[trial])
+    end = np.minimum(on_end[look], offsets[trial])
+    return trial, start, end
+
+
+@metric('on_ms')
+def on_ms(looks, trial_sets, trial_types=None):
+    return looks.trial_totals(trial_sets)[0]
+
+
+@metric('off_ms')
+def off_ms(looks, trial_sets, trial_types=None):
+    return looks.trial_totals(trial_sets)[1]
+
+
+@metric('look_count')
+def look_count(looks, trial_sets, trial_types=None):
+    return looks.look_counts(trial_sets)
+
+
+@metric('longest_look_ms')
+def longest_look_ms(looks, trial_sets, trial_types=None):
+    """
+    Longest on look within each trial, clipped to the trial, 0 if none
+    """
+    onsets, offsets = _split(trial_sets)
+    trial, start, end = _on_looks_in_trials(looks, onsets, offsets)
+
+    longest = np.zeros(len(onsets), dtype=np.int64)
+    np.maximum.at(longest, trial, end - start)
+    return longest
+
+
+@metric('first_look_latency_ms')
+def first_look_latency_ms(looks, trial_sets, trial_types=None):
+    return looks.first_look_latency(trial_sets)
+
+
+@metric('ended_by_look_away')
+def ended_by_look_away(looks, trial_sets, trial_types=None):
+    """
+    Whether the child had been looking away for at least LOOK_AWAY_MS when
+    the trial ended, as in an infant-controlled trial
+    """
+    onsets, offsets = _split(trial_sets)
+    if len(looks) == 0:
+        return np.zeros(len(onsets), dtype=bool)
+
+    # the run holding the last ms of the trial
+    run = np.clip(np.searchsorted(looks.start_ms, offsets, side='right') - 1, 0, None)
+    away = ~looks.state[run] & (looks.start_ms[run] <= offsets)
+    return away & (np.maximum(looks.start_ms[run], onsets) <= offsets - LOOK_AWAY_MS)
+
+
+def _fam_window_sums(looks, trial_sets, trial_types):
+    """
+    On time summed over the last HABITUATION_WINDOW fam trials up to each
+    fam trial, and the sum over the first window
+
+    rtype: Tuple[np.ndarray, np.ndarray, float], indices of fam trials,
+            window sum ending at each of them (NaN before a full window)
+            and the baseline sum
+    """
+    if trial_types is None:
+        raise ValueError('habituation metrics need the trial types')
+    fam = np.flatnonzero(trial_types == 'fam')
+    on = looks.trial_totals(trial_sets)[0][fam].astype(np.float64)
+
+    sums = np.full(len(fam), np.nan)
+    if len(fam) >= HABITUATION_WINDOW:
+        running = np.concatenate([[0], np.cumsum(on)])
+        sums[HABITUATION_WINDOW - 1:] = running[HABITUATION_WINDOW:] - running[:-HABITUATION_WINDOW]
+    return fam, sums, sums[HABITUATION_WINDOW - 1] if len(fam) >= HABITUATION_WINDOW else np.nan
+
+
+@metric('habituation_ratio')
+def habituation_ratio(looks, trial_sets, trial_types=None):
+    """
+    On time over the last HABITUATION_WINDOW fam trials divided by the on
+    time over the first window, for fam trials after the first window
+    """
+    fam, sums, baseline = _fam_window_sums(looks, trial_sets, trial_types)
+    ratio = np.full(len(trial_sets), np.nan)
+    # windows may not overlap the baseline window
+    later = np.arange(len(fam)) >= 2 * HABITUATION_WINDOW - 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio[fam[later]] = sums[later] / baseline
+    return ratio
+
+
+@metric('habituated')
+def habituated(looks, trial_sets, trial_types=None):
+    """
+    Whether the habituation criterion has been met by the end of each
+    trial, i.e. habituation_ratio < HABITUATION_CRITERION on this or an
+    earlier fam trial
+    """
+    met = habituation_ratio(looks, trial_sets, trial_types) < HABITUATION_CRITERION
+    return np.maximum.accumulate(met) if len(met) else met
@@ -0,0 +1,216 @@
+"""
+Frame time stamps read straight from an MP4/MOV container's sample tables,
+without ffprobe and without decoding any video.
+
+For the first video track the decode time of every sample comes from the
+time-to-sample table (stts), the composition offsets (ctts) turn those
+into presentation times, and the first edit of the edit list (elst) shifts
+them so the first shown frame is at 0, which is what ffprobe's
+best_effort_timestamp_time reports. Fragmented MP4s (moof boxes) keep
+their tables elsewhere and are not supported.
+"""
+import os
+import struct
+
+import numpy as np
+
+def read_frame_times(video_file_path):
+    """
+    Returns the presentation time in seconds of every frame of the first
+    video track, in presentation order, and the number of frames. Times are
+    rounded to the microsecond like ffprobe prints them.
+
+    Any file that cannot be read this way, including truncated or corrupt
+    box tables, raises a ValueError, so callers can fall back to ffprobe.
+
+    video_file_path (string): path to the .mp4/.mov video
+    rtype: Tuple[np.ndarray, int]
+    """
+    if not os.path.isfile(video_file_path):
+        return np.array([], dtype=np.float64), 0
+
+    try:
+        return _read_frame_times(video_file_path)
+    except (struct.error, IndexError, ZeroDivisionError, OverflowError) as e:
+        raise ValueError('{} has malformed MP4 boxes: {}: {}'.format(video_file_path, type(e).__name__, e)) from e
+
+
+def _read_frame_times(video_file_path):
+    moov = _read_moov(video_file_path)
+    movie_timescale = _timescale(_child(moov, 0, len(moov), b'mvhd'), moov)
+
+    # samples of a fragmented MP4 are listed in moof boxes after the moov
+    if _child(moov, 0, len(moov), b'mvex') is not None:
+        raise ValueError('{} is a fragmented MP4, which is not supported'.format(video_file_path))
+
+    for kind, start, end in _boxes(moov, 0, len(moov)):
+        if kind == b'trak' and _handler(moov, start, end) == b'vide':
+            return _track_times(moov, start, end, movie_timescale)
+
+    raise ValueError('{} has no video track'.format(video_file_path))
+
+
+def _read_moov(path):
+    """
+    Walks the top level boxes reading only their headers, and returns the
+    contents of the moov box
+    """
+    with open(path, 'rb') as video_file:
+        file_size = os.fstat(video_file.fileno()).st_size
+        pos = 0
+        while pos + 8 <= file_size:
+            video_file.seek(pos)
+            header = video_file.read(16)
+            size, kind = struct.unpack_from('>I4s', header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', header, 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - pos
+            if size < header_size:
+                raise ValueError('{} is not an MP4 file, bad box at byte {}'.format(path, pos))
+
+            if kind == b'moof':
+                raise ValueError('{} is a fragmented MP4, which is not supported'.format(path))
+            if kind == b'moov':
+                video_file.seek(pos + header_size)
+                return video_file.read(size - header_size)
+            pos += size
+
+    raise ValueError('{} has no moov box, it may not be an MP4 file'.format(path))
+
+
+def _boxes(data, start, end):
+    """
+    Yields (type, payload start, payload end) of the boxes in data[start:end]
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise ValueError('corrupt {} box at byte {} of moov'.format(kind, pos))
+        yield kind, pos + header_size, pos + size
+        pos += size
+
+
+def _child(data, start, end, path):
+    """
+    Returns (payload start, payload end) of the first box at path below
+    data[start:end], e.g. b'mdia/minf/stbl/stts', or None
+    """
+    for kind in path.split(b'/'):
+        for child_kind, child_start, child_end in _boxes(data, start, end):
+            if child_kind == kind:
+                start, end = child_start, child_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _handler(data, start, end):
+    hdlr = _child(data, start, end, b'mdia/hdlr')
+    # version and flags, pre_defined, then the handler type
+    return data[hdlr[0] + 8:hdlr[0] + 12] if hdlr else None
+
+
+def _timescale(box, data):
+    """
+    Reads the timescale of an mvhd or mdhd box, which sits after the
+    creation and modification times
+    """
+    if box is None:
+        raise ValueError('missing mvhd or mdhd box')
+    start = box[0]
+    version = data[start]
+    timescale = struct.unpack_from('>I', data, start + (20 if version == 1 else 12))[0]
+    if timescale == 0:
+        raise ValueError('mvhd or mdhd box has a timescale of 0')
+    return timescale
+
+
+def _table(data, box, dtype):
+    """
+    Reads the entries of a full box made of an entry count followed by
+    fixed size records, as an array of dtype
+    """
+    start = box[0]
+    count = struct.unpack_from('>I', data, start + 4)[0]
+    return np.frombuffer(data, dtype=dtype, count=count, offset=start + 8)
+
+
+def _media_start(data, track_start, track_end, media_timescale, movie_timescale):
+    """
+    Returns the media time shown first and the delay before it, both in
+    the media timescale, from the first edits of the edit list
+    """
+    elst = _child(data, track_start, track_end, b'edts/elst')
+    if elst is None:
+        return 0, 0
+
+    version = data[elst[0]]
+    if version == 1:
+        entries = _table(data, elst, np.dtype([('duration', '>u8'), ('media_time', '>i8'), ('rate', '>i4')]))
+    else:
+        entries = _table(data, elst, np.dtype([('duration', '>u4'), ('media_time', '>i4'), ('rate', '>i4')]))
+
+    delay = 0
+    for duration, media_time, _ in entries.tolist():
+        # an empty edit delays the start of the track by its duration
+        if media_time == -1:
+            delay += duration * media_timescale // movie_timescale
+            continue
+        return media_time, delay
+    return 0, delay
+
+
+def _track_times(data, track_start, track_end, movie_timescale):
+    media_timescale = _timescale(_child(data, track_start, track_end, b'mdia/mdhd'), data)
+
+    stbl = _child(data, track_start, track_end, b'mdia/minf/stbl')
+    if stbl is None:
+        raise ValueError('video track has no sample table')
+
+    stts = _child(data, stbl[0], stbl[1], b'stts')
+    if stts is None:
+        raise ValueError('video track has no stts box')
+    stts = _table(data, stts, np.dtype([('count', '>u4'), ('delta', '>u4')]))
+
+    # the sample count of the sample size table bounds the time tables, so a
+    # corrupt count cannot expand into a huge array
+    stsz = _child(data, stbl[0], stbl[1], b'stsz') or _child(data, stbl[0], stbl[1], b'stz2')
+    if stsz is None:
+        raise ValueError('video track has no stsz box')
+    num_samples = struct.unpack_from('>I', data, stsz[0] + 8)[0]
+    if stts['count'].sum(dtype=np.int64) != num_samples:
+        raise ValueError('stts box covers {} samples, stsz box has {}'.format(
+            stts['count'].sum(dtype=np.int64), num_samples))
+
+    # decode time of each sample
+    deltas = np.repeat(stts['delta'].astype(np.int64), stts['count'].astype(np.int64))
+    times = np.cumsum(deltas) - deltas
+
+    # composition offsets give presentation times, signed in practice even in version 0
+    ctts = _child(data, stbl[0], stbl[1], b'ctts')
+    if ctts is not None:
+        ctts = _table(data, ctts, np.dtype([('count', '>u4'), ('offset', '>i4')]))
+        if ctts['count'].sum(dtype=np.int64) > num_samples:
+            raise ValueError('ctts box covers more samples than the {} of the stsz box'.format(num_samples))
+        offsets = np.repeat(ctts['offset'].astype(np.int64), ctts['count'].astype(np.int64))
+        times[:len(offsets)] += offsets[:len(times)]
+
+    media_start, delay = _media_start(data, track_start, track_end, media_timescale, movie_timescale)
+    times = times - media_start
+    # samples before the edit start are decoded but never shown
+    times = np.sort(times[times >= 0]) + delay
+
+    # round to the microsecond, as ffprobe prints them
+    microseconds = (times * 2000000 + media_timescale) // (2 * media_timescale)
+    return microseconds / 1e6, len(times)
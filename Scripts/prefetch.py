@@ -0,0 +1,213 @@
+import asyncio
+import contextlib
+import queue
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from Scripts.timestamp_store import TimestampStore
+from Scripts.video import (FrameTimes, count_command, parse_count, read_mp4_frame_times, save_frame_times,
+                           times_command, to_ms)
+
+# put in the queue after the last video
+_DONE = object()
+
+
+class FramePrefetcher:
+    """
+    Gets the frame time stamps of a list of videos ahead of the code using
+    them. An asyncio loop in a background thread runs up to concurrency
+    ffprobe processes at once and hands finished videos to the consumer
+    through a queue holding at most queue_size of them, in the order the
+    videos were given. Videos already in store are passed straight through,
+    and every probed video is added to store as soon as it is done, so
+    nothing finished is lost if the run is interrupted.
+
+    Use as a context manager and iterate over it; leaving the with block
+    early, including on Ctrl-C, cancels the probes still running and kills
+    their ffprobe processes.
+        with FramePrefetcher(paths) as prefetcher:
+            for vid_path, (timestamps, num_frames) in prefetcher:
+                ...
+
+    video_paths (List[string]): paths of the videos, in the order wanted
+    store (string or TimestampStore): time stamp cache, or its directory
+    session (string): the experiment session of the videos, if any
+    concurrency (int): number of videos to probe at once
+    queue_size (int): number of finished videos to hold for the consumer
+    mode (string): 'frames' or 'packets' to use ffprobe, or 'mp4'/'auto'
+            to read MP4 sample tables first, see Scripts/video.py
+    """
+
+    def __init__(self, video_paths, store='video_data', session=None, concurrency=4, queue_size=8, mode='auto'):
+        if mode not in ('frames', 'packets', 'mp4', 'auto'):
+            raise ValueError('unsupported prefetch mode {}'.format(mode))
+        self.video_paths = list(video_paths)
+        self.store = store if isinstance(store, TimestampStore) else TimestampStore(store)
+        self.session = session
+        self.concurrency = concurrency
+        self.mode = mode
+        self.results = queue.Queue(maxsize=queue_size)
+        self._loop = None
+        self._main = None
+        self._thread = None
+        self._error = None
+        self._closed = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='frame-prefetch', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._main = self._loop.create_task(self._produce())
+        try:
+            self._loop.run_until_complete(self._main)
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            self._error = e
+            self._put(_DONE)
+        finally:
+            # let cancelled probes kill their ffprobe processes before closing
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    def _put(self, item):
+        """
+        Blocking put that gives up once the prefetcher is closed
+        """
+        while not self._closed.is_set():
+            try:
+                self.results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def _produce(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = []
+
+        # keep the next concurrency videos running, hand them out in order
+        for vid_path in self.video_paths:
+            pending.append((vid_path, asyncio.ensure_future(self._get(vid_path, semaphore))))
+            if len(pending) < self.concurrency:
+                continue
+            vid_path, task = pending.pop(0)
+            if not await self._hand_out(vid_path, await task):
+                return
+        for vid_path, task in pending:
+            if not await self._hand_out(vid_path, await task):
+                return
+        await self._hand_out(None, _DONE)
+
+    async def _hand_out(self, vid_path, result):
+        item = _DONE if result is _DONE else (vid_path, result)
+        return await self._loop.run_in_executor(None, self._put, item)
+
+    async def _get(self, vid_path, semaphore):
+        """
+        Gets one video's time stamps. A video that fails is handed out as
+        not found, so one bad video does not stop the others; the consumer
+        runs into the same error when it gets the video itself, and can
+        report it for that video alone.
+        """
+        try:
+            return await self._get_frame_information(vid_path, semaphore)
+        except Exception as e:
+            print('failed to prefetch {}: {}: {}'.format(vid_path, type(e).__name__, e))
+            return np.zeros(0), 0
+
+    async def _get_frame_information(self, vid_path, semaphore):
+        child_id = Path(vid_path).stem
+        stored = self.store.get(child_id, self.session)
+        if stored is not None:
+            return stored
+
+        async with semaphore:
+            frame_times, num_frames, mode = await self._loop.run_in_executor(
+                None, read_mp4_frame_times, vid_path, self.mode)
+            if frame_times is None:
+                frame_times, num_frames = await _probe(vid_path, mode)
+
+        return save_frame_times(self.store, child_id, to_ms(frame_times), num_frames, self.session)
+
+    def __iter__(self):
+        """
+        Yields (video path, (timestamps, num_frames)) for every video in
+        order. timestamps is empty for a video that was not found or could
+        not be probed.
+        """
+        while True:
+            item = self.results.get()
+            if item is _DONE:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield item
+
+    def close(self):
+        """
+        Stops prefetching, cancelling running probes and killing their
+        ffprobe processes
+
+        rtype: None
+        """
+        self._closed.set()
+        if self._thread is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._cancel)
+        except RuntimeError:
+            # the loop finished and closed in the meantime
+            pass
+        self._thread.join()
+
+    def _cancel(self):
+        if self._main is not None:
+            self._main.cancel()
+
+
+async def _probe(vid_path, mode):
+    """
+    Runs ffprobe for the frame count and time stamps of one video, reading
+    the time stamps line by line as Scripts/video.py does
+
+    rtype: Tuple[np.ndarray, int]
+    """
+    count_lines = []
+    await _run(count_command(vid_path), count_lines.append)
+    frame_times = FrameTimes(parse_count(''.join(count_lines)))
+    await _run(times_command(vid_path, mode), frame_times.add)
+    return frame_times.result(mode)
+
+
+async def _run(commands_list, read_line):
+    """
+    Runs ffprobe and passes each line it prints to read_line, killing it
+    if cancelled or if read_line fails
+    """
+    ffprobe = await asyncio.create_subprocess_exec(
+        *commands_list, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        async for line in ffprobe.stdout:
+            read_line(line.decode())
+        await ffprobe.wait()
+    except BaseException:
+        with contextlib.suppress(ProcessLookupError):
+            ffprobe.kill()
+        await ffprobe.wait()
+        raise
@@ -0,0 +1,124 @@
+import numpy as np
+
+from Scripts.looks import LookSegments
+
+
+def preprocess(on, confidence, time_ms, min_confidence=None, window=None, max_gap_ms=None, min_look_ms=None):
+    """
+    Cleans up per-frame iCatcher on/off labels before trials are assigned.
+    Each step runs only if its setting is given, in this order:
+
+    1. min_confidence: frames less confident than this take the label of
+       the last confident frame before them (the first confident frame
+       for any at the start), and NaN confidence, so they are left out of
+       the mean confidence of a trial's on looks
+    2. window: majority filter, each frame takes the label held by most
+       frames in the window centred on it, removing flicker shorter than
+       half the window
+    3. max_gap_ms: where frames were dropped, i.e. consecutive time stamps
+       are further apart than this, a frame is inserted halfway through
+       the gap with the label of the frame after it, so the gap is split
+       between its two sides instead of all going to the frame before.
+       Inserted frames have NaN confidence.
+    4. min_look_ms: looks (on or off) shorter than this are merged into
+       the look before them (the one after them for a short first look)
+
+    on (array-like of bool): whether each frame is an on look
+    confidence (array-like of float): iCatcher confidence of each frame
+    time_ms (array-like of int): time stamp of each frame in ms
+    min_confidence (float): confidence below which a frame's label is ignored
+    window (int): odd number of frames in the majority filter
+    max_gap_ms (int): longest interval between frames that is not a gap
+    min_look_ms (int): shortest look kept
+    rtype: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], on,
+            confidence, time_ms and the 1-based input frame number of each
+            output frame
+    """
+    on = np.array(on, dtype=bool)
+    confidence = np.asarray(confidence, dtype=np.float64)
+    time_ms = np.asarray(time_ms, dtype=np.int64)
+    frame = np.arange(1, len(on) + 1)
+    if len(on) == 0:
+        return on, confidence, time_ms, frame
+
+    if min_confidence is not None:
+        on = fill_unconfident(on, confidence, min_confidence)
+        confidence = np.where(confidence >= min_confidence, confidence, np.nan)
+    if window is not None and window > 1:
+        on = majority_filter(on, window)
+    if max_gap_ms is not None:
+        on, confidence, time_ms, frame = split_gaps(on, confidence, time_ms, frame, max_gap_ms)
+    if min_look_ms is not None:
+        on = merge_short_looks(on, time_ms, min_look_ms)
+
+    return on, confidence, time_ms, frame
+
+
+def fill_unconfident(on, confidence, min_confidence):
+    """
+    Forward fills the label of frames with confidence below min_confidence
+
+    rtype: np.ndarray of bool
+    """
+    confident = confidence >= min_confidence
+    if not confident.any():
+        return on
+    source = np.where(confident, np.arange(len(on)), -1)
+    source = np.maximum.accumulate(source)
+    # frames before the first confident frame take its label
+    source[source < 0] = np.argmax(confident)
+    return on[source]
+
+
+def majority_filter(on, window):
+    """
+    Sets each frame to the label held by most frames in the window of
+    window frames centred on it, repeating the first and last frames at
+    the edges
+
+    rtype: np.ndarray of bool
+    """
+    if window % 2 == 0:
+        raise ValueError('majority filter window must be odd, not {}'.format(window))
+    half = window // 2
+    padded = np.concatenate([np.repeat(on[:1], half), on, np.repeat(on[-1:], half)])
+    votes = np.lib.stride_tricks.sliding_window_view(padded.astype(np.int8), window).sum(axis=1)
+    return votes > half
+
+
+def split_gaps(on, confidence, time_ms, frame, max_gap_ms):
+    """
+    Inserts a frame halfway through every gap longer than max_gap_ms
+    between consecutive time stamps, copying the label and frame number of
+    the frame after the gap
+
+    rtype: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+    """
+    gaps = np.flatnonzero(np.diff(time_ms) > max_gap_ms)
+    if len(gaps) == 0:
+        return on, confidence, time_ms, frame
+
+    after = gaps + 1
+    midpoints = (time_ms[gaps] + time_ms[after]) // 2
+    return (np.insert(on, after, on[after]),
+            np.insert(confidence, after, np.nan),
+            np.insert(time_ms, after, midpoints),
+            np.insert(frame, after, frame[after]))
+
+
+def merge_short_looks(on, time_ms, min_look_ms):
+    """
+    Gives looks shorter than min_look_ms the label of the last long enough
+    look before them, or of the first one if there is none before
+
+    rtype: np.ndarray of bool
+    """
+    looks = LookSegments.from_frames(on, None, time_ms)
+    long_enough = (looks.end_ms - looks.start_ms) >= min_look_ms
+    if not long_enough.any() or long_enough.all():
+        return on
+
+    source = np.where(long_enough, np.arange(len(looks)), -1)
+    source = np.maximum.accumulate(source)
+    source[source < 0] = np.argmax(long_enough)
+    return np.repeat(looks.state[source], looks.num_frames)
@@ -0,0 +1,152 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class ResultCache:
+    """
+    On-disk cache of each child's output rows, keyed by a hash of
+    everything the rows are computed from: the iCatcher .npz contents, the
+    frame time stamps, the child's trial timing rows and the analysis
+    parameters. A child is recomputed only when one of those changes.
+
+    Entries are pickled DataFrames named by their key. Reading an entry
+    touches its modification time, and after every write the least
+    recently used entries are deleted until the cache fits in max_bytes.
+
+    cache_dir (string): folder holding the cache
+    max_bytes (int): size the cache is trimmed to
+    """
+
+    def __init__(self, cache_dir='.result_cache', max_bytes=256 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(npz_path, timestamps, trial_rows, params):
+        """
+        Returns the hash of the inputs of one child's analysis
+
+        npz_path (string): path to the iCatcher .npz output
+        timestamps (array-like of int): time stamp of each frame in ms
+        trial_rows (DataFrame): the child's trial timing rows
+        params (dict): analysis parameters, must be JSON serializable
+        rtype: string
+        """
+        digest = hashlib.sha256()
+        with open(npz_path, 'rb') as npz_file:
+            for block in iter(lambda: npz_file.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(np.ascontiguousarray(timestamps, dtype=np.int32).tobytes())
+        digest.update(trial_rows.to_csv().encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / (key + '.pkl')
+
+    def get(self, key):
+        """
+        rtype: DataFrame, the cached rows, or None if key is not cached
+        """
+        path = self._path(key)
+        try:
+            rows = pd.read_pickle(path)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rows
+
+    def put(self, key, rows):
+        """
+        Caches the rows computed for key, then evicts old entries
+
+        rtype: None
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                rows.to_pickle(tmp_file)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def _written_path(self, data_filename):
+        name = hashlib.sha256(os.path.abspath(data_filename).encode()).hexdigest()[:16]
+        return self.cache_dir / 'written' / (name + '.json')
+
+    def written(self, data_filename):
+        """
+        Returns the key each child's latest rows in an output file were
+        computed from, as saved by save_written. A child can only be skipped
+        when its current key is the one its latest rows came from: after
+        running with inputs A, then B, then A again, the third run is a
+        cache hit but the latest rows in the output are still B's.
+
+        data_filename (string): the output file
+        rtype: dict, child ID -> key
+        """
+        try:
+            with open(self._written_path(data_filename), 'r') as written_file:
+                return json.load(written_file)
+        except FileNotFoundError:
+            return {}
+
+    def save_written(self, data_filename, written):
+        """
+        Saves the child ID -> key dict of written for data_filename
+
+        rtype: None
+        """
+        path = self._written_path(data_filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(written, tmp_file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        """
+        Deletes least recently used entries until the cache fits in
+        max_bytes
+
+        rtype: None
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                # already evicted by another process
+                pass
+            total -= size
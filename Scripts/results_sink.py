@@ -0,0 +1,451 @@
+import contextlib
+import os
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+class CsvResultsSink:
+    """
+    Output file that rows are only ever appended to. The processed child
+    IDs and the row count are read once when the sink is opened, and each
+    child's rows are added with a single append of the whole block, so
+    earlier rows are never rewritten. After a block is synced, the size of
+    the file is recorded in a hidden .[NAME].committed file next to it; on
+    the next open, anything after the last recorded size, i.e. the block a
+    crash interrupted, is cut off, so that child is analyzed again. A file
+    without a record, e.g. one written before there were records or
+    replaced since, is only cut back to its last complete line.
+
+    The file keeps the BBB_output.csv layout, including the unnamed
+    running index column.
+
+    path (string): path to the .csv file
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.committed_path = self.path.with_name('.' + self.path.name + '.committed')
+        self._load()
+
+    def _load(self):
+        self.ids = set()
+        self.num_rows = 0
+        # columns of the header, without the index, None for a new file
+        self.columns = None
+
+        if not self.path.is_file():
+            self.committed_path.unlink(missing_ok=True)
+            return
+
+        self._drop_uncommitted()
+        if self.path.stat().st_size == 0:
+            return
+        children = pd.read_csv(self.path, usecols=['child'])['child']
+        self.ids = set(children.unique())
+        self.num_rows = len(children)
+        self.columns = list(pd.read_csv(self.path, index_col=0, nrows=0).columns)
+
+    def __contains__(self, child_id):
+        return child_id in self.ids
+
+    def check_columns(self, columns):
+        """
+        Raises a ValueError if rows with columns cannot be appended, because
+        the file already has a header with other columns, e.g. when
+        --metrics is added or changed for an existing output file
+
+        columns (List[string]): columns of the rows to append
+        rtype: None
+        """
+        if self.columns is not None and list(columns) != self.columns:
+            raise ValueError('{} has columns {}, rows with columns {} would not line up with them; '
+                             'write to a new output file'.format(self.path, self.columns, list(columns)))
+
+    def _committed_size(self, inode):
+        """
+        rtype: int, size of the file with inode after its last complete
+                block, or None if there is no record of it
+        """
+        try:
+            lines = self.committed_path.read_bytes().split(b'\n')
+        except FileNotFoundError:
+            return None
+        # the last line is empty, or a record a crash cut short
+        complete = [line.split() for line in lines[:-1] if line]
+        if not complete or int(complete[-1][1]) != inode:
+            return None
+        return int(complete[-1][0])
+
+    def _drop_uncommitted(self):
+        with open(self.path, 'rb+') as output_file:
+            inode = os.fstat(output_file.fileno()).st_ino
+            committed = self._committed_size(inode)
+            size = output_file.seek(0, os.SEEK_END)
+            if committed is not None and committed <= size:
+                if committed < size:
+                    print('{}: dropping {} bytes of a block that was not completely written'.format(
+                        self.path, size - committed))
+                    output_file.truncate(committed)
+            else:
+                # no record, or the file was replaced since
+                output_file.seek(0)
+                data = output_file.read()
+                if data and not data.endswith(b'\n'):
+                    output_file.truncate(data.rfind(b'\n') + 1)
+            size = output_file.seek(0, os.SEEK_END)
+        # start the record over, it only has to hold the latest size
+        self._record(size, inode, truncate=True)
+
+    def _record(self, size, inode, truncate=False):
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if truncate else os.O_APPEND)
+        fd = os.open(self.committed_path, flags, 0o644)
+        try:
+            _write_all(fd, b'%d %d\n' % (size, inode))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, df):
+        """
+        Appends the rows for one child
+
+        df (DataFrame): rows made by get_child_rows
+        rtype: None
+        """
+        self.check_columns(df.columns)
+        df = df.set_axis(range(self.num_rows, self.num_rows + len(df)))
+        new_file = not self.path.is_file() or self.path.stat().st_size == 0
+        block = df.to_csv(header=new_file)
+
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            _write_all(fd, block.encode())
+            os.fsync(fd)
+            stat = os.fstat(fd)
+        finally:
+            os.close(fd)
+        self._record(stat.st_size, stat.st_ino)
+
+        self.ids.update(df['child'].unique())
+        self.num_rows += len(df)
+        self.columns = list(df.columns)
+
+    def read(self):
+        """
+        rtype: DataFrame, all rows written so far
+        """
+        if not self.path.is_file():
+            return pd.DataFrame()
+        return pd.read_csv(self.path, index_col=0)
+
+    def export(self, data_filename=None):
+        """
+        Writes the rows in the BBB_output.csv layout. If a child was
+        written more than once, only its latest rows are kept.
+
+        data_filename (string): path to write to, defaults to compacting
+                the sink's own file in place
+        rtype: None
+        """
+        export_csv(self.read(), data_filename or self.path)
+        if data_filename is None:
+            # the file was replaced, start over from its new contents
+            self.committed_path.unlink(missing_ok=True)
+            self._load()
+
+
+class SqliteResultsSink:
+    """
+    Same as CsvResultsSink but keeps rows in an SQLite table, with every
+    child's rows added in one transaction
+
+    path (string): path to the .sqlite/.db file
+    """
+
+    TABLE = 'results'
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.connection = sqlite3.connect(str(self.path))
+        self.ids = set()
+
+        exists = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (self.TABLE,)).fetchone()
+        if exists:
+            self.ids = {row[0] for row in self.connection.execute(
+                'SELECT DISTINCT child FROM {}'.format(self.TABLE))}
+
+    def __contains__(self, child_id):
+        return child_id in self.ids
+
+    def check_columns(self, columns):
+        """
+        Raises a ValueError if rows with columns cannot be appended to the
+        existing table, see CsvResultsSink.check_columns
+
+        rtype: None
+        """
+        existing = [row[1] for row in self.connection.execute('PRAGMA table_info({})'.format(self.TABLE))]
+        if existing and list(columns) != existing:
+            raise ValueError('{} has columns {}, rows with columns {} would not line up with them; '
+                             'write to a new output file'.format(self.path, existing, list(columns)))
+
+    def append(self, df):
+        """
+        Appends the rows for one child
+
+        df (DataFrame): rows made by get_child_rows
+        rtype: None
+        """
+        with self.connection:
+            df.to_sql(self.TABLE, self.connection, if_exists='append', index=False)
+        self.ids.update(df['child'].unique())
+
+    def read(self):
+        """
+        rtype: DataFrame, all rows written so far
+        """
+        if not self.ids:
+            return pd.DataFrame()
+        return pd.read_sql('SELECT * FROM {} ORDER BY rowid'.format(self.TABLE), self.connection)
+
+    def export(self, data_filename):
+        """
+        Writes the rows to a .csv file in the BBB_output.csv layout. If a
+        child was written more than once, only its latest rows are kept.
+
+        data_filename (string): path of the .csv file
+        rtype: None
+        """
+        export_csv(self.read(), data_filename)
+
+
+# null partition value, as pyarrow names it
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('writing .parquet results needs pyarrow, install it with pip install pyarrow')
+    return pyarrow, pyarrow.parquet
+
+
+class ParquetResultsSink:
+    """
+    Parquet dataset of per-trial results, in a folder partitioned by
+    session and child:
+        [path]/trials/session=[SESSION]/child=[CHILD_ID]/part-[TIME].parquet
+    Each child's rows are one small file, so appending never touches
+    another child's data, and a child written again replaces its own file.
+    Columns are typed, trial_type and stim_type are dictionary encoded and
+    child and session come from the folder names, so reads filtering on
+    them only open the matching files.
+
+    Labeled per-frame data can be kept the same way under [path]/frames,
+    see write_frames.
+
+    path (string): path to the .parquet folder
+    """
+
+    # column types of the rows made by get_child_rows, any others are inferred
+    TYPES = {
+        'trial_num': 'int32',
+        'trial_type': 'dictionary',
+        'stim_type': 'dictionary',
+        'confidence': 'float64',
+        'iCatcher_on(s)': 'float64',
+        'iCatcher_off(s)': 'float64',
+    }
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.trials_dir = self.path / 'trials'
+        self.ids = {child.name.split('=', 1)[1] for child in self.trials_dir.glob('session=*/child=*')
+                    if any(child.glob('*.parquet'))}
+
+    def __contains__(self, child_id):
+        return child_id in self.ids
+
+    def check_columns(self, columns):
+        """
+        Every child's rows are a file with its own schema, so rows with any
+        columns can be added
+
+        rtype: None
+        """
+
+    def append(self, df):
+        """
+        Writes the rows for one child
+
+        df (DataFrame): rows made by get_child_rows
+        rtype: None
+        """
+        pa, pq = _pyarrow()
+        child_id, session = df['child'].iloc[0], df['session'].iloc[0]
+
+        df = df.drop(columns=['child', 'session'])
+        for column, kind in self.TYPES.items():
+            if column in df.columns and kind != 'dictionary':
+                df[column] = df[column].astype(kind)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        for column, kind in self.TYPES.items():
+            if kind == 'dictionary' and column in df.columns:
+                index = table.schema.get_field_index(column)
+                values = table[column]
+                if pa.types.is_null(values.type):
+                    # e.g. no stimulus info for the child, Parquet cannot
+                    # write a dictionary of nulls
+                    values = values.cast(pa.string())
+                table = table.set_column(index, column, values.dictionary_encode())
+
+        _write_partition(pq, table, self.trials_dir, session, child_id)
+        self.ids.add(child_id)
+
+    def read(self, filters=None, columns=None):
+        """
+        Reads rows written so far
+
+        filters (List[Tuple]): pyarrow filters, e.g. [('child', 'in', ids)]
+                or [('session', '=', '1'), ('trial_num', '<=', 3)]
+        columns (List[string]): columns to read, all if None
+        rtype: DataFrame
+        """
+        return _read_partitions(self.trials_dir, filters, columns, ['child', 'session'])
+
+    def export(self, data_filename):
+        """
+        Writes the rows to a .csv file in the BBB_output.csv layout, ordered
+        by session and child
+
+        data_filename (string): path of the .csv file
+        rtype: None
+        """
+        export_csv(self.read(), data_filename)
+
+
+def write_frames(path, child_id, session, frames):
+    """
+    Saves one child's labeled frames (frame, on_off, confidence, time_ms
+    and trial columns, as made by read_convert_output and assign_trial) to
+    [path]/frames/session=[SESSION]/child=[CHILD_ID] of a Parquet results
+    folder, replacing any saved before
+
+    rtype: None
+    """
+    pa, pq = _pyarrow()
+    table = pa.table({
+        'frame': pa.array(frames['frame'].to_numpy(), pa.int32()),
+        'on': pa.array((frames['on_off'] == 'on').to_numpy(), pa.bool_()),
+        'confidence': pa.array(frames['confidence'].to_numpy(), pa.float32()),
+        'time_ms': pa.array(frames['time_ms'].to_numpy(), pa.int32()),
+        'trial': pa.array(frames['trial'].to_numpy(), pa.int16()),
+    })
+    _write_partition(pq, table, Path(path) / 'frames', session, child_id)
+
+
+def read_frames(path, filters=None, columns=None):
+    """
+    Reads labeled frames saved by write_frames
+
+    path (string): path to the .parquet results folder
+    filters (List[Tuple]): pyarrow filters, e.g. [('child', '=', child_id)]
+    columns (List[string]): columns to read, all if None
+    rtype: DataFrame
+    """
+    return _read_partitions(Path(path) / 'frames', filters, columns, ['child', 'session'])
+
+
+def _write_all(fd, data):
+    """
+    Writes all of data to fd, which os.write does not guarantee
+    """
+    data = memoryview(data)
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _write_partition(pq, table, root, session, child_id):
+    """
+    Writes table as the only file of its session/child partition, through
+    a hidden temporary file that readers skip
+    """
+    folder = root / 'session={}'.format(NULL_PARTITION if session is None else session) / 'child={}'.format(child_id)
+    folder.mkdir(parents=True, exist_ok=True)
+    old_files = list(folder.glob('*.parquet'))
+
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+    os.close(fd)
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, folder / 'part-{}.parquet'.format(time.time_ns()))
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    for old_file in old_files:
+        old_file.unlink()
+
+
+def _read_partitions(root, filters, columns, first_columns):
+    pa, pq = _pyarrow()
+    if not root.is_dir():
+        return pd.DataFrame()
+
+    import pyarrow.dataset as ds
+    partitioning = ds.partitioning(pa.schema([('session', pa.string()), ('child', pa.string())]), flavor='hive')
+    table = pq.read_table(root, partitioning=partitioning, filters=filters, columns=columns)
+    df = table.to_pandas()
+    # put the partition columns first, like the other sinks
+    ordered = [column for column in first_columns if column in df.columns]
+    return df[ordered + [column for column in df.columns if column not in ordered]]
+
+
+def open_sink(data_filename):
+    """
+    Opens the results sink matching the extension of data_filename: .csv
+    for CsvResultsSink, .sqlite or .db for SqliteResultsSink, .parquet for
+    ParquetResultsSink
+
+    rtype: CsvResultsSink, SqliteResultsSink or ParquetResultsSink
+    """
+    suffix = Path(data_filename).suffix
+    if suffix in ('.sqlite', '.db'):
+        return SqliteResultsSink(data_filename)
+    if suffix == '.csv':
+        return CsvResultsSink(data_filename)
+    if suffix == '.parquet':
+        return ParquetResultsSink(data_filename)
+    raise ValueError('unsupported results file {}, expected .csv, .sqlite, .db or .parquet'.format(data_filename))
+
+
+def export_csv(df, data_filename):
+    """
+    Writes df to data_filename in the BBB_output.csv layout, keeping only
+    the last block of rows for every child, through a temporary file so
+    the old file stays intact until the new one is complete
+    """
+    if len(df):
+        # rows of a child's latest run are the ones after its last trial_num 1
+        run = (df['trial_num'] == 1).groupby(df['child']).cumsum()
+        latest = run.groupby(df['child']).transform('max')
+        df = df[run == latest]
+    df = df.reset_index(drop=True)
+
+    data_filename = Path(data_filename)
+    fd, tmp_path = tempfile.mkstemp(dir=data_filename.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            df.to_csv(tmp_file)
+        os.replace(tmp_path, data_filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
@@ -0,0 +1,164 @@
+import numpy as np
+
+from Scripts.looks import LookSegments
+from Scripts.trials import label_frames
+
+# frames per chunk when streaming an iCatcher output
+CHUNK_SIZE = 1 << 16
+
+
+class TrialAccumulator:
+    """
+    Sums per-trial on and off time and on-look confidence over an iCatcher
+    output fed in consecutive chunks of frames, so a recording never has to
+    be held in memory at once. Gives the same values as building the whole
+    per-frame DataFrame: on/off totals from LookSegments.trial_totals and
+    the mean confidence of on frames assigned to each trial by label_frames.
+
+    A frame lasts until the next frame's time stamp, which is only known
+    once the next chunk arrives, so the last frame of each chunk is held
+    back and carried into the next one. The last frame of the recording
+    lasts the median frame interval, which is kept exactly as a count of
+    each interval length seen.
+
+    trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+    """
+
+    def __init__(self, trial_sets):
+        self.trial_sets = trial_sets
+        num_trials = len(trial_sets)
+        self.on_ms = np.zeros(num_trials, dtype=np.int64)
+        self.off_ms = np.zeros(num_trials, dtype=np.int64)
+        self.confidence_sum = np.zeros(num_trials + 1)
+        self.on_frames = np.zeros(num_trials + 1, dtype=np.int64)
+        self.max_trial = 0
+        self.num_frames = 0
+        self._intervals = {}
+        self._carry = None
+        self._looks = []
+
+    def add(self, on, confidence, time_ms):
+        """
+        Adds the next chunk of frames
+
+        on (array-like of bool): whether each frame is an on look
+        confidence (array-like of float): iCatcher confidence of each frame
+        time_ms (array-like of int): time stamp of each frame in ms
+        rtype: None
+        """
+        on = np.asarray(on, dtype=bool)
+        confidence = np.asarray(confidence, dtype=np.float64)
+        time_ms = np.asarray(time_ms, dtype=np.int64)
+        if len(on) == 0:
+            return
+        self.num_frames += len(on)
+
+        # frame labels don't depend on neighbouring frames, so count them now
+        trials = label_frames(time_ms, self.trial_sets)
+        self.max_trial = max(self.max_trial, int(trials.max()))
+        self.confidence_sum += np.bincount(trials[on], weights=confidence[on], minlength=len(self.confidence_sum))
+        self.on_frames += np.bincount(trials[on], minlength=len(self.on_frames))
+
+        if self._carry is not None:
+            on = np.concatenate([self._carry[0], on])
+            confidence = np.concatenate([self._carry[1], confidence])
+            time_ms = np.concatenate([self._carry[2], time_ms])
+
+        lengths, counts = np.unique(np.diff(time_ms), return_counts=True)
+        for length, count in zip(lengths.tolist(), counts.tolist()):
+            self._intervals[length] = self._intervals.get(length, 0) + count
+
+        self._carry = on[-1:], confidence[-1:], time_ms[-1:]
+        if len(on) > 1:
+            self._add_segments(on[:-1], confidence[:-1], time_ms[:-1], time_ms[-1])
+
+    def _add_segments(self, on, confidence, time_ms, end_ms):
+        looks = LookSegments.from_frames(on, confidence, time_ms, end_ms)
+        self._looks.append(looks)
+        on_ms, off_ms = looks.trial_totals(self.trial_sets)
+        self.on_ms += on_ms.astype(np.int64)
+        self.off_ms += off_ms.astype(np.int64)
+
+    def median_interval(self):
+        """
+        Returns the median interval between consecutive frames, as np.median
+        would over all of them
+
+        rtype: float
+        """
+        if not self._intervals:
+            return 0
+        lengths = sorted(self._intervals)
+        seen = np.cumsum([self._intervals[length] for length in lengths])
+        total = seen[-1]
+        lower = lengths[np.searchsorted(seen, (total - 1) // 2, side='right')]
+        upper = lengths[np.searchsorted(seen, total // 2, side='right')]
+        return (lower + upper) / 2
+
+    def finish(self):
+        """
+        Adds the held back last frame, lasting the median frame interval
+
+        rtype: None
+        """
+        if self._carry is not None:
+            on, confidence, time_ms = self._carry
+            self._add_segments(on, confidence, time_ms, time_ms[-1] + int(self.median_interval()))
+            self._carry = None
+
+    def looks(self):
+        """
+        Returns the runs of the whole recording so far. There is one per
+        look, not per frame, so these stay small however long the
+        recording is.
+
+        rtype: LookSegments
+        """
+        return LookSegments.concatenate(self._looks)
+
+    def on_off_times(self):
+        """
+        Returns [on time, off time] in seconds for each trial, like
+        LookSegments.on_off_times
+
+        rtype: List[List[float]]
+        """
+        return np.round(np.column_stack([self.on_ms, self.off_ms]) / 1000, 3).tolist()
+
+    def on_confidence(self):
+        """
+        Returns the mean confidence of the on frames in each trial, NaN for
+        a trial without any
+
+        rtype: np.ndarray of float
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.confidence_sum[1:] / self.on_frames[1:]
+
+
+def stream_trial_totals(output, timestamps, trial_sets, chunk_size=CHUNK_SIZE):
+    """
+    Streams an iCatcher output and its frame time stamps through a
+    TrialAccumulator chunk by chunk. Peak memory depends on chunk_size, not
+    on the length of the recording, if timestamps is memory-mapped (see
+    TimestampStore(mmap=True)).
+
+    output (ICatcherOutput): the child's iCatcher output
+    timestamps (array-like of int): time stamp of each frame in ms
+    trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+    chunk_size (int): frames per chunk
+    rtype: TrialAccumulator
+    """
+    totals = TrialAccumulator(trial_sets)
+    num_frames = 0
+    for labels, confidence in output.iter_chunks(chunk_size):
+        end = num_frames + len(labels)
+        if end <= len(timestamps):
+            totals.add(labels > 0, confidence, timestamps[num_frames:end])
+        num_frames = end
+
+    if num_frames != len(timestamps):
+        raise ValueError('{} has {} frames but the video has {} time stamps'.format(
+            output.path, num_frames, len(timestamps)))
+    totals.finish()
+    return totals
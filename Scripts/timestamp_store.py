@@ -0,0 +1,126 @@
+import contextlib
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+
+class TimestampStore:
+    """
+    Per-video frame time stamp cache. Each video is kept as its own int32
+    .npy array with a small .json file next to it holding the frame count,
+    so looking a video up only touches its own two files and adding a video
+    never rewrites anything already stored.
+
+    Files are written to a temporary name and moved into place with
+    os.replace, and the .json is written after the array, so readers never
+    see a half written entry and several jobs can write to the same store
+    at once.
+
+    root (string): directory holding the cache
+    mmap (bool): if True, arrays are memory-mapped read-only instead of
+            being read into memory
+    """
+
+    def __init__(self, root='video_data', mmap=False):
+        self.root = Path(root)
+        self.mmap = mmap
+
+    def _base(self, child_id, session=None):
+        folder = self.root
+        if session:
+            folder = folder / ('session' + str(session))
+        return folder / child_id
+
+    def get(self, child_id, session=None):
+        """
+        Returns (timestamps, num_frames) for a stored video, or None if
+        child_id has not been stored for session
+
+        child_id (string): unique child ID associated with subject
+        session (string): the experiment session of the video, if any
+        rtype: Tuple[np.ndarray, int] or None
+        """
+        base = self._base(child_id, session)
+        try:
+            with open(base.with_suffix('.json'), 'r') as meta_file:
+                meta = json.load(meta_file)
+        except FileNotFoundError:
+            return None
+
+        timestamps = np.load(base.with_suffix('.npy'), mmap_mode='r' if self.mmap else None)
+        return timestamps, meta['num_frames']
+
+    def put(self, child_id, timestamps, num_frames, session=None):
+        """
+        Stores the time stamps of a video. Writing a child_id that is
+        already stored replaces it with the same atomic moves.
+
+        child_id (string): unique child ID associated with subject
+        timestamps (array-like of int): time stamp of each frame in ms
+        num_frames (int): number of frames in the video
+        session (string): the experiment session of the video, if any
+        rtype: None
+        """
+        base = self._base(child_id, session)
+        base.parent.mkdir(parents=True, exist_ok=True)
+
+        timestamps = np.asarray(timestamps, dtype=np.int32)
+        meta = {'child': child_id, 'session': session,
+                'num_frames': int(num_frames), 'count': len(timestamps)}
+
+        self._write_atomic(base.with_suffix('.npy'), lambda f: np.save(f, timestamps))
+        self._write_atomic(base.with_suffix('.json'), lambda f: f.write(json.dumps(meta).encode()))
+
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.' + path.name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                write(tmp_file)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
+
+def migrate_json(json_path, store, session=None):
+    """
+    One-shot copy of the old monolithic video_data.json cache into a
+    TimestampStore. Videos already in the store are left untouched.
+
+    json_path (string): path to the old JSON cache, an array of
+            {child, timestamps, num_frames} dictionaries
+    store (TimestampStore): store to copy the videos into
+    session (string): the experiment session to file the videos under. The
+            old cache does not record sessions, so without one the videos
+            are only found by runs without --session
+    rtype: int, the number of videos copied
+    """
+    with open(json_path, 'r') as json_file:
+        data = json.load(json_file)
+
+    copied = 0
+    for vid in data:
+        if store.get(vid['child'], session) is not None:
+            continue
+        store.put(vid['child'], vid['timestamps'], vid['num_frames'], session)
+        copied += 1
+
+    return copied
+
+
+if __name__ == "__main__":
+    # usage: python -m Scripts.timestamp_store video_data.json video_data [SESSION]
+    # the old cache has no sessions, so give the session its videos were
+    # recorded in for run_analyze_output --session to find them
+    json_path, store_dir = sys.argv[1], sys.argv[2]
+    session = sys.argv[3] if len(sys.argv) > 3 else None
+    copied = migrate_json(json_path, TimestampStore(store_dir), session)
+    print('copied {} videos from {} to {}{}'.format(
+        copied, json_path, store_dir, ' for session ' + session if session else ''))
@@ -0,0 +1,142 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+
+
+class LookitTrialInfo:
+    """
+    Trial timing parsed from Lookit logs (lookit_trial_timing_info.csv, see
+    lookit_info/lookit_json_parser.py). The table is read once and split
+    per child, so every later lookup is a dictionary access. It is read
+    again if the file's modification time changes.
+
+    csv_path (string): path to the trial timing .csv
+    """
+
+    def __init__(self, csv_path):
+        self.csv_path = Path(csv_path)
+        self._mtime = None
+        self._by_session = False
+        self._children = {}
+        self._empty = None
+
+    def _refresh(self):
+        mtime = os.stat(self.csv_path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+
+        df = pd.read_csv(self.csv_path)
+        self._by_session = 'session_id' in df.columns
+        keys = ['child_id', 'session_id'] if self._by_session else ['child_id']
+
+        self._children = {}
+        for key, child_df in df.groupby(keys, sort=False):
+            if not self._by_session and isinstance(key, tuple):
+                key = key[0]
+            elif self._by_session:
+                # sessions are given as strings, e.g. --session 2
+                key = (key[0], str(key[1]))
+            self._children[key] = (get_trial_sets_from_df(child_df), child_df)
+        self._empty = df.iloc[:0]
+        self._mtime = mtime
+
+    def get(self, child_id, session_id=None):
+        """
+        Returns a list of [onset, offset] times for each trial in ms
+        relative to the start of the video, and the trial rows for the child
+
+        child_id (string): unique child ID associated with subject
+        session_id (string): session of the child; only used if the table
+                has a session_id column
+        rtype: Tuple[List[List[int]], DataFrame]
+        """
+        self._refresh()
+
+        key = (child_id, str(session_id)) if self._by_session else child_id
+        return self._children.get(key, ([], self._empty))
+
+
+class ManualTrialInfo:
+    """
+    Trial timing from manually formatted per-subject files in the format
+    the notebook describes: sub-[ID]_session-[ID]_trial_info.csv with onset
+    and offset columns, plus optionally
+    sub-[ID]_session-[ID]_experiment_onset.txt holding the ms from the start
+    of the video to the start of the experiment, which is added to the
+    trial times. Each child's files are read once, and again if either
+    one's modification time changes.
+
+    trial_info_dir (string): folder with the trial info .csv files
+    experiment_onsets_dir (string): folder with the experiment onset .txt
+            files, or None if trial times are already relative to the video
+    manifest (Manifest): index with 'trial_info' (and 'experiment_onset')
+            roots to take the files and their modification times from
+            instead of statting them, see Scripts/manifest.py, or None
+    """
+
+    def __init__(self, trial_info_dir, experiment_onsets_dir=None, manifest=None):
+        self.trial_info_dir = Path(trial_info_dir)
+        self.experiment_onsets_dir = Path(experiment_onsets_dir) if experiment_onsets_dir else None
+        self.manifest = manifest
+        self._children = {}
+
+    def get(self, child_id, session_id=None):
+        """
+        Returns a list of [onset, offset] times for each trial in ms
+        relative to the start of the video, and the trial rows for the child
+
+        child_id (string): unique child ID associated with subject
+        session_id (string): session of the child, 1 if None
+        rtype: Tuple[List[List[int]], DataFrame]
+        """
+        if session_id is None:
+            session_id = 1
+        name = 'sub-{}_session-{}'.format(child_id, session_id)
+        if self.manifest is not None:
+            paths, mtimes = self._lookup(child_id, session_id)
+        else:
+            paths = [self.trial_info_dir / (name + '_trial_info.csv')]
+            if self.experiment_onsets_dir:
+                paths.append(self.experiment_onsets_dir / (name + '_experiment_onset.txt'))
+            mtimes = tuple(os.stat(path).st_mtime_ns for path in paths)
+        trial_file = paths[0]
+        cached = self._children.get(name)
+        if cached is not None and cached[0] == mtimes:
+            return cached[1]
+
+        df = pd.read_csv(trial_file)
+
+        # note: relative means, trial onsets/offsets relative to the start of video
+        # if your video starts AFTER experiment starts, set as negative value in file
+        expt_onset = 0
+        if self.experiment_onsets_dir:
+            with open(paths[1]) as f:
+                expt_onset = int(f.read())
+        df['relative_onset'] = df['onset'] + expt_onset
+        df['relative_offset'] = df['offset'] + expt_onset
+
+        result = (get_trial_sets_from_df(df), df)
+        self._children[name] = (mtimes, result)
+        return result
+
+    def _lookup(self, child_id, session_id):
+        kinds = ['trial_info', 'experiment_onset'] if self.experiment_onsets_dir else ['trial_info']
+        entries = [self.manifest.get(kind, child_id, session_id) for kind in kinds]
+        for kind, entry in zip(kinds, entries):
+            if entry is None:
+                raise FileNotFoundError('no {} file for child {} session {} in the manifest'.format(
+                    kind, child_id, session_id))
+        return [entry['path'] for entry in entries], tuple(entry['mtime_ns'] for entry in entries)
+
+
+def get_trial_sets_from_df(df):
+    """
+    Returns the unique [onset, offset] pairs in ms of the trial rows in df,
+    in order, skipping trials without an onset or offset
+
+    df (DataFrame): trial rows with relative_onset and relative_offset columns
+    rtype: List[List[int]]
+    """
+    df_sets = df[['relative_onset', 'relative_offset']].dropna()
+    return df_sets.astype(int).drop_duplicates().values.tolist()
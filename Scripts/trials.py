@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def label_frames(time_ms, trial_sets):
+    """
+    Given frame time stamps and trial onsets and offsets, returns an array
+    mapping each frame to the 1-based index of the trial it falls in
+    (onset and offset inclusive), or 0 if it is not in any trial.
+
+    Trials are split into non-overlapping elementary intervals once, and
+    every frame is placed with a single searchsorted over their bounds, so
+    the cost is O(frames * log(trials)) instead of a Python loop per frame.
+    If trials overlap or are duplicated, a frame goes to the trial that
+    comes first in trial_sets, same as the old per-frame lookup.
+
+    time_ms (array-like of int): time stamp of each frame in ms
+    trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+    rtype: np.ndarray of int
+    """
+    times = np.asarray(time_ms)
+    labels = np.zeros(len(times), dtype=int)
+    if len(trial_sets) == 0:
+        return labels
+
+    sets = np.asarray(trial_sets, dtype=np.int64).reshape(-1, 2)
+    onsets = sets[:, 0]
+    # make offsets exclusive so every bound is the start of an interval
+    offsets = sets[:, 1] + 1
+
+    bounds = np.unique(np.concatenate([onsets, offsets]))
+    starts = bounds[:-1]
+
+    # which trials cover each elementary interval, first listed trial wins
+    covers = (onsets[None, :] <= starts[:, None]) & (offsets[None, :] > starts[:, None])
+    owner = np.where(covers.any(axis=1), covers.argmax(axis=1) + 1, 0)
+
+    interval = np.searchsorted(bounds, times, side='right') - 1
+    inside = (interval >= 0) & (interval < len(starts))
+    labels[inside] = owner[interval[inside]]
+
+    return labels
@@ -1,99 +1,313 @@
 # source code adapted from Yotam Erel
 
+import argparse
+import shutil
 import subprocess
+import time
 from pathlib import Path
 import json
-import pickle
 
-def get_frame_information(video_file_path, data_file_path='video_data.json'):
+import numpy as np
 
-    child_id = video_file_path.strip('.mp4').split('/')[-1]
+from Scripts.timestamp_store import TimestampStore
+from Scripts import mp4_timestamps
+
+# ways get_frame_information can get time stamps:
+#   'frames'  - ffprobe decodes the video stream, one time stamp per line
+#   'packets' - ffprobe reads packet time stamps from the container, no decoding
+#   'json'    - old full ffprobe -show_frames JSON dump, kept for comparison
+#   'mp4'     - reads the MP4 sample tables directly, no ffprobe needed
+#   'auto'    - 'mp4', falling back to 'frames' for files it can't read
+PROBE_MODES = ('frames', 'packets', 'json', 'mp4', 'auto')
+
+def get_frame_information(video_file_path, store='video_data', session=None, mode='auto'):
+    """
+    Returns the time stamp in ms of every frame in a video and the number of
+    frames, running ffprobe only if the video is not already in store
+
+    video_file_path (string): path to the .mp4 video
+    store (string or TimestampStore): time stamp cache, or the directory of
+            one. See Scripts/timestamp_store.py to migrate an old
+            video_data.json cache
+    session (string): the experiment session of the video, if any
+    mode (string): how time stamps are extracted, one of PROBE_MODES
+    rtype: Tuple[np.ndarray, int]
+    """
+    child_id = Path(video_file_path).stem
+
+    if not isinstance(store, TimestampStore):
+        store = TimestampStore(store)
 
     # if frame information already exists, return from data
-    output_file = Path(data_file_path)
-    if output_file.is_file():
-        with open(data_file_path, 'r') as json_file:
-            data = json.load(json_file)
+    stored = store.get(child_id, session)
+    if stored is not None:
+        return stored
+
+    frame_times_ms, num_frames = probe_frame_times(video_file_path, mode)
+    return save_frame_times(store, child_id, frame_times_ms, num_frames, session)
+
+
+def save_frame_times(store, child_id, frame_times_ms, num_frames, session=None):
+    """
+    Checks probed time stamps and adds them to store
+
+    store (TimestampStore): time stamp cache
+    child_id (string): unique child ID associated with the video
+    frame_times_ms (np.ndarray): time stamp of each frame in ms
+    num_frames (int): number of frames in the video stream
+    session (string): the experiment session of the video, if any
+    rtype: Tuple[np.ndarray, int]
+    """
+    # did not find video
+    if len(frame_times_ms) == 0:
+        return frame_times_ms, 0
+
+    assert frame_times_ms[0] < 10.0
+
+    store.put(child_id, frame_times_ms, num_frames, session)
+
+    # returns timestamps in milliseconds
+    return frame_times_ms, num_frames
+
+
+def probe_frame_times(video_file_path, mode='frames'):
+    """
+    Runs ffprobe on a video, or reads its MP4 sample tables, and returns the
+    time stamp in ms of each video frame along with the number of frames in
+    the video stream. Prints how many frames per second were probed so
+    modes can be compared.
+
+    In 'frames' and 'packets' mode ffprobe only prints the time stamp field
+    of the first video stream, one per line, which is parsed as it arrives
+    into an array preallocated from the stream's frame count, so memory
+    stays bounded by the number of frames rather than by ffprobe's output.
+
+    video_file_path (string): path to the .mp4 video
+    mode (string): one of PROBE_MODES
+    rtype: Tuple[np.ndarray, int]
+    """
+    if mode not in PROBE_MODES:
+        raise ValueError('unknown ffprobe mode {}, expected one of {}'.format(mode, PROBE_MODES))
+
+    start = time.perf_counter()
+    frame_times, num_frames, mode = read_mp4_frame_times(video_file_path, mode)
+
+    if mode == 'json':
+        frame_times, num_frames = _probe_json(video_file_path)
+    elif mode != 'mp4':
+        frame_times, num_frames = _probe_lines(video_file_path, mode)
+    elapsed = time.perf_counter() - start
+
+    frame_times_ms = to_ms(frame_times)
+
+    if len(frame_times_ms):
+        print('probed {} frames of {} in {:.2f}s ({:.0f} frames/s, {} mode)'.format(
+            len(frame_times_ms), video_file_path, elapsed, len(frame_times_ms) / max(elapsed, 1e-9), mode))
+
+    return frame_times_ms, num_frames
+
+
+def read_mp4_frame_times(video_file_path, mode):
+    """
+    In 'mp4' and 'auto' mode, reads the time stamps in seconds from the
+    MP4 sample tables. 'auto' falls back to ffprobe's 'frames' mode for
+    files that cannot be read this way, if ffprobe is installed.
+
+    video_file_path (string): path to the .mp4 video
+    mode (string): one of PROBE_MODES
+    rtype: Tuple[np.ndarray, int, string], the time stamps and number of
+            frames, or None and 0 if they still have to be probed, and the
+            mode they were or have to be probed with
+    """
+    if mode not in ('mp4', 'auto'):
+        return None, 0, mode
+    try:
+        frame_times, num_frames = mp4_timestamps.read_frame_times(video_file_path)
+        return frame_times, num_frames, 'mp4'
+    except ValueError as e:
+        if mode == 'mp4' or shutil.which('ffprobe') is None:
+            raise
+        print('falling back to ffprobe: {}'.format(e))
+        return None, 0, 'frames'
+
+
+def to_ms(frame_times):
+    """
+    Converts time stamps in seconds to ms, truncating like int() did
+
+    rtype: np.ndarray of int32
+    """
+    return (frame_times * 1000).astype(np.int32)
+
+
+def count_command(video_file_path):
+    """
+    ffprobe command printing the frame count of the first video stream
+    """
+    return [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=nb_frames",
+        "-of", "csv=p=0",
+        video_file_path
+        ]
+
+
+def parse_count(output):
+    """
+    Reads the output of count_command, None if the container does not
+    record the frame count
+    """
+    try:
+        return int(output.strip().rstrip(','))
+    except ValueError:
+        return None
+
+
+def times_command(video_file_path, mode):
+    """
+    ffprobe command printing one time stamp per line for the first video
+    stream, in 'frames' or 'packets' mode
+    """
+    if mode == 'frames':
+        entries = "frame=best_effort_timestamp_time"
+    else:
+        entries = "packet=pts_time"
+
+    return [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", entries,
+        "-of", "csv=p=0",
+        video_file_path
+        ]
+
+
+def parse_time(line):
+    """
+    Reads one line of times_command output, None for lines without a time
+    """
+    value = line.strip().rstrip(',')
+    if not value or value == 'N/A':
+        return None
+    return float(value)
+
+
+class FrameTimes:
+    """
+    Collects the time stamps of times_command output as its lines arrive,
+    into an array preallocated from the stream's frame count
+
+    nb_frames (int): frame count from count_command, None if unknown
+    """
+
+    def __init__(self, nb_frames):
+        self.nb_frames = nb_frames
+        self.frame_times = np.empty(nb_frames or 1024, dtype=np.float64)
+        self.count = 0
+
+    def add(self, line):
+        value = parse_time(line)
+        if value is None:
+            return
+        if self.count == len(self.frame_times):
+            self.frame_times = np.resize(self.frame_times, 2 * len(self.frame_times))
+        self.frame_times[self.count] = value
+        self.count += 1
+
+    def result(self, mode):
+        """
+        rtype: Tuple[np.ndarray, int], the time stamps in seconds and the
+                number of frames
+        """
+        frame_times = self.frame_times[:self.count]
+        # packets come in decode order, frames come out in presentation order
+        if mode == 'packets':
+            frame_times.sort()
+
+        return frame_times, self.nb_frames if self.nb_frames is not None else self.count
+
+
+def _count_frames(video_file_path):
+    """
+    Reads the frame count of the first video stream from the container
+    header, or None if the container does not record it
+    """
+    result = subprocess.run(count_command(video_file_path), stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    return parse_count(result.stdout)
+
+
+def _probe_lines(video_file_path, mode):
+    frame_times = FrameTimes(_count_frames(video_file_path))
+    commands_list = times_command(video_file_path, mode)
 
-        for vid in data:
-            if vid['child'] == child_id:
-                return vid['timestamps'], vid['num_frames']
+    ffprobe = subprocess.Popen(commands_list, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True)
+    with ffprobe.stdout:
+        for line in ffprobe.stdout:
+            frame_times.add(line)
+    ffprobe.wait()
 
+    return frame_times.result(mode)
+
+
+def _probe_json(video_file_path):
     commands_list = [
         "ffprobe",
         "-show_frames",
         "-show_streams",
         "-print_format", "json",
         video_file_path
-        ]  
+        ]
 
     # run command on terminal and store output as a json file
     ffmpeg = subprocess.Popen(commands_list, stderr=subprocess.PIPE, stdout = subprocess.PIPE)
     output, err = ffmpeg.communicate()
-    output = json.loads(output)
+    output = json.loads(output or '{}')
 
     frames = output.get('frames', [])
     # did not find video
-    if not frames: 
-        return [], []
+    if not frames:
+        return np.array([], dtype=np.float64), 0
 
-    # filter out video frame info only 
+    # filter out video frame info only
     video_frames = [frame for frame in output['frames'] if frame['media_type'] == 'video']
     frame_times = [frame["pkt_pts_time"] for frame in video_frames]
     video_stream_info = next(s for s in output['streams'] if s['codec_type'] == 'video')
     # assert len(frame_times) == int(video_stream_info["nb_frames"])
 
-    # convert to milliseconds
-    frame_times_ms = [int(1000*float(x)) for x in frame_times]
-    assert frame_times_ms[0] < 10.0
-
-    # write to json if video information extracted
-    if frame_times_ms:
-        write_to_json(child_id, frame_times_ms, int(video_stream_info["nb_frames"]), data_file_path)
-
-    # returns timestamps in milliseconds
-    return frame_times_ms, int(video_stream_info["nb_frames"])
+    return np.array(frame_times, dtype=np.float64), int(video_stream_info["nb_frames"])
 
-# did not include: video_stream_info["time_base"] 
+# did not include: video_stream_info["time_base"]
 
 
-def write_to_json(child_id, timestamps, num_frames, filename):
-    """
-    checks if output file is in directory. if not, writes new JSON file
-    consisting of an array of dictionaries. Adds 
-    {child: child_id, timestamps: timestamps, num_frames: numframes} if
-    child_id not already in data.
-    
-    child_id (string): unique child ID associated with subject
-    timestamps (List[int]):
-    num_frames (int): number of frames in the video
-    rtype: None
+def main(argv=None):
     """
-    vid_data = {
-        'child': child_id,
-        'timestamps': timestamps,
-        'num_frames': num_frames
-    }
-
-    output_file = Path(filename)
+    Command line entry point, also run by mcs.py probe. Gets the frame time
+    stamps of videos into the store, or with --compare times every probe
+    mode on them without storing anything
 
-    # if no data file with name filename exists, create new array 
-    if output_file.is_file():
-        with open(filename, 'r') as json_file:
-            data = json.load(json_file)
-    else:
-        data = []
+    argv (List[string]): arguments, sys.argv[1:] if None
+    """
+    parser = argparse.ArgumentParser(description='get the frame time stamps of videos')
+    parser.add_argument('videos', nargs='+', help='.mp4 videos to probe')
+    parser.add_argument('--mode', default='auto', choices=PROBE_MODES)
+    parser.add_argument('--store', default='video_data', help='directory of the time stamp store')
+    parser.add_argument('--session', default=None, help='experiment session of the videos')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare the throughput of the probe modes instead of storing time stamps')
+    args = parser.parse_args(argv)
 
-    # write data if child not already in data
-    if not any([child_id in x['child'] for x in data]):
-        data.append(vid_data)
-    with open(filename, 'w') as json_file:
-        json.dump(data, json_file)
+    if args.compare:
+        for vid_path in args.videos:
+            for probe_mode in PROBE_MODES:
+                probe_frame_times(vid_path, probe_mode)
+        return
 
-    return
+    store = TimestampStore(args.store)
+    for vid_path in args.videos:
+        _, num_frames = get_frame_information(vid_path, store, args.session, args.mode)
+        print('{}: {} frames'.format(vid_path, num_frames))
 
-    
 
 if __name__ == "__main__":
-    vid_path = "../TEMP_video/3GSKJ5.mp4"
-    timestamps = get_frame_information(vid_path)[0]
\ No newline at end of file
+    main()
@@ -0,0 +1,258 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# seconds a file must go unchanged after its last write before it is reported
+DEBOUNCE_S = 0.2
+
+# seconds between scans when polling
+POLL_INTERVAL_S = 1.0
+
+# inotify events: a file was closed after writing, moved in, deleted or moved
+# out. See inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT = struct.Struct('iIII')
+
+
+class Watcher:
+    """
+    Reports files that are added or changed in a set of folders, once they
+    have stopped changing. Uses inotify on Linux, and otherwise, or if
+    inotify is not available or not wanted (it does not see changes made
+    on other machines of a network filesystem), scans the folders every
+    poll_interval seconds.
+
+    A changed file is only reported after its size and modification time
+    have stayed the same for debounce seconds, and with inotify only once
+    the writer has closed it, so files still being written are not picked
+    up half done. When polling a file must also be unchanged between two
+    scans. Files present when the watcher starts are not reported.
+        with Watcher(['iCatcherOutput'], suffixes=['.npz']) as watcher:
+            for paths in watcher:
+                ...
+
+    paths (List): folders to watch, or single files, which are watched
+            through their folder. A (folder, suffixes) pair watches a folder
+            for files with its own suffixes instead of the default ones
+    suffixes (List[string]): only report files ending in one of these, or
+            None for all (single files in paths are always reported)
+    debounce (float): seconds a file must go unchanged
+    poll_interval (float): seconds between scans when polling
+    use_inotify (bool): if False, always poll
+    """
+
+    def __init__(self, paths, suffixes=None, debounce=DEBOUNCE_S, poll_interval=POLL_INTERVAL_S, use_inotify=True):
+        # folder -> names of single files and the suffixes of the rest, each
+        # suffixes entry a tuple, or None for any file
+        self.folders = {}
+        for path in paths:
+            folder_suffixes = suffixes
+            if isinstance(path, tuple):
+                path, folder_suffixes = path
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                watched = self.folders.setdefault(path, (set(), set()))
+                watched[1].add(tuple(folder_suffixes) if folder_suffixes else None)
+            else:
+                self.folders.setdefault(os.path.dirname(path), (set(), set()))[0].add(os.path.basename(path))
+        self.poll_interval = poll_interval
+
+        self._known = self._scan()
+        self._pending = {}
+        self._inotify = _Inotify.open(list(self.folders)) if use_inotify else None
+        self.debounce = debounce if self._inotify else max(debounce, poll_interval)
+        print('watching {} with {}'.format(', '.join(sorted(self.folders)),
+                                           'inotify' if self._inotify else 'polling'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _wanted(self, path):
+        folder, name = os.path.split(path)
+        watched = self.folders.get(folder)
+        if watched is None or name.startswith('.'):
+            return False
+        names, all_suffixes = watched
+        if name in names:
+            return True
+        return any(suffixes is None or name.endswith(suffixes) for suffixes in all_suffixes)
+
+    def _scan(self):
+        """
+        Returns (size, mtime) of every watched file
+        """
+        files = {}
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_file() and self._wanted(entry.path):
+                    files[entry.path] = _signature(entry.path)
+        return files
+
+    def changes(self, timeout=None):
+        """
+        Waits until some files have been added or changed and have settled,
+        and returns their paths. Deleted files are forgotten, not reported.
+
+        timeout (float): seconds to wait at most, or None to wait for changes
+        rtype: List[string], possibly empty if timeout ran out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            ready = self._settled(now)
+            if ready:
+                return ready
+            if deadline is not None and now >= deadline:
+                return []
+
+            # wake up when the next pending file may have settled
+            wait = self.poll_interval if self._inotify is None else None
+            if self._pending:
+                next_due = min(seen for _, seen in self._pending.values()) + self.debounce
+                wait = max(next_due - now, 0) if wait is None else min(wait, max(next_due - now, 0))
+            if deadline is not None:
+                wait = max(deadline - now, 0) if wait is None else min(wait, max(deadline - now, 0))
+
+            if self._inotify is not None:
+                for path, mask in self._inotify.read(wait):
+                    if not self._wanted(path):
+                        continue
+                    if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self._pending[path] = (_signature(path), time.monotonic())
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._pending.pop(path, None)
+                        self._known.pop(path, None)
+            else:
+                time.sleep(wait)
+                self._poll()
+
+    def _poll(self):
+        files = self._scan()
+        for path, signature in files.items():
+            if self._known.get(path) != signature and path not in self._pending:
+                self._pending[path] = (signature, time.monotonic())
+        for path in set(self._known) - set(files):
+            del self._known[path]
+
+    def _settled(self, now):
+        """
+        Returns the pending files that have not changed for debounce seconds
+        """
+        ready = []
+        for path, (signature, seen) in list(self._pending.items()):
+            if now - seen < self.debounce:
+                continue
+            current = _signature(path)
+            if current is None:
+                # deleted before it settled
+                del self._pending[path]
+                self._known.pop(path, None)
+            elif current != signature:
+                self._pending[path] = (current, now)
+            else:
+                del self._pending[path]
+                if self._known.get(path) != current:
+                    self._known[path] = current
+                    ready.append(path)
+        return sorted(ready)
+
+    def __iter__(self):
+        while True:
+            yield self.changes()
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class _Inotify:
+    """
+    Minimal inotify(7) binding through ctypes, watching folders for the
+    events in WATCH_MASK
+    """
+
+    def __init__(self, libc, fd, folders):
+        self.libc = libc
+        self.fd = fd
+        self.folders = {}
+        for folder in folders:
+            wd = libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + folder)
+            self.folders[wd] = folder
+
+    @classmethod
+    def open(cls, folders):
+        """
+        Returns an _Inotify watching folders, or None if inotify cannot be
+        used here
+        """
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+        except (OSError, AttributeError):
+            return None
+
+        try:
+            return cls(libc, fd, folders)
+        except OSError as e:
+            print('not using inotify: {}'.format(e))
+            os.close(fd)
+            return None
+
+    def read(self, timeout=None):
+        """
+        Waits up to timeout seconds for events and returns the path each
+        one is about, with its event mask
+
+        rtype: List[Tuple[string, int]]
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths, pos = [], 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b'\0')
+            pos += EVENT.size + length
+            if name and wd in self.folders:
+                paths.append((os.path.join(self.folders[wd], os.fsdecode(name)), mask))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
@@ -1,26 +1,79 @@
+import argparse
 import os
-import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import pandas as pd
 import numpy as np
 
-from scipy.stats import pearsonr
-
 from Scripts.video import get_frame_information
+from Scripts.timestamp_store import TimestampStore
+from Scripts.trials import label_frames
+from Scripts.looks import LookSegments
+from Scripts.icatcher_output import ICatcherOutput
+from Scripts.trial_info import LookitTrialInfo, ManualTrialInfo
+from Scripts.results_sink import open_sink, write_frames
+from Scripts.result_cache import ResultCache
+from Scripts.instrument import ChildStats, RunStats, profiled, merge_profiles
+from Scripts.streaming import stream_trial_totals
+from Scripts.metrics import METRICS as ALL_METRICS, trial_metrics
+from Scripts.preprocess import preprocess
+from Scripts.prefetch import FramePrefetcher
+from Scripts.agreement import child_agreement, cohort_agreement, manual_files, read_manual_looks
+from Scripts.alignment import align_child, write_experiment_onset
+from Scripts.manifest import Manifest
+from Scripts.watch import Watcher
 
 # global directory path variables. make these your folder names under MCS
 ICATCHER_DIR = 'iCatcherOutput'
 
+# keep uncompressed .npy copies of iCatcher outputs next to them for faster reruns
+CACHE_NPY = False
+
+# frames per chunk to stream each iCatcher output in, so memory does not grow
+# with the length of the recording, or None to load each output whole
+STREAM_CHUNK = None
+
+# settings of the label clean up run before trials are assigned, keyword
+# arguments of Scripts/preprocess.py's preprocess, or None to use the raw labels
+PREPROCESS = None
+
+# .parquet results folder to also save every child's labeled frames in (see
+# Scripts/results_sink.py), so they can be reanalyzed without iCatcher
+# outputs or videos, or None to not keep them
+FRAMES_DIR = None
+
+# extra per-trial look metrics to add as output columns, names from
+# Scripts/metrics.py, or None for only the on/off totals and confidence
+METRICS = None
+
+# number of videos to run ffprobe on at once ahead of the child being
+# analyzed (see Scripts/prefetch.py), or None to probe each video when its
+# child is reached. Only used when analyzing in a single process
+PREFETCH = None
+
+# index of input files (a Scripts/manifest.py Manifest) to look iCatcher
+# outputs, videos and manual annotations up in instead of listing folders,
+# or None. Build it with --index
+MANIFEST = None
+
 # trial info
 TRIAL_INFO_DIR = 'lookit_info/lookit_trial_timing_info.csv'
 
+# where trial timing comes from, either LookitTrialInfo or ManualTrialInfo
+TRIAL_INFO = LookitTrialInfo(TRIAL_INFO_DIR)
+
+# cache of per-child results keyed on their inputs (a ResultCache), or None
+# to only skip children already in the output file
+RESULT_CACHE = None
+ANALYSIS_VERSION = 1
+
 # directory for videos
 VID_DIR = '/nese/mit/group/saxelab/users/galraz/mcs/videos/BBB'
 
-# add absolute path to iCatcher repo
-ICATCHER = '/Users/gracesong/dev/iCatcher'
-sys.path.append(ICATCHER)
+# frame time stamp cache, see Scripts/timestamp_store.py
+VIDEO_DATA_DIR = 'video_data'
 
 ###################
 ## HELPER FUNCTIONS ##
@@ -30,161 +83,519 @@ def listdir_nohidden(path):
         if not f.startswith('.'):
             yield f
 
+
+def get_icatcher_filenames():
+    """
+    Names of the iCatcher output files in ICATCHER_DIR, from MANIFEST if
+    there is one
+    """
+    if MANIFEST is not None:
+        return [os.path.relpath(entry['path'], ICATCHER_DIR) for entry in MANIFEST.entries('icatcher')]
+    return [f for f in listdir_nohidden(ICATCHER_DIR) if f.endswith('.npz')]
+
+
+def get_video_path(child_id, session=None):
+    """
+    Path of a child's video, [VID_DIR]/session[session]/[child_id].mp4 or
+    [VID_DIR]/[child_id].mp4 without a session, or where MANIFEST found it
+    """
+    if MANIFEST is not None:
+        indexed = MANIFEST.locate('video', child_id, session)
+        if indexed is not None:
+            return indexed
+    vid_path = VID_DIR + '/'
+    if session:
+        vid_path += "session" + session + '/'
+    return vid_path + child_id + ".mp4"
+
+
+def prefetched(filenames, prefetcher):
+    """
+    Yields each filename once its video's time stamps are in the store
+    """
+    for filename, _ in zip(filenames, prefetcher):
+        yield filename
+
 ###################
 ## ANALYSIS SCRIPT ##
 ####################
-def run_analyze_output(data_filename="BBB_output.csv", session=None):
+def run_analyze_output(data_filename="BBB_output.csv", session=None, workers=1, report=None, profile=None):
     """
     Given an iCatcher output directory and Datavyu input and output 
     files, runs iCatcher over all videos in vid_dir that have not been
     already run, computes looking times for all iCatcher outputs, and
     compares with Datavyu looking times. 
     data_filename (string): name of file you want comparison data to be written
-            to. Must have .csv ending. 
+            to. Must have .csv ending, .sqlite/.db to keep rows in an
+            SQLite table or .parquet for a partitioned Parquet dataset
+            folder (see Scripts/results_sink.py)
     session (string): ID of the experiment session. If session is not
             specified, looks for videos only within VID_DIR, otherwise
             searches within [VID_DIR]/session[session]
+    workers (int): number of processes to analyze children in. Children are
+            analyzed in parallel but written in the same order as a
+            sequential run, by this process only
+    report (string): path of a .json or .csv run report with the time
+            spent in each stage and counters for every child (see
+            Scripts/instrument.py), or None to only print a summary
+    profile (string): None, 'cprofile' to write a cProfile of each child to
+            [data_filename]_profile/ and a combined one to
+            [data_filename].prof, or 'tracemalloc' to record each child's
+            peak allocated bytes
+    rtype: DataFrame, one row per child that could not be analyzed, also
+            written to [data_filename]_errors.csv
     """
-    for filename in listdir_nohidden(ICATCHER_DIR):
-        child_id = filename.split('.')[0]
-
-        # skip if child data already added
-        output_file = Path(data_filename)
-        if output_file.is_file():
-            output_df = pd.read_csv(data_filename, index_col=0)
-            ids = output_df['child'].unique()
-            if child_id in ids: 
-                print(child_id + ' already processed')
-                continue
-        
-        vid_path = VID_DIR + '/'
-        if session:
-            vid_path += "session" + session + '/'
-        vid_path = vid_path + child_id + ".mp4"
-
-        # get timestamp for each frame in the video
-        print('getting frame information for {}...'.format(vid_path))
-        timestamps, length = get_frame_information(vid_path)
-        if not timestamps:
-            print('video not found for {} in {} folder'.format(child_id, VID_DIR))
+    if STREAM_CHUNK is not None and PREPROCESS:
+        raise ValueError('preprocessing needs whole iCatcher outputs, it cannot be combined with streaming')
+    if STREAM_CHUNK is not None and FRAMES_DIR:
+        raise ValueError('saving frames needs whole iCatcher outputs, it cannot be combined with streaming')
+
+    sink = open_sink(data_filename)
+    # refuse before analyzing anyone if e.g. --metrics changed the columns
+    sink.check_columns(get_child_rows('', [], session, [], [], [], pd.DataFrame(columns=METRICS or [])).columns)
+    stats = RunStats(workers, profile)
+    stem = Path(data_filename).with_suffix('').as_posix()
+    profile_dir = stem + '_profile' if profile == 'cprofile' else None
+
+    # skip children already added, unless RESULT_CACHE can tell whether their inputs changed
+    filenames = []
+    for filename in get_icatcher_filenames():
+        if RESULT_CACHE is None and filename.split('.')[0] in sink:
+            print(filename.split('.')[0] + ' already processed')
             continue
-        
+        filenames.append(filename)
+
+    args = [filenames, [session] * len(filenames), [profile] * len(filenames), [profile_dir] * len(filenames)]
+    prefetcher = None
+    if workers > 1:
+        # workers started with spawn import this module afresh, so hand them the settings
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=configure, initargs=(get_config(),))
+        results = executor.map(analyze_child_safe, *args)
+    else:
+        executor = None
+        if PREFETCH:
+            # probe the next videos while the current child is analyzed
+            vid_paths = [get_video_path(filename.split('.')[0], session) for filename in filenames]
+            prefetcher = FramePrefetcher(vid_paths, VIDEO_DATA_DIR, session, concurrency=PREFETCH)
+            prefetcher.start()
+            args[0] = prefetched(filenames, prefetcher)
+        results = map(analyze_child_safe, *args)
+
+    # RESULT_CACHE key of each child's latest rows in the output
+    written = RESULT_CACHE.written(data_filename) if RESULT_CACHE is not None else {}
+    errors = []
+    try:
+        for child_id, rows, error, key, child_stats in results:
+            stats.add(child_stats)
+            if error is not None:
+                print('failed to analyze {}: {}'.format(child_id, error))
+                errors.append({'child': child_id, 'session': session, 'error': error})
+                continue
+            if key is not None and written.get(child_id) == key and child_id in sink:
+                print(child_id + ' already processed, inputs unchanged')
+                continue
+            # rows of a child whose inputs changed supersede its old rows on export
+            with child_stats.stage('write'):
+                sink.append(rows)
+            if key is not None:
+                written[child_id] = key
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if prefetcher is not None:
+            prefetcher.close()
+        if RESULT_CACHE is not None:
+            RESULT_CACHE.save_written(data_filename, written)
+
+    stats.finish()
+    print(stats.summary())
+    if report:
+        stats.write(report)
+    if profile_dir:
+        merge_profiles(profile_dir, stem + '.prof', child_ids=[child.child_id for child in stats.children])
+
+    errors = pd.DataFrame(errors, columns=['child', 'session', 'error'])
+    if len(errors):
+        errors.to_csv(stem + '_errors.csv', index=False)
+    return errors
+
+
+def analyze_child(filename, session=None, stats=None):
+    """
+    Computes looking times for one iCatcher output file
+
+    filename (string): name of iCatcher output file in ICATCHER_DIR, in
+            format '[CHILD_ID].npz'
+    session (string): ID of the experiment session
+    stats (ChildStats): where to record the time spent in each stage and
+            the frame, trial and cache counters, or None
+    rtype: Tuple[DataFrame, string], the rows to write for this child and
+            their RESULT_CACHE key, None without a RESULT_CACHE
+    """
+    child_id = filename.split('.')[0]
+    if stats is None:
+        stats = ChildStats(child_id)
+
+    vid_path = get_video_path(child_id, session)
+
+    # get timestamp for each frame in the video
+    print('getting frame information for {}...'.format(vid_path))
+    with stats.stage('frame_info'):
+        store = TimestampStore(VIDEO_DATA_DIR, mmap=STREAM_CHUNK is not None)
+        timestamps, length = get_frame_information(vid_path, store, session=session)
+    if len(timestamps) == 0:
+        raise ValueError('video not found for {} in {} folder'.format(child_id, VID_DIR))
+    stats.count('frames', len(timestamps))
+
+    icatcher_path = ICATCHER_DIR + '/' + filename
+    with stats.stage('trial_info'):
+        trial_sets, df = get_trial_sets(child_id, session)
+    stats.count('trials', len(trial_sets))
+
+    # reuse the rows if none of the inputs changed since they were computed
+    key = None
+    if RESULT_CACHE is not None:
+        with stats.stage('cache'):
+            key = RESULT_CACHE.key(icatcher_path, timestamps, df, get_analysis_params(session))
+            rows = RESULT_CACHE.get(key)
+        if rows is not None:
+            stats.count('cache_hits')
+            return rows, key
+        stats.count('cache_misses')
+
+    if STREAM_CHUNK is not None:
+        # sum on looks, off looks and on-look confidence chunk by chunk
+        with stats.stage('aggregate'):
+            totals = stream_trial_totals(ICatcherOutput(icatcher_path, cache=CACHE_NPY), timestamps,
+                                         trial_sets, STREAM_CHUNK)
+        icatcher_times, confidence, max_trial = totals.on_off_times(), totals.on_confidence(), totals.max_trial
+        looks = totals.looks()
+    else:
         # initialize df with time stamps for iCatcher file
-        icatcher_path = ICATCHER_DIR + '/' + filename
-        icatcher = read_convert_output(icatcher_path, timestamps)
+        with stats.stage('load'):
+            icatcher = read_convert_output(icatcher_path, timestamps, PREPROCESS)
+
+        # match trial onsets and offsets to iCatcher file
+        with stats.stage('assign'):
+            assign_trial(icatcher, trial_sets)
+
+        if FRAMES_DIR:
+            with stats.stage('write'):
+                write_frames(FRAMES_DIR, child_id, session, icatcher)
 
-        # get trial onsets and offsets from input file, match to iCatcher file
-        trial_sets, df = get_trial_sets(child_id)
-        assign_trial(icatcher, trial_sets)
-        
         # sum on looks and off looks for each trial
-        icatcher_times = get_on_off_times(icatcher)
-        # datavyu_times = get_output_times(output_file)
+        with stats.stage('aggregate'):
+            looks = get_looks(icatcher)
+            icatcher_times = looks.on_off_times(trial_sets)
+            confidence = get_on_confidence(icatcher, len(icatcher_times))
+        max_trial = icatcher['trial'].max()
+
+    # check whether number of trials from trial info is the same as 
+    if max_trial != len(df):
+        raise ValueError('mismatch in # of trials between icatcher and session info: {} in {} folder'.format(child_id, VID_DIR))
+
+    with stats.stage('aggregate'):
+        metrics = None
+        if METRICS:
+            metrics = trial_metrics(looks, trial_sets, METRICS, df['fam_or_test'].to_numpy())
+        rows = get_child_rows(child_id, icatcher_times, session, df['fam_or_test'], df['scene'], confidence, metrics)
+    if RESULT_CACHE is not None:
+        with stats.stage('cache'):
+            RESULT_CACHE.put(key, rows)
+    return rows, key
+
+
+def get_analysis_params(session=None):
+    """
+    Returns the settings that change a child's results, part of the
+    RESULT_CACHE key. Bump ANALYSIS_VERSION when the analysis itself changes.
 
-        # check whether number of trials from trial info is the same as 
-        if icatcher['trial'].max() != len(df):
-            print('mismatch in # of trials between icatcher and session info: {} in {} folder'.format(child_id, VID_DIR))
-            continue
+    rtype: dict
+    """
+    return {'version': ANALYSIS_VERSION, 'session': session, 'metrics': METRICS, 'preprocess': PREPROCESS}
 
-        write_to_csv(data_filename, child_id, icatcher_times, session, df['fam_or_test'], df['scene'], icatcher)
 
-        # return comparison metrics 
-        # icatcher_arr, datavyu_arr = np.array(icatcher_times).flatten(), np.array(datavyu_times).flatten()
-        #stat, p = pearsonr(icatcher_arr, datavyu_arr)
-       # print('Datavyu total on-off looks per trial: \n', datavyu_times)
-      #  print('iCatcher total on-off looks per trial: \n', icatcher_times)
-      #  print('Pearson R coefficient: {} \np-value: {}'.format(round(stat, 3), round(p, 3)))
+# module settings analyze_child reads, set from the command line by main
+CONFIG_NAMES = ['ICATCHER_DIR', 'VID_DIR', 'VIDEO_DATA_DIR', 'TRIAL_INFO_DIR', 'TRIAL_INFO', 'CACHE_NPY',
+                'STREAM_CHUNK', 'PREPROCESS', 'FRAMES_DIR', 'METRICS', 'MANIFEST', 'RESULT_CACHE']
 
 
-#####################
-## HELPER FUNCTIONS ##
-#####################
+def get_config():
+    """
+    Returns the current value of every setting in CONFIG_NAMES, to pass to
+    configure in worker processes
 
-def get_input_output(filename):
+    rtype: dict
     """
-    Returns the filenames for the input and output Datavyu files
-    corresponding to the iCatcher video coded in filename
-    
-    filename (string): name of tabulated iCatcher output file in format
-    '[CHILD_ID]_annotation.txt'
-    rtype: List[string]
+    return {name: globals()[name] for name in CONFIG_NAMES}
+
+
+def configure(config):
+    """
+    Sets the module settings from a get_config dict. Worker processes run
+    this first, as with the spawn start method (the default on macOS and
+    Windows) they re-import this module and would otherwise only see the
+    defaults.
+
+    rtype: None
     """
-    child_id = filename.split('_')[0]
-    input_output = []
+    globals().update({name: config[name] for name in CONFIG_NAMES if name in config})
 
-    # search for corresponding input file in Datavyu folder
-    for folder in [DATAVYU_IN, DATAVYU_OUT]:
-        for f in os.listdir(folder):
-            if child_id in f:
-                input_output.append(f)
-                break
-    if len(input_output) < 2:
-        raise Exception('Missing Datavyu files for {}.'.format(child_id))
-    return input_output
 
+def analyze_child_safe(filename, session=None, profile=None, profile_dir=None):
+    """
+    Runs analyze_child, catching any error so one bad child does not stop
+    a batch
+
+    profile (string): None, 'cprofile' or 'tracemalloc', see
+            Scripts/instrument.py
+    profile_dir (string): folder for the cProfile dumps
+    rtype: Tuple[string, DataFrame, string, string, ChildStats], child ID,
+            rows (None on failure), error message (None on success), the
+            RESULT_CACHE key of the rows (None on failure or without a
+            cache) and the child's stage timings
+    """
+    child_id = filename.split('.')[0]
+    stats = ChildStats(child_id)
+    try:
+        with profiled(stats, profile, profile_dir):
+            rows, key = analyze_child(filename, session, stats)
+        return child_id, rows, None, key, stats
+    except Exception as e:
+        stats.error = '{}: {}'.format(type(e).__name__, e)
+        return child_id, None, stats.error, None, stats
+
+
+def run_watch(data_filename="BBB_output.csv", session=None, poll=False):
+    """
+    Analyzes all children like run_analyze_output, then keeps running and
+    analyzes every iCatcher output that is added to or rewritten in
+    ICATCHER_DIR as soon as it is completely written, and every child whose
+    trials change when the trial timing files do (see Scripts/watch.py).
+    The output file, trial timing and RESULT_CACHE stay open in between, so
+    each new output only costs its own analysis. Stop with Ctrl-C.
+
+    data_filename (string): output file, as for run_analyze_output
+    session (string): ID of the experiment session
+    poll (bool): scan the folders instead of using inotify, needed when the
+            outputs are written by another machine of a network filesystem
+    rtype: None
+    """
+    run_analyze_output(data_filename, session)
+    sink = open_sink(data_filename)
+    written = RESULT_CACHE.written(data_filename) if RESULT_CACHE is not None else {}
+
+    # trials each child was last analyzed with, to tell whose trials changed
+    filenames = get_icatcher_filenames()
+    analyzed_trials = {filename: get_trial_sets_safe(filename.split('.')[0], session) for filename in filenames}
+
+    # the Lookit csv, or the folders of the per-child trial info and onset files
+    trial_paths = []
+    if getattr(TRIAL_INFO, 'csv_path', None) is not None:
+        trial_paths.append(TRIAL_INFO.csv_path)
+    for name, suffix in [('trial_info_dir', '_trial_info.csv'), ('experiment_onsets_dir', '_experiment_onset.txt')]:
+        if getattr(TRIAL_INFO, name, None) is not None:
+            trial_paths.append((getattr(TRIAL_INFO, name), [suffix]))
+
+    icatcher_dir = os.path.abspath(ICATCHER_DIR)
+    with Watcher([ICATCHER_DIR] + trial_paths, suffixes=['.npz'], use_inotify=not poll) as watcher:
+        for paths in watcher:
+            if MANIFEST is not None:
+                # trial info looked up through the index must see the new files
+                MANIFEST.refresh()
+            landed = {}
+            for path in paths:
+                if os.path.dirname(path) != icatcher_dir:
+                    continue
+                try:
+                    landed[os.path.basename(path)] = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    print('{} was removed before it could be analyzed'.format(path))
+            changed = list(landed)
+            if any(os.path.dirname(path) != icatcher_dir for path in paths):
+                changed += [filename for filename, trial_sets in analyzed_trials.items()
+                            if filename not in landed and get_trial_sets_safe(filename.split('.')[0], session) != trial_sets]
+
+            for filename in changed:
+                child_id, rows, error, key, _ = analyze_child_safe(filename, session)
+                analyzed_trials[filename] = get_trial_sets_safe(child_id, session)
+                if error is not None:
+                    print('failed to analyze {}: {}'.format(child_id, error))
+                    continue
+                if key is not None and written.get(child_id) == key and child_id in sink:
+                    print(child_id + ' already processed, inputs unchanged')
+                    continue
+                sink.append(rows)
+                if key is not None:
+                    written[child_id] = key
+                    RESULT_CACHE.save_written(data_filename, written)
+                if filename in landed:
+                    print('{} written {:.2f}s after its output landed'.format(child_id, time.time() - landed[filename]))
+                else:
+                    print('{} written again, its trials changed'.format(child_id))
+
+
+def run_agreement(manual_dir, data_filename="agreement.csv", session=None, n_boot=1000):
+    """
+    Compares iCatcher's frame labels with the manual Datavyu looks of every
+    child that has both an iCatcher output in ICATCHER_DIR and a verbose
+    file in manual_dir, after the same PREPROCESS clean up as the analysis.
+    Prints the cohort frame accuracy, Cohen's kappa and correlation of
+    per-trial on time with bootstrap confidence intervals (see
+    Scripts/agreement.py).
+
+    manual_dir (string): folder of MCS_[CHILD_ID]_[SESSION]_verbose_[ANNOTATOR].csv
+            files, e.g. InputFiles
+    data_filename (string): .csv to write one row per child to; the trial
+            rows go to [data_filename]_trials.csv and the cohort summary to
+            [data_filename]_summary.csv
+    session (string): ID of the experiment session
+    n_boot (int): number of bootstrap resamples of children
+    rtype: DataFrame, the cohort summary
+    """
+    manual = manual_files(manual_dir, MANIFEST)
+    confusions, trials = {}, []
+    for filename in sorted(get_icatcher_filenames()):
+        child_id = filename.split('.')[0]
+        if child_id not in manual:
+            continue
 
-def read_convert_output(filename, stamps):
+        timestamps, _ = get_frame_information(get_video_path(child_id, session), VIDEO_DATA_DIR, session=session)
+        if len(timestamps) == 0:
+            print('video not found for {}, skipping'.format(child_id))
+            continue
+        icatcher = read_convert_output(ICATCHER_DIR + '/' + filename, timestamps, PREPROCESS)
+        confusion, child_trials = child_agreement(icatcher['on_off'] == 'on', icatcher['time_ms'], manual[child_id])
+        confusions[child_id] = confusion
+        child_trials.insert(0, 'child', child_id)
+        trials.append(child_trials)
+
+    trials = pd.concat(trials, ignore_index=True) if trials else pd.DataFrame(
+        columns=['child', 'trial_num', 'scored_ms', 'manual_on_ms', 'icatcher_on_ms'])
+    per_child, summary = cohort_agreement(confusions, trials, n_boot)
+
+    stem = Path(data_filename).with_suffix('').as_posix()
+    per_child.to_csv(data_filename, index=False)
+    trials.to_csv(stem + '_trials.csv', index=False)
+    summary.to_csv(stem + '_summary.csv', index=False)
+    print('agreement with manual coding over {} children:'.format(len(confusions)))
+    print(summary.to_string(index=False))
+    return summary
+
+
+def run_alignment(data_filename="alignment.csv", session=None, manual_dir=None, onsets_dir=None, min_confidence=0.2):
     """
-    Given a tabular data file containing columns for frames and looks,
-    converts to pandas DataFrame with another column mapping each frame
-    to its time stamp in the video
+    Estimates for every child in ICATCHER_DIR the shift between its video
+    and its trial times, by lining up iCatcher's looks with the trials in
+    TRIAL_INFO, or with the manual looks in manual_dir (see
+    Scripts/alignment.py). With trial times relative to the start of the
+    experiment, e.g. a ManualTrialInfo without experiment onsets, the shift
+    is the experiment onset; with Lookit or already shifted times it is
+    what is left to correct.
+
+    data_filename (string): .csv to write one row per child to
+    session (string): ID of the experiment session
+    manual_dir (string): folder of Datavyu verbose .csv files to line up
+            with instead of the trial structure, or None
+    onsets_dir (string): folder to write sub-[ID]_session-[ID]_experiment_onset.txt
+            files to for children aligned with at least min_confidence,
+            or None to only write data_filename
+    min_confidence (float): lowest confidence an onset file is written for
+    rtype: DataFrame, child, session, offset_ms, correlation and confidence
+    """
+    manual = manual_files(manual_dir, MANIFEST) if manual_dir else {}
+    rows = []
+    for filename in sorted(get_icatcher_filenames()):
+        child_id = filename.split('.')[0]
+        if manual_dir and child_id not in manual:
+            continue
+
+        timestamps, _ = get_frame_information(get_video_path(child_id, session), VIDEO_DATA_DIR, session=session)
+        if len(timestamps) == 0:
+            print('video not found for {}, skipping'.format(child_id))
+            continue
+        icatcher = read_convert_output(ICATCHER_DIR + '/' + filename, timestamps, PREPROCESS)
+
+        if manual_dir:
+            _, trial_sets, *manual_looks = read_manual_looks(manual[child_id])
+        else:
+            trial_sets, manual_looks = get_trial_sets(child_id, session)[0], None
+        offset, correlation, confidence = align_child(icatcher['on_off'] == 'on', icatcher['time_ms'],
+                                                      trial_sets, manual_looks)
+        rows.append({'child': child_id, 'session': session, 'offset_ms': offset,
+                     'correlation': correlation, 'confidence': confidence})
+        print('{}: offset {} ms, correlation {:.3f}, confidence {:.2f}'.format(child_id, offset, correlation, confidence))
+
+        if onsets_dir and confidence >= min_confidence:
+            write_experiment_onset(onsets_dir, child_id, session or 1, offset)
+
+    rows = pd.DataFrame(rows, columns=['child', 'session', 'offset_ms', 'correlation', 'confidence'])
+    rows.to_csv(data_filename, index=False)
+    return rows
+
+
+#####################
+## HELPER FUNCTIONS ##
+#####################
+
+def read_convert_output(filename, stamps, preprocess_params=None):
+    """
+    Given an iCatcher .npz output file containing a label and a confidence
+    per frame, converts to pandas DataFrame with another column mapping
+    each frame to its time stamp in the video
     
-    filename (string): name of tabulated iCatcher output file in format
-    '[CHILD_ID]_annotation.txt'
-    # TODO: this is actually npz file!!
+    filename (string): name of iCatcher output file in format
+    '[CHILD_ID].npz'
     stamps (List[int]): time stamp for each frame, where stamps[i] is the 
     time stamp at frame i
+    preprocess_params (dict): settings to clean up the labels with, see
+    Scripts/preprocess.py, or None to keep them as they are
     rtype: DataFrame
     """
-    npz = np.load(filename)
-    df = pd.DataFrame([])
+    output = ICatcherOutput(filename, cache=CACHE_NPY)
+    output.validate(stamps)
 
-    lst = npz.files
+    on, confidence = output.labels > 0, output.confidence
+    frame = np.arange(1, len(output) + 1)
+    # convert frames to ms using frame rate
+    time_ms = np.asarray(stamps, dtype=int)
+    if preprocess_params:
+        on, confidence, time_ms, frame = preprocess(on, confidence, time_ms, **preprocess_params)
 
-    df['frame'] = range(1, len(npz[lst[0]]) + 1)
-    df['on_off'] = ['on' if frame > 0 else 'off' for frame in npz[lst[0]]]
-    df['confidence'] = npz[lst[1]]
+    df = pd.DataFrame([])
 
-    # convert frames to ms using frame rate
-    df['time_ms'] = stamps
-    df['time_ms'] = df['time_ms'].astype(int)
+    df['frame'] = frame
+    df['on_off'] = pd.Categorical.from_codes(on.astype(int), ['off', 'on'])
+    df['confidence'] = confidence
+    df['time_ms'] = time_ms
     
     return df
 
 
-def get_trial_sets(child_id):
+def get_trial_sets(child_id, session=None):
     """
-    Finds corresponding Datavyu input file for given iCatcher output file
-    and returns a list of [onset, offset] times for each trial in 
-    milliseconds
+    Looks up the trial timing of child_id in TRIAL_INFO and returns a list
+    of [onset, offset] times for each trial in milliseconds
     
-    input_file (string): name of Datavyu input file
-    rtype: List[List[int]]
+    child_id (string): unique child ID associated with subject
+    session (string): ID of the experiment session
+    rtype: Tuple[List[List[int]], DataFrame]
     """
+    return TRIAL_INFO.get(child_id, session)
 
-    # * this gets trial data from datavyu file, but want to be able to do that from other files
-    # * need 1) start of exp relative to video, 2) start/end of trials relative to exp
-
-    df = pd.read_csv(TRIAL_INFO_DIR)
-
-    # get part of df from current child
-    df = df[df['child_id'] == child_id] 
-
-    # there's two different file formats -- updated as needed 
-    df_sets = df[['relative_onset', 'relative_offset']]
-    df_sets = df_sets.rename(columns={"relative_onset": "onset", "relative_offset": "offset"})
-    
-    df_sets.dropna(inplace=True)
-
-    trial_sets = []
-    for _, trial in df_sets.iterrows():
-        trial_sets.append([int(trial['onset']), int(trial['offset'])])
 
-    def unique(sequence):
-        seen = set()
-        return [x for x in sequence if not (tuple(x) in seen or seen.add(tuple(x)))]
+def get_trial_sets_safe(child_id, session=None):
+    """
+    Same as get_trial_sets but only returns the trial sets, or None if the
+    child's trial timing cannot be read, e.g. its trial file is missing
 
-    return unique(trial_sets), df
+    rtype: List[List[int]]
+    """
+    try:
+        return get_trial_sets(child_id, session)[0]
+    except Exception:
+        # analyze_child_safe reports the error when the child is analyzed
+        return None
 
 
 def assign_trial(df, trial_sets):
@@ -196,56 +607,61 @@ def assign_trial(df, trial_sets):
     trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
     rtype: None
     """
-    # mapping function
-    def map_to_range(value, ranges):
-        """
-        Modifies df to have a column mapping value to one of the ranges provided, or 0 if not 
-        """
-        for start, end in ranges:
-            if value in range(start, end + 1): 
-                return ranges.index([start, end]) + 1
-        return 0
-    # rewrite this with logicals
-    df['trial'] = df['time_ms'].apply(lambda x: map_to_range(x, trial_sets))
+    df['trial'] = label_frames(df['time_ms'].to_numpy(), trial_sets)
 
 
-def get_output_times(output_file):
+def get_looks(icatcher):
     """
-    Finds corresponding Datavyu output file for given iCatcher output file
-    and returns a list of [on times, off times] for each trial in 
-    seconds
-    
-    output_file (string): name of Datavyu output file
-    rtype: List[List[int]]
+    Run-length encodes the frames of icatcher into on and off looks
+
+    icatcher (DataFrame): pandas Dataframe with on_off, confidence and
+                time_ms columns
+    rtype: LookSegments
+    """
+    return LookSegments.from_frames(icatcher['on_off'] == 'on', icatcher['confidence'], icatcher['time_ms'])
+
+
+def get_on_off_times(icatcher, trial_sets):
     """
-    # * don't need datavyu looks
-    output_file = DATAVYU_OUT + '/' + output_file
-    df = pd.read_csv(output_file)
-    df_looks = df[['Looks On Total (s)', 'Looks Off Total (s)']]
-    df_looks.dropna(inplace=True)
-     
-    looking_times = []
-    for _, trial in df_looks.iterrows():
-        looking_times.append([round(trial['Looks On Total (s)'], 3), round(trial['Looks Off Total (s)'], 3)])
+    Sums on looks and off looks within each trial, by run-length encoding
+    the frames into looks and clipping the looks to the trial intervals
     
-    return looking_times
+    icatcher (DataFrame): pandas Dataframe with on_off, confidence and
+                time_ms columns
+    trial_sets (List[List[int]]): list of trial [onset, offset] pairs in ms
+    rtype: List[List[float]], [on time, off time] in seconds per trial
+    """
+    return get_looks(icatcher).on_off_times(trial_sets)
 
 
-def write_to_csv(data_filename, child_id, icatcher_data, session, trial_type, stim_type, icatcher):
+def get_on_confidence(icatcher, num_trials):
     """
-    checks if output file is in directory. if not, writes new file
-    containing looking times computed by iCatcher and Datavyu for child
-    with Lookit ID id. 
+    Returns the mean iCatcher confidence of the on frames in each trial,
+    NaN for a trial without any
+
+    icatcher (DataFrame): pandas Dataframe with on_off, confidence and
+                trial columns
+    num_trials (int): number of trials
+    rtype: np.ndarray of float
+    """
+    on = icatcher[(icatcher['on_off'] == 'on') & (icatcher['trial'] != 0)]
+    return on.groupby('trial')['confidence'].mean().reindex(range(1, num_trials + 1)).to_numpy()
+
+
+def get_child_rows(child_id, icatcher_data, session, trial_type, stim_type, confidence, metrics=None):
+    """
+    Makes the rows of the output file containing looking times computed
+    by iCatcher for child with Lookit ID id. 
     
     child_id (string): unique child ID associated with subject
     icatcher_data (List[List[int]]): list of [on times, off times] per trial
                 calculated form iCatcher
-    datavyu_data (List[List[int]]): list of [on times, off times] per trial
-                calculated form iCatcher
     session (string): the experiment session the participant was placed in
-    rtype: None
+    confidence (array-like of float): mean confidence of on looks per trial,
+                see get_on_confidence
+    metrics (DataFrame): extra per-trial columns from trial_metrics, or None
+    rtype: DataFrame
     """
-    # assert(len(icatcher_data) == len(datavyu_data))
     num_trials = len(icatcher_data)
     id_arr = [child_id] * len(icatcher_data)
     data = {
@@ -254,25 +670,146 @@ def write_to_csv(data_filename, child_id, icatcher_data, session, trial_type, st
         'trial_num': [i + 1 for i in range(len(icatcher_data))], # * Trials.ordinal
         'trial_type': trial_type, # * Trials.x
         'stim_type': stim_type, # * Trial level info
-        'confidence': list(icatcher[(icatcher['on_off'] == 'on') & (icatcher['trial'] != 0)].groupby('trial')[['confidence']].mean().squeeze()), # * no confidence
+        'confidence': list(confidence), # * no confidence
         'iCatcher_on(s)': [trial[0] for trial in icatcher_data], # * don't want this
         'iCatcher_off(s)': [trial[1] for trial in icatcher_data] # * don't want this
     }
+    if metrics is not None:
+        for name in metrics.columns:
+            data[name] = metrics[name].to_numpy()
 
-    df = pd.DataFrame(data)
+    return pd.DataFrame(data)
 
-    output_file = Path(data_filename)
-    if not output_file.is_file():
-        df.to_csv(data_filename)
-        return
-    
-    output_df = pd.read_csv(data_filename, index_col=0)
-    ids = output_df['child'].unique()
 
-    if child_id not in ids:
-        output_df = output_df.append(df, ignore_index=True)
-        output_df.to_csv(data_filename)
+def write_to_csv(data_filename, child_id, icatcher_data, session, trial_type, stim_type, icatcher):
+    """
+    checks if output file is in directory. if not, writes new file
+    containing looking times computed by iCatcher and Datavyu for child
+    with Lookit ID id. 
     
+    child_id (string): unique child ID associated with subject
+    icatcher_data (List[List[int]]): list of [on times, off times] per trial
+                calculated form iCatcher
+    datavyu_data (List[List[int]]): list of [on times, off times] per trial
+                calculated form iCatcher
+    session (string): the experiment session the participant was placed in
+    rtype: None
+    """
+    # assert(len(icatcher_data) == len(datavyu_data))
+    confidence = get_on_confidence(icatcher, len(icatcher_data))
+    df = get_child_rows(child_id, icatcher_data, session, trial_type, stim_type, confidence)
+
+    sink = open_sink(data_filename)
+    if child_id not in sink:
+        sink.append(df)
+
+
+def main(argv=None):
+    """
+    Command line entry point, also run by mcs.py analyze
+
+    argv (List[string]): arguments, sys.argv[1:] if None
+    """
+    global ICATCHER_DIR, VID_DIR, VIDEO_DATA_DIR, TRIAL_INFO_DIR, TRIAL_INFO, STREAM_CHUNK, PREFETCH, FRAMES_DIR
+    global PREPROCESS, METRICS, MANIFEST, RESULT_CACHE
+
+    parser = argparse.ArgumentParser(description='compute looking times for all iCatcher outputs')
+    parser.add_argument('data_filename', nargs='?', default='BBB_output.csv')
+    parser.add_argument('--icatcher_dir', default=ICATCHER_DIR,
+                        help='folder of iCatcher .npz outputs')
+    parser.add_argument('--vid_dir', default=VID_DIR,
+                        help='folder of the videos, with a session[ID] folder per session if there are sessions')
+    parser.add_argument('--video_data', default=VIDEO_DATA_DIR,
+                        help='folder of the frame time stamp cache')
+    parser.add_argument('--trial_info', default=TRIAL_INFO_DIR,
+                        help='Lookit trial timing .csv, or a folder of sub-[ID]_session-[ID]_trial_info.csv files')
+    parser.add_argument('--experiment_onsets_dir', default=None,
+                        help='with a trial info folder, folder of the sub-[ID]_session-[ID]_experiment_onset.txt files')
+    parser.add_argument('--session', default=None)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of children to analyze in parallel')
+    parser.add_argument('--cache', default=None,
+                        help='folder to cache per-child results in, so only children whose inputs changed are recomputed')
+    parser.add_argument('--cache_mb', type=int, default=256,
+                        help='size the result cache is trimmed to, in MB')
+    parser.add_argument('--export', default=None,
+                        help='afterwards, write all results to this .csv in the BBB_output.csv layout')
+    parser.add_argument('--report', default=None,
+                        help='write a .json or .csv report of the time spent in each stage per child')
+    parser.add_argument('--profile', default=None, choices=['cprofile', 'tracemalloc'],
+                        help='also profile each child with cProfile or tracemalloc')
+    parser.add_argument('--prefetch', type=int, default=None, metavar='VIDEOS',
+                        help='run ffprobe on up to this many upcoming videos at once while analyzing (single process only)')
+    parser.add_argument('--stream', type=int, default=None, metavar='CHUNK_FRAMES',
+                        help='stream each iCatcher output in chunks of this many frames instead of loading it whole')
+    parser.add_argument('--metrics', nargs='+', default=None, choices=list(ALL_METRICS) + ['all'],
+                        help='extra per-trial look metrics to add as columns; use a new output file')
+    parser.add_argument('--min_confidence', type=float, default=None,
+                        help='forward fill the label of frames less confident than this')
+    parser.add_argument('--majority_window', type=int, default=None,
+                        help='odd number of frames to majority filter the labels over')
+    parser.add_argument('--max_gap_ms', type=int, default=None,
+                        help='split dropped-frame gaps longer than this between the looks on either side')
+    parser.add_argument('--min_look_ms', type=int, default=None,
+                        help='merge looks shorter than this into the look before them')
+    parser.add_argument('--frames', default=None,
+                        help='.parquet folder to also save every child\'s labeled frames in')
+    parser.add_argument('--agreement', default=None, metavar='MANUAL_DIR',
+                        help='instead of analyzing, compare iCatcher frame labels with the manual looks in this folder')
+    parser.add_argument('--agreement_output', default='agreement.csv',
+                        help='.csv to write per-child agreement to')
+    parser.add_argument('--align', default=None, metavar='OUTPUT',
+                        help='instead of analyzing, estimate each child\'s video to trial time offset and write them to this .csv')
+    parser.add_argument('--align_manual', default=None, metavar='MANUAL_DIR',
+                        help='line up with the manual looks in this folder instead of the trial structure')
+    parser.add_argument('--onsets_dir', default=None,
+                        help='also write an experiment_onset.txt file per confidently aligned child to this folder')
+    parser.add_argument('--watch', action='store_true',
+                        help='after analyzing, keep running and analyze new or changed iCatcher outputs as they land')
+    parser.add_argument('--poll', action='store_true',
+                        help='with --watch, scan folders instead of using inotify, e.g. on a network filesystem')
+    parser.add_argument('--index', default=None, metavar='MANIFEST_JSON',
+                        help='.json index of input files to refresh and look inputs up in instead of listing folders')
+    parser.add_argument('--bootstrap', type=int, default=1000,
+                        help='number of bootstrap resamples for the agreement confidence intervals')
+    args = parser.parse_args(argv)
+
+    ICATCHER_DIR, VID_DIR, VIDEO_DATA_DIR = args.icatcher_dir, args.vid_dir, args.video_data
+    manual_trials = os.path.isdir(args.trial_info)
+    if args.index:
+        roots = {'icatcher': ICATCHER_DIR, 'video': VID_DIR, 'timestamps': VIDEO_DATA_DIR,
+                 'manual': args.agreement or args.align_manual}
+        if manual_trials:
+            roots.update({'trial_info': args.trial_info, 'experiment_onset': args.experiment_onsets_dir})
+        MANIFEST = Manifest(args.index, roots)
+        print('manifest: listed {} changed folders'.format(MANIFEST.refresh()))
+    if args.trial_info != TRIAL_INFO_DIR or args.experiment_onsets_dir:
+        TRIAL_INFO_DIR = args.trial_info
+        if manual_trials:
+            TRIAL_INFO = ManualTrialInfo(TRIAL_INFO_DIR, args.experiment_onsets_dir, MANIFEST)
+        else:
+            TRIAL_INFO = LookitTrialInfo(TRIAL_INFO_DIR)
+    STREAM_CHUNK = args.stream
+    PREFETCH = args.prefetch
+    FRAMES_DIR = args.frames
+    PREPROCESS = {name: value for name, value in [('min_confidence', args.min_confidence),
+                                                   ('window', args.majority_window),
+                                                   ('max_gap_ms', args.max_gap_ms),
+                                                   ('min_look_ms', args.min_look_ms)] if value is not None} or None
+    METRICS = list(ALL_METRICS) if args.metrics == ['all'] else args.metrics
+    if args.cache:
+        RESULT_CACHE = ResultCache(args.cache, args.cache_mb * 1024 * 1024)
+    if args.align:
+        run_alignment(args.align, args.session, args.align_manual, args.onsets_dir)
+    elif args.agreement:
+        run_agreement(args.agreement, args.agreement_output, args.session, args.bootstrap)
+    elif args.watch:
+        run_watch(args.data_filename, args.session, args.poll)
+    else:
+        run_analyze_output(args.data_filename, args.session, args.workers, args.report, args.profile)
+    if args.export:
+        open_sink(args.data_filename).export(args.export)
+
 
 if __name__ == "__main__":
-    run_analyze_output()
\ No newline at end of file
+    main()
@@ -0,0 +1,224 @@
+"""
+Benchmarks the looking-time pipeline on synthetic cohorts.
+
+For each cohort size a fresh cohort is generated in a temporary folder:
+iCatcher .npz files with realistic look runs, frame time stamps at ~30 fps
+with jitter and dropped-frame gaps like those in video_data.json (already
+in the time stamp store, so no ffprobe is needed), and a trial timing table
+shaped like lookit_trial_timing_info.csv. Every stage is then timed over
+the whole cohort, followed by an end-to-end run_analyze_output. Each size
+runs in its own process so the peak RSS recorded is that size's own.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --sizes 10 100 1000 --output baseline.json
+    python benchmarks/bench_pipeline.py --compare baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+SCENES = ['barrier-jump', 'barrier-nojump', 'nobarrier-jump']
+
+
+def make_child(rng, child_id, num_trials=8):
+    """
+    Returns (labels, confidence, timestamps, trial rows) for one synthetic
+    child of about num_trials minute-long trials
+    """
+    trial_ms = rng.integers(20000, 60000, size=num_trials)
+    gap_ms = rng.integers(2000, 4000, size=num_trials)
+    onsets = 3000 + np.concatenate([[0], np.cumsum(trial_ms + gap_ms)[:-1]])
+    offsets = onsets + trial_ms
+    length_ms = int(offsets[-1] + 5000)
+
+    # ~30 fps with jitter, and a few dropped-frame gaps of 100-400 ms
+    intervals = rng.normal(33.3, 4, size=length_ms // 30).clip(15, None)
+    drops = rng.random(len(intervals)) < 0.003
+    intervals[drops] += rng.integers(100, 400, size=drops.sum())
+    timestamps = np.concatenate([[0], np.cumsum(intervals)]).astype(np.int32)
+    timestamps = timestamps[timestamps < length_ms]
+    num_frames = len(timestamps)
+
+    # alternate long on looks and short off looks, in frames
+    runs = []
+    total = 0
+    on = True
+    while total < num_frames:
+        run = int(rng.geometric(1 / 90 if on else 1 / 20))
+        runs.append((on, run))
+        total += run
+        on = not on
+    labels = np.concatenate([np.full(n, rng.integers(1, 3) if state else 0) for state, n in runs])[:num_frames]
+    confidence = np.where(labels > 0, rng.beta(8, 2, size=num_frames), rng.beta(4, 3, size=num_frames))
+
+    trial_types = ['fam'] * (num_trials - 2) + ['testA', 'testB']
+    trials = pd.DataFrame({
+        'child_id': child_id,
+        'video_onset': '2022-03-12 19:22:32.880',
+        'trial_type': ['{}-{}'.format(t, SCENES[0]) for t in trial_types],
+        'relative_onset': onsets.astype(float),
+        'relative_offset': offsets.astype(float),
+        'fam_or_test': trial_types,
+        'scene': SCENES[0],
+        'trial_number': np.arange(1, num_trials + 1),
+    })
+    return labels, confidence, timestamps, trials
+
+
+def make_cohort(root, size, seed=0):
+    """
+    Writes a synthetic cohort of size children under root
+
+    rtype: List[string], the child IDs
+    """
+    from Scripts.timestamp_store import TimestampStore
+
+    rng = np.random.default_rng(seed)
+    icatcher_dir = root / 'iCatcherOutput'
+    icatcher_dir.mkdir()
+    store = TimestampStore(root / 'video_data')
+
+    child_ids, all_trials = [], []
+    for i in range(size):
+        child_id = 'SYN{:05d}'.format(i)
+        labels, confidence, timestamps, trials = make_child(rng, child_id)
+        np.savez_compressed(icatcher_dir / (child_id + '.npz'), labels, confidence)
+        store.put(child_id, timestamps, len(timestamps))
+        child_ids.append(child_id)
+        all_trials.append(trials)
+
+    pd.concat(all_trials, ignore_index=True).to_csv(root / 'lookit_trial_timing_info.csv')
+    return child_ids
+
+
+def timed(results, stage, function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    results[stage] = results.get(stage, 0.0) + time.perf_counter() - start
+    return value
+
+
+def bench_size(size):
+    """
+    Generates a cohort of size children and times each pipeline stage over
+    all of them, then the end-to-end run. Runs in a child process.
+
+    rtype: dict
+    """
+    import analyze_output as ao
+    from Scripts.trial_info import LookitTrialInfo
+    from Scripts.video import get_frame_information
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        os.chdir(root)
+
+        stages = {}
+        child_ids = timed(stages, 'make_cohort', make_cohort, root, size)
+
+        ao.ICATCHER_DIR = str(root / 'iCatcherOutput')
+        ao.VID_DIR = str(root / 'videos')
+        ao.TRIAL_INFO = LookitTrialInfo(root / 'lookit_trial_timing_info.csv')
+
+        for child_id in child_ids:
+            timestamps, _ = timed(stages, 'get_frame_information', get_frame_information,
+                                  ao.VID_DIR + '/' + child_id + '.mp4')
+            icatcher = timed(stages, 'read_convert_output', ao.read_convert_output,
+                             ao.ICATCHER_DIR + '/' + child_id + '.npz', timestamps)
+            trial_sets, df = timed(stages, 'get_trial_sets', ao.get_trial_sets, child_id)
+            timed(stages, 'assign_trial', ao.assign_trial, icatcher, trial_sets)
+            icatcher_times = timed(stages, 'get_on_off_times', ao.get_on_off_times, icatcher, trial_sets)
+            timed(stages, 'write_to_csv', ao.write_to_csv, 'stages_output.csv', child_id, icatcher_times,
+                  None, df['fam_or_test'], df['scene'], icatcher)
+
+        # fresh provider so the end-to-end run pays for loading trial timing too
+        ao.TRIAL_INFO = LookitTrialInfo(root / 'lookit_trial_timing_info.csv')
+        errors = timed(stages, 'run_analyze_output', ao.run_analyze_output, 'end_to_end_output.csv')
+
+    os.chdir(REPO_DIR)
+    return {
+        'children': size,
+        'failed_children': len(errors),
+        'wall_s': {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+    }
+
+
+def run_benchmarks(sizes):
+    """
+    Runs bench_size for every size in a fresh process
+
+    rtype: dict, the baseline to write out
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in sizes:
+        with context.Pool(1) as pool:
+            result = pool.apply(bench_size, (size,))
+        print('{:>5} children: {}'.format(size, json.dumps(result)))
+        results.append(result)
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': results,
+    }
+
+
+def compare(baseline, current):
+    """
+    Prints the ratio of current to baseline wall time for every stage and
+    size found in both
+    """
+    old = {r['children']: r for r in baseline['results']}
+    for result in current['results']:
+        if result['children'] not in old:
+            continue
+        before = old[result['children']]
+        print('{} children ({} -> {}):'.format(result['children'], baseline['commit'], current['commit']))
+        for stage, seconds in result['wall_s'].items():
+            if stage in before['wall_s'] and before['wall_s'][stage] > 0:
+                print('  {:<24} {:>9.4f}s -> {:>9.4f}s  x{:.2f}'.format(
+                    stage, before['wall_s'][stage], seconds, seconds / before['wall_s'][stage]))
+        print('  {:<24} {:>8.1f}MB -> {:>8.1f}MB'.format('peak_rss', before['peak_rss_mb'], result['peak_rss_mb']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark the looking-time pipeline on synthetic cohorts')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--output', default=None, help='write the results to this .json baseline')
+    parser.add_argument('--compare', default=None, help='.json baseline to compare the results against')
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.sizes)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(current, output_file, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            compare(json.load(baseline_file), current)
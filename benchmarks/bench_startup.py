@@ -0,0 +1,98 @@
+"""
+Checks that mcs.py starts fast: mcs.py --help and mcs.py status are timed
+in fresh interpreters against a bare python -c pass, and -X importtime is
+used to check that neither imports any of HEAVY_MODULES, which only the
+subcommands that need them should. Exits with 1 if either goes over
+BUDGET_MS on top of the interpreter's own startup or imports a heavy
+module; tests/test_startup.py runs the same checks.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 20 --budget_ms 50
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+MCS = str(REPO_DIR / 'mcs.py')
+
+# startup time mcs.py may add to a bare interpreter, in ms
+BUDGET_MS = 100
+
+# modules that must only be imported by the subcommands that use them
+HEAVY_MODULES = ('numpy', 'pandas', 'scipy', 'pyarrow')
+
+
+def time_command(args, runs, cwd):
+    """
+    Returns the median wall time of running python with args, in ms
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=cwd, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def import_times(args, cwd):
+    """
+    Runs python -X importtime with args and returns the top level modules
+    it imported, with their cumulative import time in ms
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.rstrip()
+        # nesting is shown by indentation, top level imports have one space
+        if not name.startswith('  '):
+            modules[name.strip()] = int(cumulative) / 1000
+    return modules
+
+
+def run_checks(runs, budget_ms):
+    """
+    Times mcs.py --help and mcs.py status in an empty folder and prints
+    the results
+
+    rtype: bool, whether every check passed
+    """
+    passed = True
+    with tempfile.TemporaryDirectory() as cwd:
+        baseline = time_command(['-c', 'pass'], runs, cwd)
+        print('python -c pass: {:.1f} ms'.format(baseline))
+
+        for args in [[MCS, '--help'], [MCS, 'status']]:
+            name = 'mcs.py ' + ' '.join(args[1:])
+            overhead = time_command(args, runs, cwd) - baseline
+            modules = import_times(args, cwd)
+            heavy = sorted({module.split('.')[0] for module in modules} & set(HEAVY_MODULES))
+            slowest = sorted(modules.items(), key=lambda item: -item[1])[:3]
+
+            ok = overhead <= budget_ms and not heavy
+            passed &= ok
+            print('{}: +{:.1f} ms over python (budget {} ms), imports {:.1f} ms, slowest {} {}'.format(
+                name, overhead, budget_ms, sum(modules.values()),
+                ', '.join('{} {:.1f} ms'.format(module, ms) for module, ms in slowest),
+                'ok' if ok else 'FAILED'))
+            if heavy:
+                print('  imports {}, which should be deferred to the subcommands'.format(', '.join(heavy)))
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='check mcs.py startup time against a budget')
+    parser.add_argument('--runs', type=int, default=10, help='runs of each command to take the median of')
+    parser.add_argument('--budget_ms', type=float, default=BUDGET_MS)
+    args = parser.parse_args()
+
+    sys.exit(0 if run_checks(args.runs, args.budget_ms) else 1)
@@ -1,2 +1,9 @@
-# This script creates a job array by listing all videos in a directory and
-# passing each video to 'single_video_icatcher.sh'
+#!/bin/bash
+# This script creates a job array over the videos listed in a manifest written by
+# 'python run_icatcher.py --manifest MANIFEST', passing each video to
+# run_icatcher_cluster.py. Submit with
+#   sbatch --array=0-[N-1]%[MAX_RUNNING] cluster_scripts/array_video_icatcher.sh MANIFEST
+#SBATCH --job-name=icatcher
+#SBATCH --output=icatcher_%A_%a.out
+
+python cluster_scripts/run_icatcher_cluster.py "$1"
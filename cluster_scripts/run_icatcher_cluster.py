@@ -1,20 +1,19 @@
+# This script runs iCatcher on one video of a job array. The videos are listed
+# one per line in a manifest written by run_icatcher.py --manifest, along with
+# the output directory and iCatcher command, and array task i
+# (SLURM_ARRAY_TASK_ID) runs the i-th video.
 import os
 import subprocess
+import sys
 
-vid_dir = '../../Desktop/TEMP_video'
-output_dir = '../../Desktop/Datavyu/iCatcherOutput'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import run_icatcher
 
-vid_path = vid_dir + '/' + video
-commands_list = [
-    "python", "icatcher.py",
-    "--source_type", "file",
-    vid_path,
-    "--show_output",
-    "--output_annotation", output_dir,
-    "--output_format", "raw_output",
-    "--on_off",
-    "--model", "icatcher+"
-]
+manifest_path = sys.argv[1]
+task_id = int(os.environ['SLURM_ARRAY_TASK_ID'])
 
-result = subprocess.run(commands_list)
+videos, output_dir, run_icatcher.icatcher_cmd = run_icatcher.read_slurm_manifest(manifest_path)
+vid_path = videos[task_id]
 
+result = subprocess.run(run_icatcher.icatcher_command(vid_path, output_dir))
+sys.exit(result.returncode)
@@ -1 +1,10 @@
+#!/bin/bash
 # This script is going to call run_icatcher once with specified video path
+#   bash cluster_scripts/single_video_icatcher.sh VIDEO_PATH [OUTPUT_DIR] [ICATCHER_COMMAND]
+# Each run writes its own temporary manifest, so several can run at once.
+manifest=$(mktemp "${TMPDIR:-/tmp}/single_video_manifest.XXXXXX")
+trap 'rm -f "$manifest"' EXIT
+if [ -n "$2" ]; then echo "# output_dir: $2" >> "$manifest"; fi
+if [ -n "$3" ]; then echo "# icatcher: $3" >> "$manifest"; fi
+echo "$1" >> "$manifest"
+SLURM_ARRAY_TASK_ID=0 python cluster_scripts/run_icatcher_cluster.py "$manifest"
@@ -1,107 +1,141 @@
-import pandas as pd
+import argparse
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-def convert(date_time):
-    s = pd.Series(pd.to_timedelta(date_time))
-    datetime_str = s.dt.total_seconds() * 1e3
-    return datetime_str
-
-def onset_offset_manual_lookit(manual_direc, manual_annotated_file, lookit_file):
-    """
-    params:
-    manual_annotated_file (str) - hand annotated file for one child
-    lookit_file (str) - lookit file containing all children
-    """
-    # load both files
-    lookit_df = pd.read_csv(lookit_file)
-    manual_df = pd.read_csv(os.path.join(manual_direc, manual_annotated_file))
-
-     # get child name - determines subset of lookit dataframe
-    file_split = manual_annotated_file.replace('.csv','').split('_')
-    child_name = file_split[1]
-
-
-    # specify column names
-    if file_split[-1] == 'AW':
-        trial_type = 'Trials_x'
-        trial_onset = 'Trials_onset'
-        trial_offset = 'Trials_offset'
-        trial_ordinal = "Trials_ordinal"
-
-    elif file_split[-1] == 'GS':
-        trial_type = 'Trials.x'
-        trial_onset = 'Trials.onset'
-        trial_offset = 'Trials.offset'
-        trial_ordinal = "Trials.ordinal"
-    
-    manual_df = manual_df.loc[(manual_df[trial_type] == 'f') | (manual_df[trial_type] == 't')]
-
-    if file_split[-1] == 'AW':
-        manual_df = manual_df.drop_duplicates(subset=[trial_onset])
-        manual_df = manual_df.assign(Index=range(len(manual_df))).set_index('Index')
-   
-    
-    # change format of lookit timestamps into milliseconds
-    lookit_df['relative_onset'] = convert(lookit_df['relative_onset'])
-    lookit_df['relative_offset'] = convert(lookit_df['relative_offset'])
-
-    # get length trial for lookit
-    lookit_df = lookit_df.assign(trial_length = lookit_df['relative_offset'] - lookit_df['relative_onset'])
-
-
-    
-    # get length trial for hand annotated
-    manual_df = manual_df.assign(trial_length = manual_df[trial_offset] - manual_df[trial_onset])
+import pandas as pd
 
-    # get lookit rows for only this child 
-    child_df = lookit_df.loc[lookit_df['child_id'] == child_name]
-    child_df = child_df.assign(Index=range(len(child_df))).set_index('Index')
+# Datavyu column names of each annotator's verbose export
+MANUAL_COLUMNS = {
+    'AW': {'type': 'Trials_x', 'onset': 'Trials_onset', 'offset': 'Trials_offset', 'ordinal': 'Trials_ordinal'},
+    'GS': {'type': 'Trials.x', 'onset': 'Trials.onset', 'offset': 'Trials.offset', 'ordinal': 'Trials.ordinal'},
+}
 
+OUTPUT_COLUMNS = ['child_name', 'same_num_trials', 'annotator',
+                  'manual_trial_onset', 'manual_trial_offset', 'manual_trial_ordinal',
+                  'trial_length', 'lookit_onset', 'lookit_offset',
+                  'lookit_trial_length', 'lookit_trial_length_diff',
+                  'lookit_onset_diff', 'lookit_offset_diff']
 
-    # add lookit info to finaldata
-    manual_df = manual_df.assign(lookit_onset = child_df['relative_onset'])
-    manual_df = manual_df.assign(lookit_offset = child_df['relative_offset'])
-    manual_df = manual_df.assign(lookit_trial_length = child_df['trial_length'])
 
-    # compute distance between trial length
-    manual_df = manual_df.assign(lookit_trial_length_diff = child_df['trial_length'] - manual_df['trial_length'])
-    
-    # compute distance between onsets 
-    manual_df = manual_df.assign(lookit_onset_diff = child_df['relative_onset'] - manual_df[trial_onset])
+def convert(date_time):
+    """
+    Returns a column of times in ms. Numbers are taken to be ms already,
+    as written by lookit_json_parser.py; anything else, e.g. '0 days
+    00:01:02.123', is parsed as a time delta.
 
+    rtype: Series
+    """
+    s = pd.Series(date_time)
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype(float)
+    return pd.to_timedelta(s).dt.total_seconds() * 1e3
 
-    # compute distance between offsets 
-    manual_df = manual_df.assign(lookit_offset_diff = child_df['relative_offset'] - manual_df[trial_offset]) 
-    
-    manual_df = manual_df.assign(manual_trial_onset = manual_df[trial_onset])
-    manual_df = manual_df.assign(manual_trial_offset = manual_df[trial_offset])
-    manual_df = manual_df.assign(manual_trial_ordinal = manual_df[trial_ordinal])
-    manual_df = manual_df[["manual_trial_onset","manual_trial_offset","manual_trial_ordinal",
-                        "trial_length","lookit_onset","lookit_offset", 
-                        "lookit_trial_length","lookit_trial_length_diff",
-                        "lookit_onset_diff", "lookit_offset_diff"]]
-    manual_df.insert(0,'child_name',child_name)
-    manual_df.insert(1,'same_num_trials',len(child_df)==len(manual_df))
-    manual_df.insert(2,'annotator',file_split[-1])
 
-    
+def read_manual_trials(manual_path):
+    """
+    Reads the fam and test trials of one hand annotated file, named
+    MCS_[CHILD_ID]_[SESSION]_verbose_[ANNOTATOR].csv
 
-    
-    
-    all_children.append(manual_df)
-   
+    manual_path (string): path to the Datavyu verbose .csv
+    rtype: DataFrame, one row per trial with child_name, annotator,
+            trial_index (order of the trial in the file), onset, offset
+            and ordinal
+    """
+    file_split = os.path.basename(manual_path).replace('.csv', '').split('_')
+    child_name, annotator = file_split[1], file_split[-1]
+    columns = MANUAL_COLUMNS[annotator]
 
+    manual_df = pd.read_csv(manual_path, usecols=list(columns.values()))
+    manual_df = manual_df[manual_df[columns['type']].isin(['f', 't'])]
 
+    # AW files repeat trial rows once per look
+    if annotator == 'AW':
+        manual_df = manual_df.drop_duplicates(subset=[columns['onset']])
 
-if __name__ == '__main__':
-    lookit_file = "lookit_trial_timing_info.csv"
-    manual_directory = 'InputFiles'
+    return pd.DataFrame({
+        'child_name': child_name,
+        'annotator': annotator,
+        'trial_index': range(len(manual_df)),
+        'manual_trial_onset': manual_df[columns['onset']].to_numpy(dtype=float),
+        'manual_trial_offset': manual_df[columns['offset']].to_numpy(dtype=float),
+        'manual_trial_ordinal': manual_df[columns['ordinal']].to_numpy(dtype=float),
+    })
 
-    all_children = []
-    for file in os.listdir(manual_directory):
-        if file.endswith('.csv'):
-            onset_offset_manual_lookit(manual_directory, file, lookit_file)
 
-    all_df = pd.concat(all_children)
+def compare_manual_lookit(manual_dir, lookit_file, workers=1, manifest=None):
+    """
+    Compares the trial onsets, offsets and lengths of every hand annotated
+    file in manual_dir with those logged by Lookit. The n-th fam/test trial
+    of a file is matched to the child's n-th trial in lookit_file.
+
+    manual_dir (string): folder of Datavyu verbose .csv files
+    lookit_file (string): trial timing of all children, from
+            lookit_json_parser.py
+    workers (int): number of processes to read the manual files in
+    manifest (Manifest): index with a 'manual' root at manual_dir to take
+            the files from instead of listing the folder, or None
+    rtype: DataFrame, one row per manual trial with the Lookit times and
+            the Lookit minus manual differences in ms
+    """
+    lookit_df = pd.read_csv(lookit_file)
+    lookit = pd.DataFrame({
+        'child_name': lookit_df['child_id'],
+        'trial_index': lookit_df.groupby('child_id').cumcount(),
+        'lookit_onset': convert(lookit_df['relative_onset']),
+        'lookit_offset': convert(lookit_df['relative_offset']),
+    })
+    lookit['lookit_trial_length'] = lookit['lookit_offset'] - lookit['lookit_onset']
+    lookit_trials = lookit.groupby('child_name').size().rename('lookit_num_trials')
+
+    if manifest is not None:
+        paths = [entry['path'] for entry in manifest.entries('manual')]
+    else:
+        paths = [os.path.join(manual_dir, f) for f in sorted(os.listdir(manual_dir)) if f.endswith('.csv')]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            manual = list(executor.map(read_manual_trials, paths))
+    else:
+        manual = [read_manual_trials(path) for path in paths]
+    manual = pd.concat(manual, ignore_index=True)
+
+    df = manual.merge(lookit, how='left', on=['child_name', 'trial_index'], validate='many_to_one')
+    manual_trials = df.groupby(['child_name', 'annotator'])['trial_index'].transform('size')
+    df['same_num_trials'] = df['child_name'].map(lookit_trials).fillna(0).to_numpy() == manual_trials.to_numpy()
+
+    df['trial_length'] = df['manual_trial_offset'] - df['manual_trial_onset']
+    df['lookit_trial_length_diff'] = df['lookit_trial_length'] - df['trial_length']
+    df['lookit_onset_diff'] = df['lookit_onset'] - df['manual_trial_onset']
+    df['lookit_offset_diff'] = df['lookit_offset'] - df['manual_trial_offset']
+
+    return df.set_index(pd.Index(df['trial_index'].to_numpy()))[OUTPUT_COLUMNS]
+
+
+def main(argv=None):
+    """
+    Command line entry point, also run by mcs.py compare-manual
 
-    all_df.to_csv("manual_lookit_comparison_both.csv")  
\ No newline at end of file
+    argv (List[string]): arguments, sys.argv[1:] if None
+    """
+    parser = argparse.ArgumentParser(description='compare hand annotated trial times with Lookit trial times')
+    parser.add_argument('--manual_dir', default='InputFiles')
+    parser.add_argument('--lookit_file', default='lookit_info/lookit_trial_timing_info.csv')
+    parser.add_argument('--output', default='lookit_info/manual_lookit_comparison_both.csv')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to read the manual files in')
+    parser.add_argument('--index', default=None, metavar='MANIFEST_JSON',
+                        help='.json index of input files to refresh and find the manual files in')
+    args = parser.parse_args(argv)
+
+    manifest = None
+    if args.index:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        from Scripts.manifest import Manifest
+        manifest = Manifest(args.index, {'manual': args.manual_dir})
+        manifest.refresh()
+    all_df = compare_manual_lookit(args.manual_dir, args.lookit_file, args.workers, manifest)
+    all_df.to_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,82 @@
-from datetime import datetime
-import pandas as pd
-from string import digits
+import argparse
 import json
-import numpy as np
+import re
+
+import pandas as pd
 
 iCatcher_dir = 'iCatcherOutput'
 
-def get_lookit_trial_times():
+def get_lookit_trial_times(json_path='lookit_info/BBB.json', stream=False):
+    """
+    Parses a Lookit response export into one row per fam/test trial with
+    its onset and offset, absolute and relative to the start of the video
+    recording.
 
-    f = open('lookit_info/BBB.json')
-    BBB_info = json.load(f)
+    Trial records are collected in a single pass over the sessions and the
+    DataFrame is built once at the end, with all time stamp parsing and
+    onset/offset arithmetic done on whole columns.
 
-    # dataframe in which info will be accumulated
-    trial_timing_info = pd.DataFrame()
+    json_path (string): path to the Lookit .json export, an array of sessions
+    stream (bool): if True, decode sessions from the file one at a time
+            instead of loading the whole array into memory first
+    rtype: DataFrame
+    """
+    records = []
 
-    for session_info in BBB_info:
+    for session_info in _iter_sessions(json_path, stream):
 
         # get key of recording start
         recording_start_key = [v for v in session_info['exp_data'].keys() if v.endswith('start-recording-with-image')]
 
         # only continue if this part of the dictionary has a 'start-recording-with-image' frame
-        if recording_start_key:
-            child_id = session_info['child']['hashed_id']
+        if not recording_start_key:
+            continue
 
-            # timestamp of start of recording
-            video_onset = datetime.fromisoformat(session_info['exp_data'][recording_start_key[0]]['eventTimings'][5]['timestamp'][0:-1])
+        child_id = session_info['child']['hashed_id']
 
-            # identify index of the trials we want: the first videoStarted, and last videoPaused
-            for key, value in session_info['exp_data'].items():
+        # timestamp of start of recording
+        video_onset = session_info['exp_data'][recording_start_key[0]]['eventTimings'][5]['timestamp']
 
-                # only consider fam and test trials, no attention getters (and no prematurely terminated trials)
-                if ('fam' in key or 'test' in key) and ('attention' not in key) and (len(value['eventTimings']) > 2):
-                    print(key)
+        # identify index of the trials we want: the first videoStarted, and last videoPaused
+        for key, value in session_info['exp_data'].items():
 
-                    eventTypes = [timestamp_type['eventType'] for timestamp_type in value['eventTimings']]
+            # only consider fam and test trials, no attention getters (and no prematurely terminated trials)
+            if not (('fam' in key or 'test' in key) and ('attention' not in key) and (len(value['eventTimings']) > 2)):
+                continue
 
-                    # get locations of videoStarted and videoPaused
-                    videoStartedIdx = ['videoStarted' in event for event in eventTypes]
-                    videoPausedIdx = ['videoPaused' in event for event in eventTypes]
+            start, end = None, None
+            for event in value['eventTimings']:
+                if start is None and 'videoStarted' in event['eventType']:
+                    start = event
+                if 'videoPaused' in event['eventType']:
+                    end = event
 
-                    # find first place where 'videoStarted' appears
-                    if any(videoStartedIdx):
-                        video_start_idx = np.where(videoStartedIdx)[0][0]
+            if start is not None and end is not None:
+                records.append({'child_id': child_id, 'video_onset': video_onset, 'trial_type': key,
+                                'absolute_onset': start['timestamp'],
+                                'absolute_offset': end['timestamp'],
+                                'trial_type_onset': start['eventType'],
+                                'trial_type_offset': end['eventType']})
 
-                    # find last place where 'videoPaused' appears
-                    if any(videoPausedIdx):
-                        video_end_idx = np.where(videoPausedIdx)[0][-1]
+    trial_timing_info = pd.DataFrame(records, columns=['child_id', 'video_onset', 'trial_type',
+                                                       'absolute_onset', 'absolute_offset',
+                                                       'trial_type_onset', 'trial_type_offset'])
 
-                    if any(videoStartedIdx) and any(videoPausedIdx):
-                        trial_timestamps = \
-                        [{'child_id': child_id, 'video_onset': video_onset, 'trial_type': key, \
-                                        'absolute_onset': datetime.fromisoformat(value['eventTimings'][video_start_idx]['timestamp'][0:-1]), \
-                                        'absolute_offset': datetime.fromisoformat(value['eventTimings'][video_end_idx]['timestamp'][0:-1]),
-                                        'trial_type_onset': eventTypes[video_start_idx],
-                                        'trial_type_offset': eventTypes[video_end_idx]}]
-
-                        trial_timing_info = trial_timing_info.append(pd.DataFrame(trial_timestamps))
+    # lookit time stamps are UTC ISO strings ending in 'Z'
+    for column in ['video_onset', 'absolute_onset', 'absolute_offset']:
+        trial_timing_info[column] = pd.to_datetime(trial_timing_info[column].str[:-1])
 
     # get trial onset/offset relative to onset of video recording
-    trial_timing_info['relative_onset'] = trial_timing_info['absolute_onset'] - trial_timing_info['video_onset'] 
-    trial_timing_info['relative_onset'] = trial_timing_info['relative_onset'].apply(lambda x: x.total_seconds() * 1000)
-
-    trial_timing_info['relative_offset'] = trial_timing_info['absolute_offset'] - trial_timing_info['video_onset'] 
-    trial_timing_info['relative_offset'] = trial_timing_info['relative_offset'].apply(lambda x: x.total_seconds() * 1000)
+    trial_timing_info['relative_onset'] = \
+        (trial_timing_info['absolute_onset'] - trial_timing_info['video_onset']).dt.total_seconds() * 1000
+    trial_timing_info['relative_offset'] = \
+        (trial_timing_info['absolute_offset'] - trial_timing_info['video_onset']).dt.total_seconds() * 1000
 
     # clean up trial type to be ready for parsing
-    trial_timing_info['trial_type'] = trial_timing_info['trial_type'].str.replace('\d+-', '')
+    trial_timing_info['trial_type'] = trial_timing_info['trial_type'].str.replace(r'\d+-', '', regex=True)
 
     # parse trial type into fam vs. test and scene
-    trial_timing_info[['fam_or_test', 'scene']] = trial_timing_info['trial_type'].str.split('-', 1, expand = True)
+    trial_timing_info[['fam_or_test', 'scene']] = trial_timing_info['trial_type'].str.split('-', n=1, expand=True)
 
     # sort whole df by trial onset
     trial_timing_info.sort_values(by='absolute_onset', inplace=True)
@@ -78,5 +86,119 @@ def get_lookit_trial_times():
 
     return trial_timing_info
 
-trial_timing_info = get_lookit_trial_times()
-trial_timing_info.to_csv('lookit_trial_timing_info.csv')
+
+def _iter_sessions(json_path, stream=False, chunk_size=1 << 16):
+    """
+    Yields the sessions of a Lookit export. When streaming, the top level
+    array is read in chunks and each chunk is scanned once for the brackets
+    and quotes that end the current session, which is then decoded in one
+    go, so a session spanning many chunks costs time linear in its size.
+    """
+    with open(json_path, 'r') as json_file:
+        if not stream:
+            yield from json.load(json_file)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = json_file.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError('{} does not contain a JSON array'.format(json_path))
+        pos = 1
+
+        while True:
+            # white space and the comma between sessions
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                buffer, pos = json_file.read(chunk_size), 0
+                if not buffer:
+                    raise ValueError('{} ends inside the JSON array'.format(json_path))
+                continue
+            if buffer[pos] == ']':
+                return
+
+            if buffer[pos] not in '{[':
+                # not a session object, short enough to decode by retrying
+                try:
+                    element, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    chunk = json_file.read(chunk_size)
+                    if not chunk:
+                        raise
+                    buffer, pos = buffer[pos:] + chunk, 0
+                    continue
+                yield element
+                continue
+
+            # collect the session's text up to its closing bracket
+            pieces, state, scan_from = [], [0, False, False], pos
+            end = _element_end(buffer, scan_from, state)
+            while end is None:
+                pieces.append(buffer[pos:])
+                buffer, pos, scan_from = json_file.read(chunk_size), 0, 0
+                if not buffer:
+                    raise ValueError('{} ends inside a session'.format(json_path))
+                end = _element_end(buffer, scan_from, state)
+            pieces.append(buffer[pos:end])
+            yield decoder.decode(''.join(pieces))
+            pos = end
+
+
+# white space and commas between the elements of an array
+_SEPARATORS = re.compile(r'[\s,]*')
+
+# characters that can end a nested value, outside and inside strings
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_STRING = re.compile(r'["\\]')
+
+
+def _element_end(text, pos, state):
+    """
+    Scans text from pos for the end of an object or array whose scan state
+    is [depth, in_string, escaped], carried over from earlier chunks.
+    Returns the index just after its closing bracket, or None if text ends
+    first, with state updated to continue from the next chunk.
+    """
+    depth, in_string, escaped = state
+    while True:
+        if escaped and pos < len(text):
+            # skip the escaped character
+            pos, escaped = pos + 1, False
+        match = (_STRING if in_string else _STRUCTURE).search(text, pos)
+        if match is None:
+            state[:] = [depth, in_string, escaped]
+            return None
+        char, pos = match.group(), match.end()
+        if in_string:
+            if char == '\\':
+                escaped = True
+            else:
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+def main(argv=None):
+    """
+    Command line entry point, also run by mcs.py parse-lookit
+
+    argv (List[string]): arguments, sys.argv[1:] if None
+    """
+    parser = argparse.ArgumentParser(description='parse trial timing out of a Lookit .json export')
+    parser.add_argument('json_path', nargs='?', default='lookit_info/BBB.json')
+    parser.add_argument('output', nargs='?', default='lookit_info/lookit_trial_timing_info.csv')
+    parser.add_argument('--stream', action='store_true',
+                        help='decode the export one session at a time')
+    args = parser.parse_args(argv)
+
+    trial_timing_info = get_lookit_trial_times(args.json_path, args.stream)
+    trial_timing_info.to_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+One command line for the whole pipeline:
+    python mcs.py run-icatcher          run iCatcher over videos without an output
+    python mcs.py probe VIDEO...        get frame time stamps into the store
+    python mcs.py parse-lookit          parse trial timing out of a Lookit export
+    python mcs.py compare-manual        compare hand annotated and Lookit trial times
+    python mcs.py analyze [OUTPUT]      compute looking times for all iCatcher outputs
+    python mcs.py status [OUTPUT]       show what has been run and what is left
+
+Each subcommand takes the same options as the script it runs, see
+python mcs.py COMMAND --help. Paths shared between subcommands can be set
+once in a .json config, mcs.json in the working folder if there is one, e.g.
+    {"vid_dir": "/nese/mit/group/saxelab/users/galraz/mcs/videos/BBB",
+     "icatcher_dir": "iCatcherOutput",
+     "icatcher": "python /path/to/icatcher.py",
+     "analyze": ["--workers", "8"]}
+Keys of CONFIG_FLAGS are passed to every subcommand that takes them, and a
+subcommand's own key holds extra arguments for it. Options given on the
+command line win over the config.
+
+Only the standard library is imported up front. A subcommand's script, and
+with it numpy, pandas and the rest, is imported when that subcommand runs,
+so --help and status start fast, see benchmarks/bench_startup.py.
+"""
+import argparse
+import csv
+import importlib
+import json
+import os
+import sqlite3
+import sys
+
+CONFIG_FILE = 'mcs.json'
+
+# subcommand -> module whose main(argv) runs it, None for those run here
+COMMANDS = {
+    'analyze': 'analyze_output',
+    'run-icatcher': 'run_icatcher',
+    'probe': 'Scripts.video',
+    'parse-lookit': 'lookit_info.lookit_json_parser',
+    'compare-manual': 'lookit_info.annotation_lookit',
+    'status': None,
+}
+
+# config key -> subcommand -> the option it is passed as
+CONFIG_FLAGS = {
+    'icatcher_dir': {'analyze': '--icatcher_dir', 'run-icatcher': '--output_dir', 'status': '--icatcher_dir'},
+    'vid_dir': {'analyze': '--vid_dir', 'run-icatcher': '--vid_dir', 'status': '--vid_dir'},
+    'video_data': {'analyze': '--video_data', 'probe': '--store', 'status': '--video_data'},
+    'trial_info': {'analyze': '--trial_info'},
+    'experiment_onsets_dir': {'analyze': '--experiment_onsets_dir'},
+    'manual_dir': {'compare-manual': '--manual_dir'},
+    'lookit_file': {'compare-manual': '--lookit_file'},
+    'index': {'analyze': '--index', 'run-icatcher': '--index', 'compare-manual': '--index', 'status': '--index'},
+    'icatcher': {'run-icatcher': '--icatcher'},
+}
+
+# config keys that are not paths, so are not made relative to the config file
+NON_PATH_KEYS = {'icatcher'}
+
+
+def read_config(config_path=None):
+    """
+    Reads a .json config, with relative paths made relative to the folder
+    the config is in
+
+    config_path (string): path to the config, or None for CONFIG_FILE if it
+            exists
+    rtype: dict, empty if there is no config
+    """
+    if config_path is None:
+        if not os.path.isfile(CONFIG_FILE):
+            return {}
+        config_path = CONFIG_FILE
+
+    with open(config_path, 'r') as config_file:
+        config = json.load(config_file)
+    unknown = [key for key in config if key not in CONFIG_FLAGS and key not in COMMANDS]
+    if unknown:
+        raise ValueError('unknown keys {} in {}, expected some of {}'.format(
+            unknown, config_path, list(CONFIG_FLAGS) + list(COMMANDS)))
+
+    base = os.path.dirname(os.path.abspath(config_path))
+    for key, value in config.items():
+        if key in CONFIG_FLAGS and key not in NON_PATH_KEYS and value and not os.path.isabs(value):
+            config[key] = os.path.normpath(os.path.join(base, value))
+    return config
+
+
+def config_args(config, command):
+    """
+    Returns the arguments config adds for a subcommand, to go before the
+    ones given on the command line
+
+    rtype: List[string]
+    """
+    args = []
+    for key, flags in CONFIG_FLAGS.items():
+        if config.get(key) is not None and command in flags:
+            args += [flags[command], str(config[key])]
+    return args + [str(arg) for arg in config.get(command, [])]
+
+
+def status(argv=None):
+    """
+    Prints how far the pipeline has got: videos without an iCatcher output,
+    videos with cached frame time stamps, and iCatcher outputs that are not
+    in the results yet. Only reads folder listings and the results file's
+    child IDs, without pandas.
+
+    argv (List[string]): arguments
+    """
+    parser = argparse.ArgumentParser(prog='mcs.py status', description='show what has been run and what is left')
+    parser.add_argument('data_filename', nargs='?', default='BBB_output.csv')
+    parser.add_argument('--icatcher_dir', default='iCatcherOutput')
+    parser.add_argument('--vid_dir', default=None)
+    parser.add_argument('--video_data', default='video_data')
+    parser.add_argument('--session', default=None)
+    parser.add_argument('--index', default=None, metavar='MANIFEST_JSON',
+                        help='.json index of input files to refresh and count inputs in')
+    args = parser.parse_args(argv)
+
+    vid_dir = args.vid_dir
+    if vid_dir and args.session:
+        vid_dir = os.path.join(vid_dir, 'session' + args.session)
+    video_data = args.video_data
+    if args.session:
+        video_data = os.path.join(video_data, 'session' + args.session)
+
+    if args.index:
+        from Scripts.manifest import Manifest
+        manifest = Manifest(args.index, {'icatcher': args.icatcher_dir, 'video': args.vid_dir,
+                                         'timestamps': args.video_data})
+        manifest.refresh()
+        outputs = set(manifest.children('icatcher'))
+        videos = set(manifest.children('video', args.session)) if args.vid_dir else None
+        stamped = set(manifest.children('timestamps', args.session))
+    else:
+        outputs = _children(args.icatcher_dir, ('.npz', '.txt'))
+        videos = _children(vid_dir, ('.mp4',)) if vid_dir else None
+        stamped = _children(video_data, ('.json',))
+
+    print('iCatcher outputs: {} in {}'.format(len(outputs), args.icatcher_dir))
+    if videos is not None:
+        print('videos: {} in {}, {} without an iCatcher output (mcs.py run-icatcher)'.format(
+            len(videos), vid_dir, len(videos - outputs)))
+        print('frame time stamps: {} of the videos in {}'.format(len(videos & stamped), video_data))
+    else:
+        print('frame time stamps: {} videos in {}'.format(len(stamped), video_data))
+
+    analyzed = _result_children(args.data_filename)
+    if analyzed is None:
+        print('results: no {} yet, {} iCatcher outputs to analyze (mcs.py analyze)'.format(
+            args.data_filename, len(outputs)))
+        return
+    errors_path = os.path.splitext(args.data_filename)[0] + '_errors.csv'
+    failed = (_result_children(errors_path) or set()) - analyzed
+    print('results: {} children in {}, {} iCatcher outputs not analyzed yet (mcs.py analyze)'.format(
+        len(analyzed), args.data_filename, len(outputs - analyzed - failed)))
+    if failed:
+        print('failed: {} children, see {}'.format(len(failed), errors_path))
+
+
+def _children(folder, suffixes):
+    """
+    Child IDs of the files in folder ending in one of suffixes, the way
+    run_icatcher.py's get_child_id reads them
+    """
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return set()
+    children = set()
+    for name in names:
+        if name.startswith('.') or not name.endswith(suffixes):
+            continue
+        child_id = name.split('.')[0]
+        if child_id.endswith('_annotation'):
+            child_id = child_id[:-len('_annotation')]
+        children.add(child_id)
+    return children
+
+
+def _result_children(data_filename):
+    """
+    Child IDs in a results file of any of the Scripts/results_sink.py kinds,
+    or None if it does not exist
+    """
+    if not os.path.exists(data_filename):
+        return None
+    suffix = os.path.splitext(data_filename)[1]
+    if suffix == '.parquet':
+        trials_dir = os.path.join(data_filename, 'trials')
+        return {child.split('=', 1)[1]
+                for session in _listdir(trials_dir) if session.startswith('session=')
+                for child in _listdir(os.path.join(trials_dir, session)) if child.startswith('child=')}
+    if suffix in ('.sqlite', '.db'):
+        connection = sqlite3.connect(data_filename)
+        try:
+            return {row[0] for row in connection.execute('SELECT DISTINCT child FROM results')}
+        except sqlite3.OperationalError:
+            return set()
+        finally:
+            connection.close()
+
+    with open(data_filename, 'r', newline='') as results_file:
+        return {row['child'] for row in csv.DictReader(results_file) if row.get('child')}
+
+
+def _listdir(folder):
+    try:
+        return os.listdir(folder)
+    except FileNotFoundError:
+        return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='mcs.py', description=__doc__.split('\n\n')[0].strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='options after COMMAND are passed on to it, see mcs.py COMMAND --help')
+    parser.add_argument('--config', default=None,
+                        help='.json config of shared paths, {} if it exists'.format(CONFIG_FILE))
+    parser.add_argument('command', choices=list(COMMANDS), metavar='COMMAND',
+                        help=', '.join(COMMANDS))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    command_args = config_args(read_config(args.config), args.command) + args.args
+    if COMMANDS[args.command] is None:
+        return status(command_args)
+    sys.argv[0] = 'mcs.py ' + args.command
+    return importlib.import_module(COMMANDS[args.command]).main(command_args)
+
+
+if __name__ == "__main__":
+    main()
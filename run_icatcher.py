@@ -1,44 +1,221 @@
+import argparse
+import json
 import os
 import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# change these to your video directory and output directory as needed 
+from Scripts.manifest import Manifest
+
+# change these to your video directory and output directory as needed
 vid_dir = '../TEMP_video'
 output_dir = '../Datavyu/iCatcherOutput'
 
+# command that runs iCatcher, the video path and options are added after it
+icatcher_cmd = ["python", "icatcher.py"]
+
+def get_child_id(filename):
+    """
+    Returns the child ID a video or iCatcher output file belongs to, e.g.
+    'ABC123' for 'ABC123.mp4', 'ABC123.npz' and 'ABC123_annotation.txt'
+    """
+    child_id = filename.split('.')[0]
+    if child_id.endswith('_annotation'):
+        child_id = child_id[:-len('_annotation')]
+    return child_id
+
+
+def get_todo(vid_dir, output_dir, manifest=None):
+    """
+    Returns the videos in vid_dir that do not already have an output in
+    output_dir, matching on exact child IDs
+
+    manifest (Manifest): index with 'video' and 'icatcher' roots at vid_dir
+            and output_dir to take the files from instead of listing the
+            folders, see Scripts/manifest.py, or None
+    rtype: List[string]
+    """
+    if manifest is not None:
+        done = set(manifest.children('icatcher'))
+        return sorted(os.path.relpath(entry['path'], vid_dir) for entry in manifest.entries('video')
+                      if entry['child'] not in done)
+    done = {get_child_id(f) for f in os.listdir(output_dir) if not f.startswith('.')}
+    return sorted(v for v in os.listdir(vid_dir) if not v.startswith('.') and get_child_id(v) not in done)
+
+
+def icatcher_command(vid_path, output_dir):
+    return icatcher_cmd + [
+        "--source_type", "file",
+        vid_path,
+        "--show_output",
+        "--output_annotation", output_dir,
+        "--output_format", "raw_output",
+        "--on_off",
+        "--model", "icatcher+"
+    ]
+
+
+class JobState:
+    """
+    Status of every video in a batch, saved to a .json file after each
+    change so an interrupted batch can be resumed. Each video maps to
+    {'status': 'running' | 'done' | 'failed', 'attempts': int,
+    'returncode': int}.
+
+    path (string): path to the .json file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as state_file:
+                self.jobs = json.load(state_file)
+
+    def is_done(self, video):
+        return self.jobs.get(video, {}).get('status') == 'done'
+
+    def update(self, video, **fields):
+        with self.lock:
+            self.jobs.setdefault(video, {'status': 'pending', 'attempts': 0, 'returncode': None}).update(fields)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(self.jobs, tmp_file, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+def run_jobs(videos, concurrency=4, retries=2, backoff=5.0, state_file='icatcher_jobs.json'):
+    """
+    Runs iCatcher over videos with up to concurrency iCatcher processes at
+    once. A failed video is retried up to retries more times, waiting
+    backoff seconds before the first retry and twice as long before each
+    next one. Videos marked done in state_file are skipped.
+
+    videos (List[string]): video file names in vid_dir
+    concurrency (int): number of iCatcher processes to run at once
+    retries (int): number of times to retry a failed video
+    backoff (float): seconds to wait before the first retry
+    state_file (string): path of the resumable job state .json file
+    rtype: JobState
+    """
+    state = JobState(state_file)
+    todo = [video for video in videos if not state.is_done(video)]
+
+    def run_one(video):
+        vid_path = vid_dir + '/' + video
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff * 2 ** (attempt - 1))
+
+            state.update(video, status='running', attempts=state.jobs.get(video, {}).get('attempts', 0) + 1)
+            result = subprocess.run(icatcher_command(vid_path, output_dir))
+            print("{}: the exit code was: {}".format(video, result.returncode))
+
+            if result.returncode == 0:
+                state.update(video, status='done', returncode=0)
+                return
+            state.update(video, status='failed', returncode=result.returncode)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_one, todo))
+
+    return state
+
+
+def write_slurm_manifest(videos, manifest_path):
+    """
+    Writes one video path per line for a SLURM array job, where array task
+    i runs iCatcher on the i-th video. The output directory and iCatcher
+    command come first, as '# output_dir: ...' and '# icatcher: ...'
+    lines, so the jobs write where this run would. Submit with
+        sbatch --array=0-[N-1]%[MAX_RUNNING] cluster_scripts/array_video_icatcher.sh [MANIFEST]
+
+    rtype: int, number of videos in the manifest
+    """
+    with open(manifest_path, 'w') as manifest:
+        manifest.write('# output_dir: {}\n'.format(os.path.abspath(output_dir)))
+        manifest.write('# icatcher: {}\n'.format(' '.join(icatcher_cmd)))
+        for video in videos:
+            manifest.write(os.path.abspath(vid_dir + '/' + video) + '\n')
+    return len(videos)
+
+
+def read_slurm_manifest(manifest_path):
+    """
+    Reads a manifest written by write_slurm_manifest. Manifests without the
+    '# key: value' lines, e.g. a bare list of videos, get this module's
+    output_dir and icatcher_cmd.
+
+    rtype: Tuple[List[string], string, List[string]], the video paths, the
+            output directory and the iCatcher command
+    """
+    videos, settings = [], {}
+    with open(manifest_path, 'r') as manifest:
+        for line in manifest.read().splitlines():
+            if line.startswith('#'):
+                key, _, value = line[1:].partition(':')
+                settings[key.strip()] = value.strip()
+            elif line.strip():
+                videos.append(line)
+    cmd = settings['icatcher'].split() if settings.get('icatcher') else icatcher_cmd
+    return videos, settings.get('output_dir') or output_dir, cmd
+
+
 def run_sequential():
     """
-    runs iCatcher over all the videos in vid_dir that do not 
+    runs iCatcher over all the videos in vid_dir that do not
     already have an output in output_dir. Writes each annotation
     file as [VIDEO_NAME]_annotation.txt to output_dir
     """
-    videos = [v for v in os.listdir(vid_dir)]
-    existing_outputs = [f for f in os.listdir(output_dir)]
+    run_jobs(get_todo(vid_dir, output_dir), concurrency=1)
+    print("finished running")
+
+
+def main(argv=None):
+    """
+    Command line entry point, also run by mcs.py run-icatcher
+
+    argv (List[string]): arguments, sys.argv[1:] if None
+    """
+    global vid_dir, output_dir, icatcher_cmd
 
-    def has_vid(name):
-        child_id = name.split('.')[0]
-        for f in existing_outputs:
-            if child_id in f:
-                return False
-        return True
+    parser = argparse.ArgumentParser(description='run iCatcher over all videos without an output yet')
+    parser.add_argument('--vid_dir', default=vid_dir)
+    parser.add_argument('--output_dir', default=output_dir)
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='number of iCatcher processes to run at once')
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--backoff', type=float, default=5.0,
+                        help='seconds to wait before the first retry, doubled for each next one')
+    parser.add_argument('--state_file', default='icatcher_jobs.json')
+    parser.add_argument('--manifest', default=None,
+                        help='write a SLURM array job manifest to this file instead of running')
+    parser.add_argument('--index', default=None, metavar='MANIFEST_JSON',
+                        help='.json index of input files to refresh and find videos and outputs in')
+    parser.add_argument('--icatcher', default=None,
+                        help='command that runs iCatcher, e.g. "python /path/to/icatcher.py"')
+    args = parser.parse_args(argv)
 
-    # filter out the videos that iCatcher has already run 
-    to_run = list(filter(has_vid, videos))
+    vid_dir, output_dir = args.vid_dir, args.output_dir
+    if args.icatcher:
+        icatcher_cmd = args.icatcher.split()
 
-    for video in to_run:
-        vid_path = vid_dir + '/' + video
-        commands_list = [
-            "python", "icatcher.py",
-            "--source_type", "file",
-            vid_path, 
-            "--show_output",
-            "--output_annotation", output_dir, 
-            "--output_format", "raw_output",
-            "--on_off", 
-            "--model", "icatcher+"
-        ]
-
-        result = subprocess.run(commands_list)
-        print("The exit code was: {}".format(result.returncode))
+    manifest = None
+    if args.index:
+        manifest = Manifest(args.index, {'video': vid_dir, 'icatcher': output_dir})
+        manifest.refresh()
+    todo = get_todo(vid_dir, output_dir, manifest)
+    if args.manifest:
+        num_videos = write_slurm_manifest(todo, args.manifest)
+        print('wrote {} videos to {}, submit with sbatch --array=0-{} cluster_scripts/array_video_icatcher.sh {}'.format(
+            num_videos, args.manifest, num_videos - 1, args.manifest))
+    else:
+        run_jobs(todo, args.concurrency, args.retries, args.backoff, args.state_file)
+        print("finished running")
 
-    print("finished running")
 
+if __name__ == "__main__":
+    main()
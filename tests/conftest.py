@@ -0,0 +1,46 @@
+import os
+import stat
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+
+def write_script(path, source):
+    """
+    Writes an executable Python script standing in for an external tool
+    """
+    path.write_text('#!{}\n'.format(sys.executable) + textwrap.dedent(source))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+@pytest.fixture
+def fake_ffprobe(tmp_path, monkeypatch):
+    """
+    Puts an ffprobe on PATH that reports 300 frames at 30 fps for any
+    video, prints garbage for videos with 'bad' in their name and fails for
+    videos with 'missing' in their name
+    """
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    write_script(bin_dir / 'ffprobe', '''
+        import sys
+        path = sys.argv[-1]
+        if 'missing' in path:
+            sys.exit(1)
+        if 'bad' in path:
+            print('garbage')
+            sys.exit(0)
+        if 'stream=nb_frames' in sys.argv:
+            print('300')
+        else:
+            for i in range(300):
+                print('{:.6f}'.format(i / 30))
+    ''')
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    return bin_dir / 'ffprobe'
@@ -0,0 +1,22 @@
+import json
+
+import pytest
+
+from lookit_info.lookit_json_parser import _iter_sessions
+
+
+def test_streamed_sessions_match_loaded(tmp_path):
+    sessions = [{'child': {'hashed_id': 'A'}, 'note': 'quotes \\" and ]}{[ in a string'},
+                {'child': {'hashed_id': 'B'}, 'exp_data': {'frames': [[1, 2], {'x': None}]}}, {}]
+    path = tmp_path / 'export.json'
+    path.write_text(json.dumps(sessions, indent=2))
+
+    for chunk_size in [1, 3, 7, 1 << 16]:
+        assert list(_iter_sessions(str(path), stream=True, chunk_size=chunk_size)) == sessions
+
+
+def test_truncated_export_raises(tmp_path):
+    path = tmp_path / 'export.json'
+    path.write_text('[{"child": {"hashed_id": "A"}}, {"child": ')
+    with pytest.raises(ValueError):
+        list(_iter_sessions(str(path), stream=True, chunk_size=4))
@@ -0,0 +1,57 @@
+import struct
+
+import numpy as np
+import pytest
+
+from Scripts import mp4_timestamps
+from Scripts.video import probe_frame_times
+
+
+def box(kind, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def make_mp4(num_frames=90, delta=1000, timescale=30000, stts_count=None, empty_mvhd=False):
+    """
+    Returns a minimal MP4 with one video track of num_frames frames delta
+    apart, the stts box claiming stts_count samples if given, and with an
+    mvhd box cut down to its header at the end of the moov if empty_mvhd
+    """
+    full = b'\0\0\0\0'
+    mvhd = box(b'mvhd', full + struct.pack('>IIII', 0, 0, 1000, 0) + b'\0' * 80)
+    mdhd = box(b'mdhd', full + struct.pack('>IIII', 0, 0, timescale, num_frames * delta) + b'\0' * 4)
+    hdlr = box(b'hdlr', full + b'\0\0\0\0' + b'vide' + b'\0' * 12)
+    stts = box(b'stts', full + struct.pack('>III', 1, num_frames if stts_count is None else stts_count, delta))
+    stsz = box(b'stsz', full + struct.pack('>II', 100, num_frames))
+    stbl = box(b'stbl', stts + stsz)
+    trak = box(b'trak', box(b'mdia', mdhd + hdlr + box(b'minf', stbl)))
+    moov = trak + box(b'mvhd') if empty_mvhd else mvhd + trak
+    return box(b'ftyp', b'isom\0\0\0\0') + box(b'moov', moov)
+
+
+def test_reads_frame_times(tmp_path):
+    path = tmp_path / 'A.mp4'
+    path.write_bytes(make_mp4())
+    frame_times, num_frames = mp4_timestamps.read_frame_times(str(path))
+    assert num_frames == 90
+    np.testing.assert_allclose(frame_times, np.round(np.arange(90) / 30, 6))
+
+
+@pytest.mark.parametrize('data', [
+    pytest.param(make_mp4()[:-6], id='truncated'),
+    pytest.param(make_mp4(empty_mvhd=True), id='empty_mvhd'),
+    pytest.param(make_mp4(stts_count=0xFFFFFFF0), id='corrupt_count'),
+    pytest.param(make_mp4(timescale=0), id='zero_timescale'),
+])
+def test_malformed_tables_raise_value_error(tmp_path, data):
+    path = tmp_path / 'A.mp4'
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        mp4_timestamps.read_frame_times(str(path))
+
+
+def test_auto_falls_back_to_ffprobe(tmp_path, fake_ffprobe):
+    path = tmp_path / 'A.mp4'
+    path.write_bytes(make_mp4()[:-6])
+    frame_times, num_frames = probe_frame_times(str(path), 'auto')
+    assert num_frames == 300 and len(frame_times) == 300
@@ -0,0 +1,101 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analyze_output
+from conftest import write_script
+from Scripts.prefetch import FramePrefetcher
+from Scripts.trial_info import LookitTrialInfo
+from Scripts.video import get_frame_information
+
+
+def write_videos(folder, child_ids):
+    folder.mkdir()
+    for child_id in child_ids:
+        # not an MP4, so 'auto' falls back to ffprobe
+        (folder / (child_id + '.mp4')).write_bytes(b'not an mp4')
+    return [str(folder / (child_id + '.mp4')) for child_id in child_ids]
+
+
+def test_prefetcher_hands_out_failed_video_as_not_found(tmp_path, fake_ffprobe):
+    paths = write_videos(tmp_path / 'videos', ['A', 'bad', 'B', 'C'])
+
+    with FramePrefetcher(paths, tmp_path / 'video_data', concurrency=2) as prefetcher:
+        results = list(prefetcher)
+
+    assert [vid_path for vid_path, _ in results] == paths
+    counts = {vid_path: (len(timestamps), num_frames) for vid_path, (timestamps, num_frames) in results}
+    assert counts[paths[1]] == (0, 0)
+    assert all(counts[path] == (300, 300) for path in paths if 'bad' not in path)
+
+
+def test_failed_prefetch_is_reported_for_its_child_only(tmp_path, fake_ffprobe, monkeypatch):
+    child_ids = ['A', 'bad', 'B']
+    write_videos(tmp_path / 'videos', child_ids)
+    icatcher_dir = tmp_path / 'iCatcherOutput'
+    icatcher_dir.mkdir()
+    trials = []
+    for child_id in child_ids:
+        labels = np.where(np.arange(300) % 60 < 40, 1, 0)
+        np.savez_compressed(icatcher_dir / (child_id + '.npz'), labels, np.full(300, 0.9))
+        trials.append(pd.DataFrame({'child_id': child_id, 'relative_onset': [500.0, 5000.0],
+                                    'relative_offset': [4000.0, 9000.0], 'fam_or_test': ['fam', 'test'],
+                                    'scene': 'barrier-jump'}))
+    pd.concat(trials).to_csv(tmp_path / 'trials.csv')
+
+    config = analyze_output.get_config()
+    monkeypatch.chdir(tmp_path)
+    analyze_output.configure({'ICATCHER_DIR': str(icatcher_dir), 'VID_DIR': str(tmp_path / 'videos'),
+                              'VIDEO_DATA_DIR': str(tmp_path / 'video_data'),
+                              'TRIAL_INFO': LookitTrialInfo(tmp_path / 'trials.csv')})
+    monkeypatch.setattr(analyze_output, 'PREFETCH', 2)
+    try:
+        errors = analyze_output.run_analyze_output(str(tmp_path / 'out.csv'))
+    finally:
+        analyze_output.configure(config)
+
+    assert list(errors['child']) == ['bad']
+    assert sorted(pd.read_csv(tmp_path / 'out.csv')['child'].unique()) == ['A', 'B']
+
+
+@pytest.mark.parametrize('mode', ['auto', 'frames', 'packets'])
+def test_prefetcher_matches_get_frame_information(tmp_path, fake_ffprobe, mode):
+    paths = write_videos(tmp_path / 'videos', ['A', 'B'])
+
+    with FramePrefetcher(paths, tmp_path / 'prefetched', mode=mode) as prefetcher:
+        results = dict(prefetcher)
+
+    for path in paths:
+        timestamps, num_frames = get_frame_information(path, tmp_path / 'probed', mode=mode)
+        np.testing.assert_array_equal(results[path][0], timestamps)
+        assert results[path][1] == num_frames == 300
+
+
+def test_closing_prefetcher_kills_ffprobe(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    pid_file = tmp_path / 'ffprobe.pid'
+    # an ffprobe that prints a time stamp, then hangs
+    write_script(bin_dir / 'ffprobe', '''
+        import os, sys, time
+        open({!r}, 'w').write(str(os.getpid()))
+        print('0.0', flush=True)
+        time.sleep(60)
+    '''.format(str(pid_file)))
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+    paths = write_videos(tmp_path / 'videos', ['A'])
+
+    prefetcher = FramePrefetcher(paths, tmp_path / 'video_data', mode='frames')
+    prefetcher.start()
+    deadline = time.monotonic() + 10
+    while not pid_file.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    start = time.monotonic()
+    prefetcher.close()
+
+    assert time.monotonic() - start < 5
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
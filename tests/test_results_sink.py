@@ -0,0 +1,90 @@
+import os
+
+import pandas as pd
+import pytest
+
+from Scripts import results_sink
+from Scripts.results_sink import CsvResultsSink, ParquetResultsSink
+
+
+def rows(child_id, trial_type, stim_type, num_trials=2):
+    return pd.DataFrame({'child': child_id, 'session': '1', 'trial_num': range(1, num_trials + 1),
+                         'trial_type': trial_type, 'stim_type': stim_type, 'confidence': 0.9,
+                         'iCatcher_on(s)': 1.5, 'iCatcher_off(s)': 0.5})
+
+
+@pytest.mark.parametrize('cut', [1, 0.5], ids=['after_complete_rows', 'inside_a_row'])
+def test_csv_drops_interrupted_block(tmp_path, cut):
+    path = tmp_path / 'out.csv'
+    sink = CsvResultsSink(path)
+    sink.append(rows('A', 'test', 'barrier-jump'))
+    sink.append(rows('B', 'test', 'barrier-jump'))
+    complete = path.read_bytes()
+
+    # a crash while appending C's block, leaving its first row or part of it
+    block = rows('C', 'test', 'barrier-jump', num_trials=3).set_axis(range(4, 7)).to_csv(header=False)
+    first_row = block[:block.index('\n') + 1]
+    with open(path, 'a') as output_file:
+        output_file.write(first_row[:int(len(first_row) * cut)])
+
+    sink = CsvResultsSink(path)
+    assert sink.ids == {'A', 'B'} and sink.num_rows == 4
+    assert path.read_bytes() == complete
+
+    # C is written again as a whole
+    sink.append(rows('C', 'test', 'barrier-jump', num_trials=3))
+    df = CsvResultsSink(path).read()
+    assert list(df.index) == list(range(7))
+    assert list(df['trial_num'][df['child'] == 'C']) == [1, 2, 3]
+
+
+def test_csv_keeps_file_replaced_since_last_append(tmp_path):
+    path = tmp_path / 'out.csv'
+    CsvResultsSink(path).append(rows('A', 'test', 'barrier-jump'))
+    replacement = tmp_path / 'other.csv'
+    CsvResultsSink(replacement).append(rows('B', 'test', 'barrier-jump', num_trials=5))
+    os.replace(replacement, path)
+
+    sink = CsvResultsSink(path)
+    assert sink.ids == {'B'} and sink.num_rows == 5
+
+
+def test_csv_append_survives_short_writes(tmp_path, monkeypatch):
+    write = os.write
+    # a write that stops after at most 7 bytes, as os.write may
+    monkeypatch.setattr(results_sink.os, 'write', lambda fd, data: write(fd, bytes(data[:7])))
+    sink = CsvResultsSink(tmp_path / 'out.csv')
+    sink.append(rows('A', 'test', 'barrier-jump'))
+    sink.append(rows('B', 'test', 'barrier-jump'))
+    monkeypatch.undo()
+
+    df = CsvResultsSink(tmp_path / 'out.csv').read()
+    assert list(df['child']) == ['A', 'A', 'B', 'B']
+
+
+def test_parquet_append_without_stimulus_info(tmp_path):
+    pytest.importorskip('pyarrow')
+    sink = ParquetResultsSink(tmp_path / 'results.parquet')
+    sink.append(rows('A', None, None))
+    sink.append(rows('B', 'test', 'barrier-jump'))
+
+    df = sink.read()
+    assert list(df['child']) == ['A', 'A', 'B', 'B']
+    assert df['trial_type'].isna().sum() == 2
+    assert list(df['stim_type'].dropna()) == ['barrier-jump', 'barrier-jump']
+
+
+def test_parquet_write_error_is_not_hidden_by_cleanup(tmp_path, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    def write_table(table, path):
+        # fails after removing its output, as a writer may
+        os.unlink(path)
+        raise OSError('disk full')
+
+    monkeypatch.setattr(pq, 'write_table', write_table)
+    sink = ParquetResultsSink(tmp_path / 'results.parquet')
+    with pytest.raises(OSError, match='disk full'):
+        sink.append(rows('A', 'test', 'barrier-jump'))
+    assert 'A' not in sink
+    assert not list((tmp_path / 'results.parquet').rglob('*.tmp'))
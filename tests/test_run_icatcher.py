@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import run_icatcher
+from conftest import REPO_DIR, write_script
+
+
+@pytest.fixture
+def stub_icatcher(tmp_path, monkeypatch):
+    """
+    Points run_icatcher at a stub iCatcher that writes
+    [VIDEO]_annotation.txt to its output folder. It always fails for videos
+    with 'broken' in their name, and fails the first run of videos with
+    'flaky' in their name.
+    """
+    stub = write_script(tmp_path / 'icatcher_stub.py', '''
+        import os, sys
+        args = sys.argv[1:]
+        vid_path = args[args.index('--source_type') + 2]
+        output_dir = args[args.index('--output_annotation') + 1]
+        name = os.path.basename(vid_path).split('.')[0]
+        if 'broken' in name:
+            sys.exit(3)
+        tried = os.path.join(output_dir, '.' + name + '_tried')
+        if 'flaky' in name and not os.path.exists(tried):
+            open(tried, 'w').close()
+            sys.exit(1)
+        with open(os.path.join(output_dir, name + '_annotation.txt'), 'w') as f:
+            f.write(vid_path)
+    ''')
+    vid_dir, output_dir = tmp_path / 'videos', tmp_path / 'output'
+    vid_dir.mkdir()
+    output_dir.mkdir()
+    for name in ['A', 'B', 'flaky', 'broken']:
+        (vid_dir / (name + '.mp4')).write_bytes(b'')
+    monkeypatch.setattr(run_icatcher, 'vid_dir', str(vid_dir))
+    monkeypatch.setattr(run_icatcher, 'output_dir', str(output_dir))
+    monkeypatch.setattr(run_icatcher, 'icatcher_cmd', [sys.executable, str(stub)])
+    return stub
+
+
+def test_run_jobs_retries_and_resumes(tmp_path, stub_icatcher):
+    state_file = str(tmp_path / 'jobs.json')
+    todo = run_icatcher.get_todo(run_icatcher.vid_dir, run_icatcher.output_dir)
+    assert todo == ['A.mp4', 'B.mp4', 'broken.mp4', 'flaky.mp4']
+
+    state = run_icatcher.run_jobs(todo, concurrency=2, retries=1, backoff=0, state_file=state_file)
+    assert {video: job['status'] for video, job in state.jobs.items()} == {
+        'A.mp4': 'done', 'B.mp4': 'done', 'flaky.mp4': 'done', 'broken.mp4': 'failed'}
+    assert state.jobs['flaky.mp4']['attempts'] == 2
+    assert state.jobs['broken.mp4'] == {'status': 'failed', 'attempts': 2, 'returncode': 3}
+    with open(state_file) as f:
+        assert json.load(f) == state.jobs
+
+    # only the failed video is left, and a resumed batch skips finished ones
+    assert run_icatcher.get_todo(run_icatcher.vid_dir, run_icatcher.output_dir) == ['broken.mp4']
+    state = run_icatcher.run_jobs(todo, concurrency=2, retries=0, backoff=0, state_file=state_file)
+    assert state.jobs['A.mp4']['attempts'] == 1
+    assert state.jobs['broken.mp4']['attempts'] == 3
+
+
+def test_array_job_writes_to_manifest_output_dir(tmp_path, stub_icatcher):
+    manifest = str(tmp_path / 'manifest.txt')
+    assert run_icatcher.write_slurm_manifest(['A.mp4', 'B.mp4'], manifest) == 2
+
+    videos, output_dir, cmd = run_icatcher.read_slurm_manifest(manifest)
+    assert [os.path.basename(video) for video in videos] == ['A.mp4', 'B.mp4']
+    assert output_dir == os.path.abspath(run_icatcher.output_dir)
+    assert cmd == run_icatcher.icatcher_cmd
+
+    # run from elsewhere, the job must still write to the manifest's output dir
+    result = subprocess.run([sys.executable, str(REPO_DIR / 'cluster_scripts' / 'run_icatcher_cluster.py'), manifest],
+                            cwd=str(tmp_path), env=dict(os.environ, SLURM_ARRAY_TASK_ID='1'))
+    assert result.returncode == 0
+    assert os.listdir(output_dir) == ['B_annotation.txt']
+
+
+def test_single_video_script(tmp_path, stub_icatcher):
+    script = str(REPO_DIR / 'cluster_scripts' / 'single_video_icatcher.sh')
+    command = '{} {}'.format(sys.executable, stub_icatcher)
+    runs = [subprocess.Popen(['bash', script, str(tmp_path / 'videos' / (name + '.mp4')), run_icatcher.output_dir,
+                              command], cwd=str(REPO_DIR), env=dict(os.environ, TMPDIR=str(tmp_path)))
+            for name in ['A', 'B']]
+    assert [run.wait() for run in runs] == [0, 0]
+    assert sorted(os.listdir(run_icatcher.output_dir)) == ['A_annotation.txt', 'B_annotation.txt']
+    # the temporary manifests are removed
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('single_video_manifest')]
@@ -0,0 +1,10 @@
+import sys
+
+from conftest import REPO_DIR
+
+sys.path.insert(0, str(REPO_DIR / 'benchmarks'))
+import bench_startup
+
+
+def test_mcs_startup_within_budget():
+    assert bench_startup.run_checks(runs=5, budget_ms=bench_startup.BUDGET_MS)
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analyze_output
+from Scripts.manifest import Manifest
+from Scripts.trial_info import LookitTrialInfo, ManualTrialInfo
+
+# trial onsets and offsets in ms of child A in each session
+SESSIONS = {'1': [(500, 4000), (5000, 9000)],
+            '2': [(1000, 3000), (4000, 6000), (7000, 9500)]}
+
+
+def write_trial_info(folder, child_id='A', sessions=SESSIONS):
+    """
+    Writes sub-[child_id]_session-[ID]_trial_info.csv for every session
+    """
+    folder.mkdir(exist_ok=True)
+    for session, trials in sessions.items():
+        pd.DataFrame({'onset': [onset for onset, _ in trials], 'offset': [offset for _, offset in trials],
+                      'fam_or_test': 'test', 'scene': 'barrier-jump'}).to_csv(
+            folder / 'sub-{}_session-{}_trial_info.csv'.format(child_id, session), index=False)
+
+
+def test_manual_trial_sets_per_session(tmp_path):
+    write_trial_info(tmp_path / 'trial_info')
+    trial_info = ManualTrialInfo(tmp_path / 'trial_info')
+
+    for session, trials in SESSIONS.items():
+        trial_sets, df = trial_info.get('A', session)
+        assert trial_sets == [list(trial) for trial in trials]
+        assert list(df['relative_onset']) == [onset for onset, _ in trials]
+    # without a session, session 1 is used
+    assert trial_info.get('A')[0] == trial_info.get('A', '1')[0]
+
+
+def test_manual_trial_sets_add_experiment_onset(tmp_path):
+    write_trial_info(tmp_path / 'trial_info')
+    onsets_dir = tmp_path / 'onsets'
+    onsets_dir.mkdir()
+    (onsets_dir / 'sub-A_session-1_experiment_onset.txt').write_text('-200')
+    (onsets_dir / 'sub-A_session-2_experiment_onset.txt').write_text('300')
+    trial_info = ManualTrialInfo(tmp_path / 'trial_info', onsets_dir)
+
+    assert trial_info.get('A', '1')[0] == [[300, 3800], [4800, 8800]]
+    assert trial_info.get('A', '2')[0] == [[1300, 3300], [4300, 6300], [7300, 9800]]
+
+    # a rewritten onset file is read again
+    (onsets_dir / 'sub-A_session-2_experiment_onset.txt').write_text('0')
+    assert trial_info.get('A', '2')[0] == [list(trial) for trial in SESSIONS['2']]
+
+
+def test_manual_trial_sets_from_manifest(tmp_path):
+    write_trial_info(tmp_path / 'trial_info')
+    manifest = Manifest(tmp_path / 'index.json', {'trial_info': tmp_path / 'trial_info'})
+    manifest.refresh()
+    # the manifest, not the folder, decides where the files are
+    trial_info = ManualTrialInfo(tmp_path / 'elsewhere', manifest=manifest)
+
+    for session, trials in SESSIONS.items():
+        assert trial_info.get('A', session)[0] == [list(trial) for trial in trials]
+    with pytest.raises(FileNotFoundError):
+        trial_info.get('A', '3')
+    with pytest.raises(FileNotFoundError):
+        trial_info.get('B', '1')
+
+
+def test_lookit_trial_sets_per_session(tmp_path):
+    rows = [{'child_id': 'A', 'session_id': int(session), 'relative_onset': onset, 'relative_offset': offset,
+             'fam_or_test': 'test', 'scene': 'barrier-jump'}
+            for session, trials in SESSIONS.items() for onset, offset in trials]
+    pd.DataFrame(rows).to_csv(tmp_path / 'trials.csv')
+    trial_info = LookitTrialInfo(tmp_path / 'trials.csv')
+
+    for session, trials in SESSIONS.items():
+        assert trial_info.get('A', session)[0] == [list(trial) for trial in trials]
+    trial_sets, df = trial_info.get('B', '1')
+    assert trial_sets == [] and len(df) == 0
+
+
+def test_lookit_trial_sets_without_sessions(tmp_path):
+    pd.DataFrame({'child_id': ['A', 'A', 'B'], 'relative_onset': [500.0, 5000.0, 100.0],
+                  'relative_offset': [4000.0, None, 900.0]}).to_csv(tmp_path / 'trials.csv')
+    trial_info = LookitTrialInfo(tmp_path / 'trials.csv')
+
+    # trials without an offset are skipped, the session is ignored
+    assert trial_info.get('A')[0] == [[500, 4000]]
+    assert trial_info.get('B', '2')[0] == [[100, 900]]
+
+
+def test_run_uses_trial_info_of_its_session(tmp_path, fake_ffprobe, monkeypatch):
+    write_trial_info(tmp_path / 'trial_info')
+    icatcher_dir = tmp_path / 'iCatcherOutput'
+    icatcher_dir.mkdir()
+    np.savez_compressed(icatcher_dir / 'A.npz', np.where(np.arange(300) % 60 < 40, 1, 0), np.full(300, 0.9))
+    (tmp_path / 'videos' / 'session2').mkdir(parents=True)
+    # not an MP4, so 'auto' falls back to ffprobe
+    (tmp_path / 'videos' / 'session2' / 'A.mp4').write_bytes(b'not an mp4')
+
+    config = analyze_output.get_config()
+    monkeypatch.chdir(tmp_path)
+    analyze_output.configure({'ICATCHER_DIR': str(icatcher_dir), 'VID_DIR': str(tmp_path / 'videos') + '/',
+                              'VIDEO_DATA_DIR': str(tmp_path / 'video_data'),
+                              'TRIAL_INFO': ManualTrialInfo(tmp_path / 'trial_info')})
+    try:
+        errors = analyze_output.run_analyze_output(str(tmp_path / 'out.csv'), session='2')
+    finally:
+        analyze_output.configure(config)
+
+    assert len(errors) == 0
+    rows = pd.read_csv(tmp_path / 'out.csv')
+    assert list(rows['trial_num']) == [1, 2, 3]
+    assert list(rows['session']) == [2, 2, 2]